@@ -0,0 +1,279 @@
+# Deterministic, in-process stand-ins for the OpenAI-compatible client (chat and
+# embeddings) and for Pinecone, so engine code paths can be measured without
+# network access. Latency and failures are injected from seeded distributions.
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from commons.sanitizer import get_default_sanitizer
+from commons.snapshot import LocalIndex
+from commons.tokens import estimate_tokens
+
+DEFAULT_DIMENSION = 1536
+
+
+class FakeAPIError(Exception):
+    """An upstream failure with an HTTP status code, like the SDK errors."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeRateLimitError(FakeAPIError):
+    def __init__(self, message="Rate limit reached (429)."):
+        super().__init__(message, status_code=429)
+
+
+class Latency:
+    """
+    A latency distribution in milliseconds: 'fixed', 'normal', 'lognormal' or
+    'uniform' around `mean_ms` with spread `jitter_ms`, plus `per_item_ms` for
+    every item in a batch (texts embedded, vectors upserted).
+    """
+
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, distribution="normal", per_item_ms=0.0, seed=0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.per_item_ms = per_item_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self, items=1):
+        with self._lock:
+            if not self.jitter_ms or self.distribution == "fixed":
+                base = self.mean_ms
+            elif self.distribution == "normal":
+                base = self._rng.gauss(self.mean_ms, self.jitter_ms)
+            elif self.distribution == "lognormal":
+                sigma2 = math.log(1 + (self.jitter_ms / self.mean_ms) ** 2) if self.mean_ms else 0.0
+                base = self._rng.lognormvariate(math.log(self.mean_ms or 1e-9) - sigma2 / 2, math.sqrt(sigma2))
+            elif self.distribution == "uniform":
+                base = self._rng.uniform(self.mean_ms - self.jitter_ms, self.mean_ms + self.jitter_ms)
+            else:
+                raise ValueError(f"Unknown latency distribution '{self.distribution}'.")
+        return max(0.0, base) + self.per_item_ms * items
+
+    def wait(self, items=1):
+        delay = self.sample_ms(items)
+        if delay:
+            time.sleep(delay / 1000)
+
+
+class Faults:
+    """Fails a share of calls: `rate_limit_rate` with a 429, `error_rate` with a 500."""
+
+    def __init__(self, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.injected = {"rate_limited": 0, "error": 0}
+
+    def check(self, operation):
+        if not self.error_rate and not self.rate_limit_rate:
+            return
+        with self._lock:
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                self.injected["rate_limited"] += 1
+                raise FakeRateLimitError(f"{operation}: rate limit reached (429).")
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.injected["error"] += 1
+                raise FakeAPIError(f"{operation}: internal server error (500).")
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def fake_embedding(text, dimension=DEFAULT_DIMENSION):
+    """A deterministic unit vector for a text: equal texts always embed equally."""
+    vector = np.random.default_rng(_seed(text)).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+_WORDS = ("mission", "orbit", "rover", "probe", "jupiter", "mars", "lunar", "module", "sample", "signal",
+          "instrument", "gravity", "magnetic", "field", "surface", "crew", "launch", "landing", "data", "system")
+_STYLE_INTENTS = (("suspense", "suspenseful narrative blueprint"), ("story", "suspenseful narrative blueprint"),
+                  ("casual", "casual summary style"), ("simple", "casual summary style"),
+                  ("technical", "technical explanation blueprint"), ("report", "technical explanation blueprint"))
+
+
+def default_plan(goal):
+    """
+    The plan a well-behaved planner would return: Librarian, Researcher and Writer,
+    plus a rewrite pass when the goal asks to rewrite the result.
+    """
+    lowered = goal.lower()
+    intent = next((intent for word, intent in _STYLE_INTENTS if word in lowered), "technical explanation blueprint")
+    plan = [
+        {"step": 1, "agent": "Librarian", "input": {"intent_query": intent}},
+        {"step": 2, "agent": "Researcher", "input": {"topic_query": goal}},
+        {"step": 3, "agent": "Writer", "input": {"blueprint": "$$STEP_1_OUTPUT$$", "facts": "$$STEP_2_OUTPUT$$"}},
+    ]
+    if "rewrite" in lowered or "then" in lowered:
+        plan += [
+            {"step": 4, "agent": "Librarian", "input": {"intent_query": "casual summary style"}},
+            {"step": 5, "agent": "Writer", "input": {"blueprint": "$$STEP_4_OUTPUT$$",
+                                                      "previous_content": "$$STEP_3_OUTPUT$$"}},
+        ]
+    return plan
+
+
+class _FakeChatCompletions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, response_format=None, **kwargs):
+        owner = self.owner
+        owner._count("chat")
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        owner.faults.check("chat.completions")
+        owner.chat_latency.wait()
+        if response_format and response_format.get("type") == "json_object":
+            if "Execution Plan" in system:
+                content = json.dumps(owner.plan_fn(user))
+            elif "sub_queries" in system or "sub-queries" in system:
+                content = json.dumps({"sub_queries": [user]})
+            else:
+                content = json.dumps({"result": "ok"})
+        else:
+            rng = random.Random(_seed(system + user))
+            content = " ".join(rng.choice(_WORDS) for _ in range(owner.completion_words))
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(system) + estimate_tokens(user),
+                                completion_tokens=estimate_tokens(content))
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=usage, model=model)
+
+
+class _FakeEmbeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, model, **kwargs):
+        owner = self.owner
+        texts = [input] if isinstance(input, str) else list(input)
+        owner._count("embeddings")
+        owner.faults.check("embeddings")
+        owner.embedding_latency.wait(len(texts))
+        data = [SimpleNamespace(embedding=fake_embedding(text, owner.dimension), index=i)
+                for i, text in enumerate(texts)]
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return SimpleNamespace(data=data, model=model, usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+
+class FakeOpenAI:
+    """
+    Stands in for the OpenAI client: `chat.completions.create` and `embeddings.create`.
+    JSON-mode planner prompts get a plan from `plan_fn(goal)`; text prompts get
+    `completion_words` deterministic words. `calls` counts requests by endpoint.
+    """
+
+    def __init__(self, chat_latency=None, embedding_latency=None, faults=None, dimension=DEFAULT_DIMENSION,
+                 completion_words=120, plan_fn=default_plan):
+        self.chat_latency = chat_latency or Latency()
+        self.embedding_latency = embedding_latency or Latency()
+        self.faults = faults or Faults()
+        self.dimension = dimension
+        self.completion_words = completion_words
+        self.plan_fn = plan_fn
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_FakeChatCompletions(self))
+        self.embeddings = _FakeEmbeddings(self)
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+
+class FakeIndex:
+    """A LocalIndex behind injected latency and failures, safe to call from many threads."""
+
+    def __init__(self, query_latency=None, upsert_latency=None, faults=None):
+        self.query_latency = query_latency or Latency()
+        self.upsert_latency = upsert_latency or Latency()
+        self.faults = faults or Faults()
+        self.calls = {"query": 0, "upsert": 0, "delete": 0}
+        self._index = LocalIndex()
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+    def query(self, vector, namespace="", top_k=10, include_metadata=False, **kwargs):
+        self._count("query")
+        self.faults.check("index.query")
+        self.query_latency.wait()
+        with self._lock:
+            return self._index.query(vector, namespace=namespace, top_k=top_k, include_metadata=include_metadata)
+
+    def upsert(self, vectors, namespace=""):
+        self._count("upsert")
+        self.faults.check("index.upsert")
+        self.upsert_latency.wait(len(vectors))
+        with self._lock:
+            return self._index.upsert(vectors, namespace=namespace)
+
+    def delete(self, ids=None, delete_all=False, namespace=""):
+        self._count("delete")
+        with self._lock:
+            return self._index.delete(ids=ids, delete_all=delete_all, namespace=namespace)
+
+    def describe_index_stats(self):
+        with self._lock:
+            return self._index.describe_index_stats()
+
+
+class FakePinecone:
+    """Stands in for the Pinecone client: one FakeIndex per index name."""
+
+    def __init__(self, dimension=DEFAULT_DIMENSION, **index_options):
+        self.dimension = dimension
+        self.index_options = index_options
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def Index(self, name):
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = FakeIndex(**self.index_options)
+            return self._indexes[name]
+
+    def create_index(self, name, dimension=None, metric="cosine", spec=None, **kwargs):
+        self.Index(name)
+
+    def list_indexes(self):
+        names = list(self._indexes)
+        return SimpleNamespace(names=lambda: names)
+
+    def describe_index(self, name):
+        return SimpleNamespace(name=name, dimension=self.dimension, status={"ready": True})
+
+
+def seed_index(index, context_blueprints, knowledge_texts, dimension=DEFAULT_DIMENSION,
+               namespace_context="ContextLibrary", namespace_knowledge="KnowledgeStore"):
+    """Loads blueprints and knowledge chunks into a fake index with fake embeddings."""
+    index.upsert([{"id": item["id"], "values": fake_embedding(item["description"], dimension),
+                   "metadata": {"description": item["description"], "blueprint_json": item["blueprint"]}}
+                  for item in context_blueprints], namespace=namespace_context)
+    vectors = []
+    rules = get_default_sanitizer().fingerprint
+    for i, text in enumerate(knowledge_texts):
+        words = re.findall(r"\S+", text)
+        vectors.append({"id": f"knowledge_chunk_{i}", "values": fake_embedding(text, dimension),
+                        "metadata": {"text": text, "source": f"doc_{i % 7}.txt", "token_count": len(words),
+                                     "sanitization": "clean", "sanitization_rules": rules}})
+    index.upsert(vectors, namespace=namespace_knowledge)
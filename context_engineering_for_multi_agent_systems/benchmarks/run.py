@@ -0,0 +1,253 @@
+# Offline benchmark scenarios over the fakes in benchmarks/fakes.py. Run from the
+# project directory:
+#   python -m benchmarks.run                        # every scenario, default settings
+#   python -m benchmarks.run --scenarios query_qps --llm-ms 400 --rate-limit-rate 0.02
+# Results are written as JSON (benchmarks/results/ by default) so runs can be compared.
+# Chunking and token counting still use tiktoken, whose encodings must be cached locally.
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from commons.batch import run_batch
+from commons.engine import context_engine
+from commons.helpers import query_pinecone
+from commons.metrics import get_registry, set_low_overhead
+
+from .fakes import FakeOpenAI, FakePinecone, Faults, Latency, seed_index
+
+INDEX_NAME = "benchmark-index"
+GENERATION_MODEL = "qwen-plus"
+EMBEDDING_MODEL = "text-embedding-v2"
+NAMESPACE_CONTEXT = "ContextLibrary"
+NAMESPACE_KNOWLEDGE = "KnowledgeStore"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+BENCHMARK_BLUEPRINTS = [
+    {"id": "blueprint_suspense_narrative", "description": "Suspenseful narrative blueprint for tense stories.",
+     "blueprint": json.dumps({"scene_goal": "Increase tension.", "style_guide": "Short, sharp sentences."})},
+    {"id": "blueprint_technical_explanation", "description": "Technical explanation blueprint for clear reports.",
+     "blueprint": json.dumps({"scene_goal": "Explain clearly.", "style_guide": "Objective and formal."})},
+    {"id": "blueprint_casual_summary", "description": "Casual summary style for easy-to-read summaries.",
+     "blueprint": json.dumps({"scene_goal": "Summarize casually.", "style_guide": "Informal and brief."})},
+]
+BENCHMARK_TOPICS = ["Apollo 11 landing", "Juno mission at Jupiter", "Perseverance rover sampling",
+                    "Ingenuity helicopter flights", "Voyager golden record", "Hubble servicing missions",
+                    "Cassini grand finale", "Artemis lunar program"]
+BENCHMARK_GOALS = [f"Write a technical report on the {topic}." for topic in BENCHMARK_TOPICS] + \
+                  [f"Write a suspenseful story about the {topic}, then rewrite it casually." for topic in BENCHMARK_TOPICS]
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"min": ordered[0], "p50": at(50), "p90": at(90), "p95": at(95), "p99": at(99), "max": ordered[-1],
+            "mean": sum(ordered) / len(ordered)}
+
+
+def knowledge_texts(count):
+    return [f"{BENCHMARK_TOPICS[i % len(BENCHMARK_TOPICS)]}: fact {i}. " + " ".join(
+        f"detail-{i}-{j}" for j in range(60)) for i in range(count)]
+
+
+def build_services(args):
+    """A fake client and Pinecone with a seeded index, configured from the CLI options."""
+    faults = Faults(error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    client = FakeOpenAI(chat_latency=Latency(args.llm_ms, args.llm_ms * args.jitter, "lognormal", seed=args.seed),
+                        embedding_latency=Latency(args.embed_ms, args.embed_ms * args.jitter, "lognormal",
+                                                  per_item_ms=args.embed_item_ms, seed=args.seed + 1),
+                        faults=faults, dimension=args.dimension)
+    pc = FakePinecone(dimension=args.dimension,
+                      query_latency=Latency(args.query_ms, args.query_ms * args.jitter, "lognormal", seed=args.seed + 2),
+                      upsert_latency=Latency(args.query_ms, args.query_ms * args.jitter, "lognormal",
+                                             per_item_ms=0.01, seed=args.seed + 3),
+                      faults=Faults(error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                    seed=args.seed + 4))
+    seed_index(pc.Index(INDEX_NAME), BENCHMARK_BLUEPRINTS, knowledge_texts(args.knowledge_chunks),
+               dimension=args.dimension)
+    return client, pc
+
+
+def _run_goal(goal, client, pc):
+    start = time.perf_counter()
+    result, trace = context_engine(goal, client=client, pc=pc, index_name=INDEX_NAME,
+                                   generation_model=GENERATION_MODEL, embedding_model=EMBEDDING_MODEL,
+                                   namespace_context=NAMESPACE_CONTEXT, namespace_knowledge=NAMESPACE_KNOWLEDGE)
+    return time.perf_counter() - start, trace
+
+
+def scenario_engine_run(args):
+    """Sequential context_engine runs: end-to-end latency and where it went."""
+    client, pc = build_services(args)
+    latencies, statuses, span_totals = [], {}, {}
+    for i in range(args.runs):
+        elapsed, trace = _run_goal(BENCHMARK_GOALS[i % len(BENCHMARK_GOALS)], client, pc)
+        latencies.append(elapsed)
+        statuses[trace.status] = statuses.get(trace.status, 0) + 1
+        for name, ms in trace.tracer.summary().items():
+            span_totals[name] = span_totals.get(name, 0.0) + ms
+    return {"runs": args.runs, "latency_seconds": percentiles(latencies), "statuses": statuses,
+            "span_ms_per_run": {name: ms / args.runs for name, ms in span_totals.items()},
+            "api_calls": dict(client.calls), "index_calls": dict(pc.Index(INDEX_NAME).calls)}
+
+
+def scenario_ingestion(args):
+    """Ingestion throughput through nasa_rag_pipeline.upsert_index into a fresh fake index."""
+    try:
+        from nasa_rag_pipeline import upsert_index
+    except ImportError as e:
+        return {"skipped": f"nasa_rag_pipeline could not be imported: {e}"}
+    from commons.ingestion import IngestionManifest
+
+    client, pc = build_services(args)
+    index = FakePinecone(dimension=args.dimension).Index("ingestion-benchmark")
+    body = "\n\n".join(knowledge_texts(args.doc_chunks))
+    corpus = {f"doc_{i}.txt": f"Document {i}.\n\n{body}" for i in range(args.docs)}
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = IngestionManifest(os.path.join(directory, "manifest.json"), EMBEDDING_MODEL)
+        start = time.perf_counter()
+        upsert_index(index, BENCHMARK_BLUEPRINTS, "", corpus, client, EMBEDDING_MODEL, manifest,
+                     namespace_context=NAMESPACE_CONTEXT, namespace_knowledge=NAMESPACE_KNOWLEDGE)
+        elapsed = time.perf_counter() - start
+    vectors = sum(ns.vector_count for ns in index.describe_index_stats().namespaces.values())
+    return {"documents": args.docs, "vectors": vectors, "seconds": elapsed,
+            "vectors_per_second": vectors / elapsed if elapsed else None,
+            "api_calls": dict(client.calls), "index_calls": dict(index.calls)}
+
+
+def scenario_query_qps(args):
+    """Retrieval throughput and latency through query_pinecone from `concurrency` threads."""
+    client, pc = build_services(args)
+    index = pc.Index(INDEX_NAME)
+    queries = [f"{BENCHMARK_TOPICS[i % len(BENCHMARK_TOPICS)]} detail {i}" for i in range(args.queries)]
+
+    def timed_query(query):
+        start = time.perf_counter()
+        matches = query_pinecone(query, NAMESPACE_KNOWLEDGE, 3, index, client, EMBEDDING_MODEL)
+        return time.perf_counter() - start, len(matches)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(timed_query, queries))
+    elapsed = time.perf_counter() - start
+    return {"queries": len(queries), "concurrency": args.concurrency, "seconds": elapsed,
+            "qps": len(queries) / elapsed if elapsed else None,
+            "latency_seconds": percentiles([latency for latency, _ in results]),
+            "empty_results": sum(1 for _, count in results if count == 0)}
+
+
+def scenario_concurrent_goals(args):
+    """Many goals at once through context_engine: throughput and tail latency under load."""
+    client, pc = build_services(args)
+    goals = [BENCHMARK_GOALS[i % len(BENCHMARK_GOALS)] for i in range(args.goals)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda goal: _run_goal(goal, client, pc), goals))
+    elapsed = time.perf_counter() - start
+    statuses = {}
+    for _, trace in results:
+        statuses[trace.status] = statuses.get(trace.status, 0) + 1
+    return {"goals": len(goals), "concurrency": args.concurrency, "seconds": elapsed,
+            "goals_per_second": len(goals) / elapsed if elapsed else None,
+            "latency_seconds": percentiles([latency for latency, _ in results]), "statuses": statuses,
+            "api_calls": dict(client.calls)}
+
+
+def scenario_batch(args):
+    """The concurrent_goals workload through run_batch: shared steps run once."""
+    client, pc = build_services(args)
+    goals = [BENCHMARK_GOALS[i % len(BENCHMARK_GOALS)] for i in range(args.goals)]
+    start = time.perf_counter()
+    results = run_batch(goals, client=client, pc=pc, index_name=INDEX_NAME, generation_model=GENERATION_MODEL,
+                        embedding_model=EMBEDDING_MODEL, namespace_context=NAMESPACE_CONTEXT,
+                        namespace_knowledge=NAMESPACE_KNOWLEDGE, max_workers=args.concurrency)
+    elapsed = time.perf_counter() - start
+    statuses = {}
+    for _, trace in results:
+        statuses[trace.status] = statuses.get(trace.status, 0) + 1
+    return {"goals": len(goals), "workers": args.concurrency, "seconds": elapsed,
+            "goals_per_second": len(goals) / elapsed if elapsed else None, "statuses": statuses,
+            "api_calls": dict(client.calls)}
+
+
+SCENARIOS = {
+    "engine_run": scenario_engine_run,
+    "ingestion": scenario_ingestion,
+    "query_qps": scenario_query_qps,
+    "concurrent_goals": scenario_concurrent_goals,
+    "batch": scenario_batch,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    results = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": _git_revision(),
+               "python": platform.python_version(), "settings": vars(args), "scenarios": {}}
+    for name in args.scenarios:
+        logging.warning(f"[Benchmark] Running scenario '{name}'...")
+        start = time.perf_counter()
+        results["scenarios"][name] = SCENARIOS[name](args)
+        results["scenarios"][name]["wall_seconds"] = time.perf_counter() - start
+    results["metrics"] = get_registry().snapshot()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the context engine.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", default=None, help="Result file (default: benchmarks/results/<timestamp>.json).")
+    parser.add_argument("--llm-ms", type=float, default=50.0, help="Mean chat completion latency.")
+    parser.add_argument("--embed-ms", type=float, default=10.0, help="Mean embedding request latency.")
+    parser.add_argument("--embed-item-ms", type=float, default=0.05, help="Extra embedding latency per text.")
+    parser.add_argument("--query-ms", type=float, default=5.0, help="Mean vector query latency.")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Latency spread as a fraction of the mean.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--goals", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--doc-chunks", type=int, default=5, help="Knowledge paragraphs per ingested document.")
+    parser.add_argument("--knowledge-chunks", type=int, default=200, help="Chunks preloaded into the query index.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the per-call INFO logging on.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        set_low_overhead(True)
+        logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmarks(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Benchmark results written to {output}")
+    for name, result in results["scenarios"].items():
+        print(f"  {name}: {json.dumps({k: v for k, v in result.items() if not isinstance(v, dict)}, default=str)}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
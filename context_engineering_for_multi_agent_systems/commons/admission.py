@@ -0,0 +1,354 @@
+# Admission control in front of the Context Engine. Goals wait in priority order
+# (interactive, then standard, then bulk) and are admitted while there is capacity:
+# a global concurrency limit, per-tenant caps, a share reserved away from bulk work
+# and an optional budget of estimated tokens in flight. When the upstream rate
+# limiter pushes back (recent 429s in commons/metrics.py), bulk work is held back
+# and standard work gets half the slots, so interactive latency stays flat.
+# Work that waits past its class's limit, or is displaced from a full queue by
+# higher-priority work, is shed.
+#
+#   controller = AdmissionController(max_concurrent=8, tenant_limits={"nightly": 2})
+#   with controller.admit(goal, tenant="nightly", priority="bulk"):
+#       context_engine(goal, ...)
+import contextlib
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from . import metrics
+from .tokens import estimate_tokens
+
+PRIORITY_CLASSES = {"interactive": 0, "standard": 1, "bulk": 2}
+DEFAULT_PRIORITY = "standard"
+DEFAULT_TENANT = "default"
+# Seconds a goal may wait for admission before it is shed; None waits indefinitely.
+DEFAULT_MAX_WAIT = {"interactive": None, "standard": 300.0, "bulk": 600.0}
+# Share of the concurrency limit bulk work may use, so interactive goals always find a slot.
+DEFAULT_BULK_SHARE = 0.5
+RATE_LIMIT_WINDOW = 30.0
+RATE_LIMIT_THRESHOLD = 3
+POLL_INTERVAL = 0.1
+
+# Tokens in the planner's fixed system prompt (instructions and examples), before capabilities.
+PLANNER_PROMPT_TOKENS = 900
+# Words that split a goal into sequential parts ("..., then rewrite it casually").
+_SEQUENCE_MARKERS = re.compile(r"\b(?:then|afterwards|rewrite|finally)\b|然后|接着|再|之后", re.IGNORECASE)
+
+_DECISIONS = metrics.get_registry().counter("admission_decisions_total", "Admission decisions by priority class.",
+                                            ["priority", "decision"])
+_WAIT = metrics.get_registry().histogram("admission_wait_seconds", "Time goals waited for admission.",
+                                         ["priority"])
+
+
+class AdmissionRejected(RuntimeError):
+    """Raised when a goal is shed instead of admitted. `reason` says why."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CostModel:
+    """
+    Estimates a goal's cost in tokens before it is planned: the planner prompt plus
+    the expected plan length times the tokens an average step uses. Both averages
+    are learned from finished runs (observe) as exponential moving averages.
+    """
+
+    def __init__(self, steps_per_part=3.0, tokens_per_step=1500.0, smoothing=0.2):
+        self.steps_per_part = steps_per_part
+        self.tokens_per_step = tokens_per_step
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def goal_parts(goal):
+        return 1 + len(_SEQUENCE_MARKERS.findall(goal))
+
+    def expected_steps(self, goal, plan=None):
+        if plan:
+            return len(plan)
+        return max(1, round(self.steps_per_part * self.goal_parts(goal)))
+
+    def estimate(self, goal, plan=None):
+        return int(PLANNER_PROMPT_TOKENS + estimate_tokens(goal) + self.expected_steps(goal, plan) * self.tokens_per_step)
+
+    def observe(self, trace):
+        """Updates the averages from a finished ExecutionTrace (its plan and llm.chat token counts)."""
+        if not trace.plan or trace.tracer is None:
+            return
+        tokens = sum(span.attributes.get("tokens_in", 0) + span.attributes.get("tokens_out", 0)
+                     for span in trace.tracer.spans if span.name == "llm.chat")
+        steps = len(trace.plan)
+        with self._lock:
+            a = self.smoothing
+            self.steps_per_part += a * (steps / self.goal_parts(trace.goal) - self.steps_per_part)
+            if tokens:
+                self.tokens_per_step += a * (tokens / steps - self.tokens_per_step)
+
+
+class RateLimitMonitor:
+    """
+    Reports saturation when `threshold` or more 429s were counted in the last
+    `window` seconds. Every failed LLM or embedding attempt is counted once in the
+    error counters; retries are not added, since each retry follows a counted error.
+    """
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, threshold=RATE_LIMIT_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self._samples = deque()
+
+    @staticmethod
+    def rate_limited_total():
+        total = 0
+        for counter in (metrics.LLM_ERRORS, metrics.EMBEDDING_ERRORS):
+            total += sum(value for key, value in counter.snapshot().items() if key.endswith(",rate_limited"))
+        return total
+
+    def saturated(self, now=None):
+        now = time.monotonic() if now is None else now
+        total = self.rate_limited_total()
+        self._samples.append((now, total))
+        while len(self._samples) > 1 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+        return total - self._samples[0][1] >= self.threshold
+
+
+class Ticket:
+    """A goal waiting for (or holding) admission."""
+
+    def __init__(self, seq, goal, tenant, priority, cost, on_admit, on_shed):
+        self.seq = seq
+        self.goal = goal
+        self.tenant = tenant
+        self.priority = priority
+        self.rank = PRIORITY_CLASSES[priority]
+        self.cost = cost
+        self.on_admit = on_admit
+        self.on_shed = on_shed
+        self.status = "waiting"
+        self.reason = None
+        self.submitted_at = time.monotonic()
+        self.admitted_at = None
+        self.settled = threading.Event()
+
+    @property
+    def wait_seconds(self):
+        return (self.admitted_at or time.monotonic()) - self.submitted_at
+
+
+class AdmissionController:
+    """
+    Admits goals in priority order under a concurrency limit (`max_concurrent`),
+    per-tenant caps (`tenant_limits`, else `default_tenant_limit`), a bulk share and
+    an optional `token_budget` of estimated tokens in flight. At most `max_waiting`
+    goals wait; a full queue sheds its newest lowest-priority goal to make room for
+    a higher-priority one, or rejects the newcomer.
+    """
+
+    def __init__(self, max_concurrent=4, max_waiting=64, tenant_limits=None, default_tenant_limit=None,
+                 bulk_share=DEFAULT_BULK_SHARE, token_budget=None, max_wait=None, cost_model=None,
+                 rate_limit_monitor=None, poll_interval=POLL_INTERVAL):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.tenant_limits = dict(tenant_limits or {})
+        self.default_tenant_limit = default_tenant_limit
+        self.bulk_limit = max(1, int(max_concurrent * bulk_share))
+        self.token_budget = token_budget
+        self.max_wait = dict(DEFAULT_MAX_WAIT, **(max_wait or {}))
+        self.cost_model = cost_model or CostModel()
+        self.monitor = rate_limit_monitor or RateLimitMonitor()
+        self.poll_interval = poll_interval
+        self._seq = itertools.count()
+        self._waiting = []
+        self._running = set()
+        self._condition = threading.Condition()
+        self._saturated = False
+        self._closed = False
+        self._timer = None
+        self.totals = {"admitted": 0, "shed": 0, "rejected": 0}
+
+    # --- submitting ---
+    def submit(self, goal, tenant=DEFAULT_TENANT, priority=DEFAULT_PRIORITY, on_admit=None, on_shed=None):
+        """
+        Queues a goal for admission and returns its Ticket. `on_admit(ticket)` is called
+        once it is admitted (from whichever thread admits it, so it must not block) and
+        `on_shed(ticket)` if it is shed later. Raises AdmissionRejected when it can't queue.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority '{priority}'; expected one of {list(PRIORITY_CLASSES)}.")
+        ticket = Ticket(next(self._seq), goal, tenant, priority, self.cost_model.estimate(goal), on_admit, on_shed)
+        with self._condition:
+            if self._closed:
+                raise AdmissionRejected("The admission controller is closed.")
+            shed = []
+            if len(self._waiting) >= self.max_waiting:
+                victim = max(self._waiting, key=lambda waiting: (waiting.rank, waiting.seq))
+                if victim.rank <= ticket.rank:
+                    self.totals["rejected"] += 1
+                    _DECISIONS.inc(priority=priority, decision="rejected")
+                    raise AdmissionRejected(f"The admission queue is full ({self.max_waiting} waiting).")
+                self._waiting.remove(victim)
+                shed.append(self._shed(victim, f"Displaced by {priority} work from a full queue."))
+            self._waiting.append(ticket)
+            self._start_timer()
+            settled = shed + self._dispatch()
+        self._notify(settled)
+        return ticket
+
+    @contextlib.contextmanager
+    def admit(self, goal, tenant=DEFAULT_TENANT, priority=DEFAULT_PRIORITY, timeout=None):
+        """Blocks until the goal is admitted and holds its slot for the block. Raises AdmissionRejected if shed."""
+        ticket = self.submit(goal, tenant, priority)
+        if not ticket.settled.wait(timeout) and self.cancel(ticket):
+            raise AdmissionRejected("Timed out waiting for admission.")
+        # Not withdrawn, so it was settled, possibly just after the timeout: admitted ones hold a slot.
+        if ticket.status != "admitted":
+            raise AdmissionRejected(ticket.reason or "Timed out waiting for admission.")
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def cancel(self, ticket):
+        """
+        Withdraws a ticket that is still waiting. Returns False if it was already
+        admitted or shed; an admitted ticket then holds a slot until released.
+        """
+        with self._condition:
+            if ticket not in self._waiting:
+                return False
+            self._waiting.remove(ticket)
+            ticket.status = "cancelled"
+            ticket.settled.set()
+            return True
+
+    def release(self, ticket, trace=None):
+        """Frees an admitted goal's slot. A finished trace, if given, refines the cost model."""
+        if trace is not None:
+            self.cost_model.observe(trace)
+        with self._condition:
+            self._running.discard(ticket)
+            ticket.status = "done"
+            settled = self._dispatch()
+            self._condition.notify_all()
+        self._notify(settled)
+
+    # --- scheduling ---
+    def _blocked_by(self, ticket, running_by_tenant, running_by_rank, tokens_in_flight):
+        """Why `ticket` can't be admitted now ('capacity' blocks every lower-priority ticket too), or None."""
+        tenant_limit = self.tenant_limits.get(ticket.tenant, self.default_tenant_limit)
+        if tenant_limit is not None and running_by_tenant.get(ticket.tenant, 0) >= tenant_limit:
+            return "tenant"
+        if len(self._running) >= self.max_concurrent:
+            return "capacity"
+        if ticket.priority == "bulk" and (self._saturated or running_by_rank.get(ticket.rank, 0) >= self.bulk_limit):
+            return "class"
+        if ticket.priority == "standard" and self._saturated and \
+                running_by_rank.get(ticket.rank, 0) >= max(1, self.max_concurrent // 2):
+            return "class"
+        if self.token_budget and self._running and tokens_in_flight + ticket.cost > self.token_budget:
+            return "capacity"
+        return None
+
+    def _dispatch(self):
+        # Called with the condition held. Admits what fits, in priority order, and sheds expired waiters.
+        now = time.monotonic()
+        self._saturated = self.monitor.saturated(now)
+        running_by_tenant, running_by_rank = {}, {}
+        for running in self._running:
+            running_by_tenant[running.tenant] = running_by_tenant.get(running.tenant, 0) + 1
+            running_by_rank[running.rank] = running_by_rank.get(running.rank, 0) + 1
+        tokens_in_flight = sum(running.cost for running in self._running)
+        admitted, shed = [], []
+        for ticket in sorted(self._waiting, key=lambda waiting: (waiting.rank, waiting.seq)):
+            max_wait = self.max_wait.get(ticket.priority)
+            if max_wait is not None and now - ticket.submitted_at > max_wait:
+                self._waiting.remove(ticket)
+                shed.append(self._shed(ticket, f"Waited over {max_wait:.0f}s for admission."))
+                continue
+            reason = self._blocked_by(ticket, running_by_tenant, running_by_rank, tokens_in_flight)
+            if reason == "capacity":
+                break
+            if reason is not None:
+                continue
+            self._waiting.remove(ticket)
+            self._running.add(ticket)
+            ticket.status = "admitted"
+            ticket.admitted_at = now
+            running_by_tenant[ticket.tenant] = running_by_tenant.get(ticket.tenant, 0) + 1
+            running_by_rank[ticket.rank] = running_by_rank.get(ticket.rank, 0) + 1
+            tokens_in_flight += ticket.cost
+            self.totals["admitted"] += 1
+            admitted.append(ticket)
+        return admitted + shed
+
+    def _shed(self, ticket, reason):
+        ticket.status = "shed"
+        ticket.reason = reason
+        self.totals["shed"] += 1
+        logging.warning(f"[准入控制] Shed a {ticket.priority} goal from tenant '{ticket.tenant}': {reason}")
+        return ticket
+
+    def _notify(self, settled):
+        # Callbacks run outside the lock, so they may submit or release other goals.
+        for ticket in settled:
+            if ticket.status == "admitted":
+                _DECISIONS.inc(priority=ticket.priority, decision="admitted")
+                _WAIT.observe(ticket.wait_seconds, priority=ticket.priority)
+                if ticket.on_admit:
+                    ticket.on_admit(ticket)
+            else:
+                _DECISIONS.inc(priority=ticket.priority, decision="shed")
+                if ticket.on_shed:
+                    ticket.on_shed(ticket)
+            ticket.settled.set()
+
+    def _start_timer(self):
+        # Waiters also move on without a release: saturation clears, or a wait limit passes.
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._tick, name="admission-timer", daemon=True)
+            self._timer.start()
+
+    def _tick(self):
+        while True:
+            with self._condition:
+                self._condition.wait(self.poll_interval)
+                if self._closed and not self._waiting:
+                    return
+                settled = self._dispatch() if self._waiting else []
+                if settled:
+                    self._condition.notify_all()
+            self._notify(settled)
+
+    # --- status ---
+    def status(self):
+        with self._condition:
+            waiting = {name: 0 for name in PRIORITY_CLASSES}
+            running = {name: 0 for name in PRIORITY_CLASSES}
+            tenants = {}
+            for ticket in self._waiting:
+                waiting[ticket.priority] += 1
+            for ticket in self._running:
+                running[ticket.priority] += 1
+                tenants[ticket.tenant] = tenants.get(ticket.tenant, 0) + 1
+            return {"waiting": waiting, "running": running, "running_by_tenant": tenants,
+                    "tokens_in_flight": sum(ticket.cost for ticket in self._running),
+                    "saturated": self._saturated, "max_concurrent": self.max_concurrent,
+                    "max_waiting": self.max_waiting, "totals": dict(self.totals)}
+
+    def drain(self, timeout=None):
+        """Stops accepting goals and waits until the queued and running ones finish. Returns True if idle."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._closed = True
+            while self._waiting or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining if remaining is not None else self.poll_interval)
+            return True
@@ -1,40 +1,159 @@
 from .helpers import (
     create_mcp_message,
-    call_llm_robust, query_pinecone, helper_sanitize_input)
+    call_llm_robust, query_pinecone, query_pinecone_by_vector, get_embeddings)
+from .sanitizer import get_default_sanitizer, SanitizationVerdict
+from .mcp import MCPMessage, MCP_KEYS
+from .replay import ReplayMissError
 from .utils import initialize_clients
+from .tokens import count_tokens, split_text
+from .tracing import in_current_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import APIError
+from tenacity import RetryError
 import json
 import logging
+import re
 
 
-def researcher_agent(mcp_message, client, index, generation_model, embedding_model, namespace_knowledge):
+# Independent clauses ("Juno's instruments; Cassini's findings") and the items of an
+# explicit list ("Juno, Cassini and Voyager 2", "朱诺号、卡西尼号和旅行者2号").
+_TOPIC_CLAUSE_SEPARATORS = re.compile(r"\s*[;；]\s*")
+_TOPIC_LIST_SEPARATORS = re.compile(r"\s*[,，、]\s*")
+# A CJK conjunction must follow another character, so an item like "和平号" stays whole.
+_TOPIC_LAST_ITEM_CONJUNCTION = re.compile(r"^(?:and|or)\s+|\s+(?:and|or)\s+|(?<=.)(?:以及|和|与|及|或)",
+                                          re.IGNORECASE)
+RESEARCH_MIN_LIST_ITEMS = 3
+RESEARCH_MAX_SUB_QUERIES = 4
+RESEARCH_TOP_K_PER_QUERY = 3
+RESEARCH_MAX_CHUNKS = 6
+
+
+def split_topic_query(topic, max_sub_queries=RESEARCH_MAX_SUB_QUERIES):
+    """
+    A cheap local heuristic that splits a topic into sub-queries, used when the
+    Researcher runs with sub_query_mode="heuristic". The full topic always comes
+    first. It only splits independent clauses (separated by ';') and explicit lists
+    of at least RESEARCH_MIN_LIST_ITEMS items ("Juno, Cassini and Voyager 2"); a
+    lone "and" joins one noun phrase, and no fragment borrows words from another.
+    """
+    clauses = [clause for clause in _TOPIC_CLAUSE_SEPARATORS.split(topic.strip()) if clause]
+    if len(clauses) > 1:
+        parts = clauses
+    else:
+        parts = [item for item in _TOPIC_LIST_SEPARATORS.split(topic.strip()) if item]
+        if len(parts) > 1:
+            # The conjunction before the last item ("..., Cassini and Voyager 2") ends the list.
+            parts[-1:] = [item for item in _TOPIC_LAST_ITEM_CONJUNCTION.split(parts[-1], maxsplit=1) if item]
+        if len(parts) < RESEARCH_MIN_LIST_ITEMS:
+            parts = []
+    sub_queries = [topic]
+    for part in parts:
+        if part not in sub_queries:
+            sub_queries.append(part)
+    return sub_queries[:max_sub_queries]
+
+
+def split_topic_query_llm(topic, client, generation_model, max_sub_queries=RESEARCH_MAX_SUB_QUERIES):
+    """Asks the LLM, in one small JSON call, for focused sub-queries covering the topic."""
+    system_prompt = f"""Split the research topic into at most {max_sub_queries - 1} short, self-contained 
+        search queries that together cover it. Respond with JSON: {{"sub_queries": ["...", "..."]}}"""
+    try:
+        response = json.loads(call_llm_robust(system_prompt, topic, client=client,
+                                              generation_model=generation_model, json_mode=True))
+        sub_queries = [topic] + [q for q in response.get("sub_queries", []) if isinstance(q, str) and q != topic]
+        return sub_queries[:max_sub_queries]
+    except ReplayMissError:
+        raise
+    except Exception as e:
+        logging.warning(f"[Researcher] LLM topic split failed, searching the whole topic instead: {e}")
+        return [topic]
+
+
+def retrieve_for_sub_queries(sub_queries, index, client, embedding_model, namespace,
+                             top_k=RESEARCH_TOP_K_PER_QUERY, max_chunks=RESEARCH_MAX_CHUNKS):
+    """
+    Embeds all sub-queries in one batched call, queries them concurrently, and
+    merges the matches: duplicates keep their best score, the best `max_chunks` win.
+    """
+    if not sub_queries:
+        return []
+    try:
+        embeddings = get_embeddings(sub_queries, client, embedding_model)
+    except ReplayMissError:
+        raise
+    except Exception as e:
+        logging.error(f"[Researcher] Embedding sub-queries failed: {e}")
+        return []
+    with ThreadPoolExecutor(max_workers=len(embeddings)) as pool:
+        result_sets = list(pool.map(
+            in_current_context(lambda embedding: query_pinecone_by_vector(embedding, namespace, top_k, index)),
+            embeddings))
+    merged = {}
+    for matches in result_sets:
+        for match in matches:
+            best = merged.get(match['id'])
+            if best is None or match['score'] > best['score']:
+                merged[match['id']] = match
+    return sorted(merged.values(), key=lambda match: match['score'], reverse=True)[:max_chunks]
+
+
+def researcher_agent(mcp_message, client, index, generation_model, embedding_model, namespace_knowledge,
+                     sub_query_mode="off"):
     """
    Retrieves and synthesizes factual information from the Knowledge Base.
+   With sub_query_mode "llm" or "heuristic", broad topics are fanned out into
+   sub-queries that are retrieved together and synthesized in a single prompt;
+   by default ("off") the topic is searched as given.
    """
     logging.info("\n[Researcher] Activated. Investigating topic...")
     try:
         topic = mcp_message['content']['topic_query']
         if not topic:
             raise ValueError("Researcher requires 'topic_query' in the input content.")
+        if sub_query_mode == "llm":
+            sub_queries = split_topic_query_llm(topic, client, generation_model)
+        elif sub_query_mode == "heuristic":
+            sub_queries = split_topic_query(topic)
+        else:
+            sub_queries = [topic]
         # Query Pinecone Knowledge Namespace
-        results = query_pinecone(query_text=topic, namespace=namespace_knowledge,
-                                 top_k=3, index=index, client=client, embedding_model=embedding_model)
+        if len(sub_queries) > 1:
+            logging.info(f"[Researcher] Fanning out into {len(sub_queries)} sub-queries: {sub_queries}")
+            results = retrieve_for_sub_queries(sub_queries, index, client, embedding_model, namespace_knowledge)
+        else:
+            results = query_pinecone(query_text=topic, namespace=namespace_knowledge,
+                                     top_k=RESEARCH_TOP_K_PER_QUERY, index=index, client=client,
+                                     embedding_model=embedding_model)
         if not results:
             logging.warning("[Researcher] No relevant information found.")
             return create_mcp_message("Researcher", {"answer": "No data found on the topic.", "sources": []})
 
         # Sanitize and Prepare Source Texts
+        # Chunks ingested with enrichment carry a precomputed sanitization verdict and
+        # token count. Chunks without one, or whose verdict came from a different rule
+        # set than the active one, are scanned together in a single batch.
+        sanitizer = get_default_sanitizer()
+        unscanned = [match for match in results
+                     if 'sanitization' not in match['metadata']
+                     or match['metadata'].get('sanitization_rules') != sanitizer.fingerprint]
+        verdicts = dict(zip((id(match) for match in unscanned),
+                            sanitizer.sanitize_many([m['metadata']['text'] for m in unscanned])))
         sanitized_texts = []
         sources = set()
+        source_tokens = 0
         for match in results:
-            try:
-                clean_text = helper_sanitize_input(
-                    match['metadata']['text'])
-                sanitized_texts.append(clean_text)
-                if 'source' in match['metadata']:
-                    sources.add(match['metadata']['source'])
-            except ValueError as e:
-                logging.warning(f"[Researcher] A retrieved chunk failed sanitization and was skipped.Reason: {e}")
+            metadata = match['metadata']
+            verdict = verdicts.get(id(match))
+            if verdict is None:
+                verdict = SanitizationVerdict(metadata['sanitization'] == "clean", metadata.get('sanitization_rule'))
+            if not verdict.clean:
+                logging.warning(f"[Researcher] A retrieved chunk failed sanitization and was skipped."
+                                f"Reason: potential threat detected with pattern '{verdict.rule}'.")
                 continue
+            sanitized_texts.append(metadata['text'])
+            source_tokens += int(metadata.get('token_count', 0))
+            if 'source' in metadata:
+                sources.add(metadata['source'])
 
         if not sanitized_texts:
             logging.error("[Researcher] All retrieved chunks failed sanitization.Aborting.")
@@ -43,7 +162,8 @@ def researcher_agent(mcp_message, client, index, generation_model, embedding_mod
                                                 "sources": []})
 
         # Synthesize the findings (Retrieve-and-Synthesize)
-        logging.info(f"[Researcher] Found {len(sanitized_texts)} relevant chunks. Synthesizing answer with citations...")
+        logging.info(f"[Researcher] Found {len(sanitized_texts)} relevant chunks "
+                     f"({source_tokens or 'unknown'} tokens). Synthesizing answer with citations...")
         system_prompt = """You are an expert research synthesis AI. Your task is 
                         to provide a clear, factual answer to the user's topic based *only* on the 
                         provided source texts. After the answer, you MUST provide a "Sources" section 
@@ -133,7 +253,7 @@ def writer_agent(mcp_message, client, generation_model):
 
 
 # --- Agent 3: The Validator ---
-def validator_agent(mcp_input, client):
+def validator_agent(mcp_input, client, generation_model='qwen-plus'):
     """This agent fact-checks a draft against a source summary."""
     print("\n[验证Agent已激活]")
     # Extracting the two required pieces of information
@@ -148,7 +268,7 @@ def validator_agent(mcp_input, client):
     \"fail\" and a one-sentence explanation.
      """
     validation_context = f"SOURCE SUMMARY:\n{source_summary}\n\nDRAFT:\n{draft_post}"
-    validation_result = call_llm_robust(system_prompt, validation_context, client)
+    validation_result = call_llm_robust(system_prompt, validation_context, client, generation_model=generation_model)
     print(f"验证已完成，结果: {validation_result}")
     return create_mcp_message(
         sender="ValidatorAgent",
@@ -158,15 +278,16 @@ def validator_agent(mcp_input, client):
 
 def validate_mcp_message(message):
     """A simple validator to check the structure of an MCP message."""
-    required_keys = ["protocol_version", "sender", "content", "metadata"]
+    # MCPMessage instances are validated when they are built.
+    if isinstance(message, MCPMessage):
+        return True
     if not isinstance(message, dict):
         print(f"MCP Validation Failed: Message is not a dictionary.")
         return False
-    for key in required_keys:
-        if key not in message:
-            print(f"MCP Validation Failed: Missing key '{key}'")
-            return False
-        print(f"MCP message from {message['sender']} validated successfully.")
+    missing = [key for key in MCP_KEYS if key not in message]
+    if missing:
+        print(f"MCP Validation Failed: Missing key '{missing[0]}'")
+        return False
     return True
 
 
@@ -201,10 +322,64 @@ def context_librarian_agent(mcp_message, client, index, embedding_model, namespa
         raise e
 
 
-def summarizer_agent(mcp_message, client, generation_model):
+# Texts above this many tokens are summarized hierarchically (map-reduce) instead of in one prompt.
+SUMMARIZER_MAP_REDUCE_THRESHOLD = 6000
+SUMMARIZER_MAX_WORKERS = 4
+
+
+def _summarize_once(text, summary_objective, client, generation_model, part_label=None):
+    """Runs a single summarization prompt."""
+    system_prompt = """You are an expert summarization AI. 
+        Your task is to reduce the provided text to its essential points, guided by the user's specific objective. 
+        The summary must be concise, accurate, and directly address the stated goal."""
+    if part_label:
+        system_prompt += f"""
+        The text is {part_label} of a longer document. Keep every point relevant to the objective; 
+        the partial summaries will be combined afterwards."""
+
+    user_prompt = f"""--- OBJECTIVE ---\n{summary_objective}\n\n
+    --- TEXT TO SUMMARIZE ---\n{text}\n--- END TEXT 
+    ---\n\nGenerate the summary now."""
+    # Call the hardened LLM helper to perform the summarization
+    return call_llm_robust(
+        system_prompt,
+        user_prompt,
+        client=client,
+        generation_model=generation_model
+    )
+
+
+def _map_reduce_summarize(text, summary_objective, client, generation_model, threshold, max_workers, depth=0):
+    """
+    Summarizes a text that may exceed the context window: it is split with
+    tokens.split_text (by tokens, or by estimate when exact counts are off), the
+    pieces are summarized in parallel against the same objective, and the joined
+    partial summaries are reduced recursively.
+    """
+    if count_tokens(text, generation_model) <= threshold:
+        return _summarize_once(text, summary_objective, client, generation_model)
+    if depth >= 3:
+        raise ValueError("Summarizer could not reduce the text below the token threshold.")
+    pieces = split_text(text, threshold, overlap=min(200, threshold // 10))
+    logging.info(f"[摘要器智能体] Map step (level {depth + 1}): summarizing {len(pieces)} parts in parallel...")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        partial_summaries = list(pool.map(
+            in_current_context(lambda item: _summarize_once(item[1], summary_objective, client, generation_model,
+                                                            part_label=f"part {item[0] + 1} of {len(pieces)}")),
+            enumerate(pieces)))
+    combined = "\n\n".join(partial_summaries)
+    logging.info(f"[摘要器智能体] Reduce step (level {depth + 1}): combining {len(partial_summaries)} partial summaries...")
+    return _map_reduce_summarize(combined, summary_objective, client, generation_model,
+                                 threshold, max_workers, depth + 1)
+
+
+def summarizer_agent(mcp_message, client, generation_model,
+                     map_reduce_threshold=SUMMARIZER_MAP_REDUCE_THRESHOLD, max_workers=SUMMARIZER_MAX_WORKERS):
     """
      Reduces a large text to a concise summary based on an objective.
      Acts as a gatekeeper to manage token counts and costs.
+     Texts longer than `map_reduce_threshold` tokens are summarized in parallel
+     parts (up to `max_workers` at once) and then reduced.
      """
     logging.info("[摘要器智能体] Activated. Reducing context...")
     try:
@@ -214,21 +389,17 @@ def summarizer_agent(mcp_message, client, generation_model):
         # The agent validates that it has received the necessary inputs before proceeding.
         if not text_to_summarize or not summary_objective:
             raise ValueError("Summarizer requires 'text_to_summarize' and 'summary_objective' in the input content.")
-        # Define the prompts for the LLM
-        system_prompt = """You are an expert summarization AI. 
-            Your task is to reduce the provided text to its essential points, guided by the user's specific objective. 
-            The summary must be concise, accurate, and directly address the stated goal."""
-
-        user_prompt = f"""--- OBJECTIVE ---\n{summary_objective}\n\n
-        --- TEXT TO SUMMARIZE ---\n{text_to_summarize}\n--- END TEXT 
-        ---\n\nGenerate the summary now."""
+        # References to earlier steps may resolve to structured outputs; summarize their text form.
+        if not isinstance(text_to_summarize, str):
+            text_to_summarize = json.dumps(text_to_summarize, ensure_ascii=False)
         # The agent calls the robust LLM helper function and returns the result.
-        # Call the hardened LLM helper to perform the summarization
-        summary = call_llm_robust(
-            system_prompt,
-            user_prompt,
+        summary = _map_reduce_summarize(
+            text_to_summarize,
+            summary_objective,
             client=client,
-            generation_model=generation_model
+            generation_model=generation_model,
+            threshold=map_reduce_threshold,
+            max_workers=max_workers
         )
         # Return the summary in the standard MCP format
         return create_mcp_message("Summarizer", {"summary": summary})
@@ -237,37 +408,104 @@ def summarizer_agent(mcp_message, client, generation_model):
         raise e
 
 
-def final_orchestrator(initial_goal):
+def best_of_n_drafts(write_draft, validate_draft, writer_context, num_drafts, max_workers=None):
+    """
+    Generates `num_drafts` drafts concurrently, validates each one as soon as it is
+    written, and returns on the first draft that passes. Returns (draft, feedback):
+    the passing draft and its verdict, or (None, feedback of a failed draft) when
+    every draft fails. Drafts still being written or validated are abandoned.
+    A draft that fails with an API or validation error is skipped; any other
+    exception is a bug and propagates.
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers or num_drafts * 2)
+    write_draft, validate_draft = in_current_context(write_draft), in_current_context(validate_draft)
+    pending = {pool.submit(write_draft, writer_context): None for _ in range(num_drafts)}
+    feedback = None
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                draft = pending.pop(future)
+                try:
+                    result = future.result()
+                except (APIError, RetryError, ValueError) as e:
+                    logging.warning(f"[编排器] A parallel draft or validation failed: {e}")
+                    continue
+                if result is None:
+                    continue
+                if draft is None:
+                    # A draft finished writing; validate it right away.
+                    pending[pool.submit(validate_draft, result)] = result
+                elif "pass" in result.lower():
+                    return draft, result
+                else:
+                    feedback = feedback or result
+        return None, feedback
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# The blueprint the orchestrator's Writer follows: a factual, self-contained article.
+ORCHESTRATOR_BLUEPRINT = json.dumps({
+    "scene_goal": "Write a short, factual article that covers the research findings.",
+    "style_guide": "Clear and neutral. Make no claims beyond the research findings."})
+
+
+def final_orchestrator(initial_goal, client=None, pc=None, index_name='genai-mas-mcp-ch3',
+                       generation_model='qwen-plus', embedding_model='text-embedding-v2',
+                       namespace_knowledge='KnowledgeStore', blueprint=ORCHESTRATOR_BLUEPRINT,
+                       num_drafts=1, max_revisions=2):
     """
-    Manages the multi-agent workflow to achieve a high-level goal.
+    Manages the multi-agent workflow to achieve a high-level goal: research it,
+    then write and validate an article, revising on failed validation.
+    With num_drafts > 1, each round writes that many drafts in parallel and keeps
+    the first one that passes validation; revisions happen only if all fail.
+    Clients are created with initialize_clients() unless they are passed in.
     """
     print("=" * 50)
     print(f"[编排器] Goal Received: '{initial_goal}'")
     print("=" * 50)
-    client, _ = initialize_clients()
+    if client is None or pc is None:
+        client, pc = initialize_clients()
+    index = pc.Index(index_name)
     # --- Step 1: Orchestrator plans and calls the Researcher Agent ---
     print("\n[编排器]任务1: Research. Delegating to Researcher Agent.")
-    research_topic = "Mediterranean Diet"
-
     mcp_to_researcher = create_mcp_message(
         sender="Orchestrator",
-        content=research_topic
+        content={"topic_query": initial_goal}
     )
 
-    mcp_from_researcher = researcher_agent(mcp_to_researcher, client)
+    mcp_from_researcher = researcher_agent(mcp_to_researcher, client, index, generation_model, embedding_model,
+                                           namespace_knowledge)
 
     if not validate_mcp_message(mcp_from_researcher) or not mcp_from_researcher['content']:
         print("Workflow failed due to invalid or empty message from Researcher.")
         return
-    research_summary = mcp_from_researcher['content']
+    research_content = mcp_from_researcher['content']
+    research_summary = research_content.get('answer_with_sources') or research_content.get('answer')
     print("\n[编排器] Research complete. Received summary:")
     print("-" * 20)
     print(research_summary)
     print("-" * 20)
 
     # --- Step 2 & 3: Iterative Writing and Validation Loop ---
+    def write_draft(writer_context):
+        mcp_to_writer = create_mcp_message(sender="Orchestrator",
+                                           content={"blueprint": blueprint, "facts": writer_context})
+        mcp_from_writer = writer_agent(mcp_to_writer, client, generation_model)
+        if not validate_mcp_message(mcp_from_writer) or not mcp_from_writer['content']:
+            return None
+        return mcp_from_writer['content']
+
+    def validate_draft(draft_post):
+        validation_content = {"summary": research_summary, "draft": draft_post}
+        mcp_to_validator = create_mcp_message(sender="Orchestrator", content=validation_content)
+        mcp_from_validator = validator_agent(mcp_to_validator, client, generation_model)
+        if not validate_mcp_message(mcp_from_validator) or not mcp_from_validator['content']:
+            return None
+        return mcp_from_validator['content']
+
     final_output = "Could not produce a validated article."
-    max_revisions = 2
     for i in range(max_revisions):
         print(f"\n[编排器] Writing Attempt {i + 1}/{max_revisions}")
 
@@ -275,26 +513,27 @@ def final_orchestrator(initial_goal):
         if i > 0:
             writer_context += f"\n\nPlease revise the previous draft based on this feedback: {validation_result}"
 
-        mcp_to_writer = create_mcp_message(sender="Orchestrator", content=writer_context)
-        mcp_from_writer = writer_agent(mcp_to_writer, client)
-
-        if not validate_mcp_message(mcp_from_writer) or not mcp_from_writer['content']:
-            print("Aborting revision loop due to invalid message from Writer.")
-            break
-        draft_post = mcp_from_writer['content']
-
-        # --- Validation Step ---
-        print("\n[编排器] Draft received. Delegating to Validator Agent.")
-        validation_content = {"summary": research_summary, "draft": draft_post}
-        mcp_to_validator = create_mcp_message(sender="Orchestrator", content=validation_content)
-        mcp_from_validator = validator_agent(mcp_to_validator, client)
-
-        if not validate_mcp_message(mcp_from_validator) or not mcp_from_validator['content']:
-            print("Aborting revision loop due to invalid message from Validator.")
-            break
-        validation_result = mcp_from_validator['content']
-
-        if "pass" in validation_result.lower():
+        if num_drafts > 1:
+            # --- Best-of-N: parallel drafts, validated as they arrive ---
+            print(f"\n[编排器] Delegating {num_drafts} parallel drafts to Writer and Validator Agents.")
+            draft_post, validation_result = best_of_n_drafts(write_draft, validate_draft, writer_context, num_drafts)
+            if draft_post is None and validation_result is None:
+                print("Aborting revision loop: no parallel draft produced a valid verdict.")
+                break
+        else:
+            draft_post = write_draft(writer_context)
+            if draft_post is None:
+                print("Aborting revision loop due to invalid message from Writer.")
+                break
+
+            # --- Validation Step ---
+            print("\n[编排器] Draft received. Delegating to Validator Agent.")
+            validation_result = validate_draft(draft_post)
+            if validation_result is None:
+                print("Aborting revision loop due to invalid message from Validator.")
+                break
+
+        if draft_post is not None and "pass" in validation_result.lower():
             print("\n[编排器] Validation PASSED. Finalizing content.")
             final_output = draft_post
             break
@@ -310,3 +549,4 @@ def final_orchestrator(initial_goal):
     print("[编排器] Workflow Complete. Final Output:")
     print("=" * 50)
     print(final_output)
+    return final_output
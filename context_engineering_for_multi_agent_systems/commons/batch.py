@@ -0,0 +1,232 @@
+# Batch mode for the Context Engine: plan many goals at once, merge the steps their
+# plans share into one execution graph, and run that graph on a worker pool.
+#
+#   results = run_batch(goals, client, pc, index_name, generation_model, embedding_model,
+#                       namespace_context, namespace_knowledge)
+#   for final_output, trace in results: ...
+#
+# Two steps merge when they call the same agent with the same input, where a
+# reference to an earlier step counts as "the same" when that earlier step merged
+# too. So goals sharing a Librarian intent or Researcher topic share one call, and
+# goals with identical plans share the whole run.
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .blobstore import BlobStore
+from .engine import ExecutionTrace, plan_and_compile
+from .helpers import create_mcp_message
+from .namespaces import get_namespace_pointer
+from .plans import REFERENCE_PATTERN
+from .registry import AGENT_TOOLKIT
+from . import metrics
+from . import tracing
+
+DEFAULT_MAX_PLANNERS = 8
+DEFAULT_MAX_WORKERS = 16
+
+
+class ExecutionNode:
+    """One agent call in the merged graph, shared by every goal step that maps to it."""
+
+    def __init__(self, node_id, step, inputs):
+        self.node_id = node_id
+        # The first step that created the node; its planned input is what runs.
+        self.step = step
+        # {output key referenced by `step`: the node that produces it}
+        self.inputs = inputs
+        self.dependents = []
+        self.resolved_input = None
+        self.output = None
+        self.error = None
+
+    @property
+    def agent_name(self):
+        return self.step.agent_name
+
+    def run(self, bound_agents, store):
+        state = {key: node.output for key, node in self.inputs.items()}
+        start = time.perf_counter()
+        with tracing.span("batch.node", node=self.node_id, agent=self.agent_name):
+            self.resolved_input = self.step.resolve(state)
+            mcp_output = bound_agents.get(self.agent_name)(create_mcp_message("Engine", self.resolved_input))
+        metrics.ENGINE_STEP_LATENCY.observe(time.perf_counter() - start, agent=self.agent_name)
+        self.output = store.intern(mcp_output["content"])
+
+
+def _node_key(step, nodes_by_output):
+    # References become the id of the node they point to, so the key names the actual work.
+    def canonical(value):
+        if isinstance(value, str):
+            match = REFERENCE_PATTERN.match(value)
+            if match:
+                return {"$node": nodes_by_output[match.group(1)].node_id}
+            return value
+        if isinstance(value, dict):
+            return {key: canonical(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [canonical(item) for item in value]
+        return value
+
+    return json.dumps([step.agent_name, canonical(step.planned_input)], sort_keys=True, ensure_ascii=False,
+                      default=str)
+
+
+def build_graph(compiled_plans):
+    """
+    Merges compiled plans into one graph. Returns (nodes, step_nodes), where
+    step_nodes[i] lists the node for each step of compiled_plans[i] (None entries
+    are skipped).
+    """
+    nodes = {}
+    step_nodes = []
+    for compiled_plan in compiled_plans:
+        if compiled_plan is None:
+            step_nodes.append(None)
+            continue
+        nodes_by_output = {}
+        plan_nodes = []
+        for step in compiled_plan:
+            key = _node_key(step, nodes_by_output)
+            node = nodes.get(key)
+            if node is None:
+                inputs = {f"STEP_{ref}_OUTPUT": nodes_by_output[f"STEP_{ref}_OUTPUT"] for ref in step.depends_on}
+                node = nodes[key] = ExecutionNode(len(nodes) + 1, step, inputs)
+                for dependency in set(inputs.values()):
+                    dependency.dependents.append(node)
+            nodes_by_output[step.output_key] = node
+            plan_nodes.append(node)
+        step_nodes.append(plan_nodes)
+    return list(nodes.values()), step_nodes
+
+
+def execute_graph(nodes, bound_agents, store, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Runs every node once its inputs are ready, up to `max_workers` at a time. A
+    failed node sets `error`; nodes depending on it are skipped with an error too.
+    """
+    waiting = {node: len(set(node.inputs.values())) for node in nodes}
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    run_node = tracing.in_current_context(lambda node: node.run(bound_agents, store))
+    pending = {}
+
+    def release(node):
+        # Submits the node, or fails it right away if one of its inputs failed.
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            failed = next((dep for dep in current.inputs.values() if dep.error is not None), None)
+            if failed is None:
+                pending[pool.submit(run_node, current)] = current
+                continue
+            current.error = f"Skipped: input node {failed.node_id} ({failed.agent_name}) failed."
+            for dependent in current.dependents:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    stack.append(dependent)
+
+    try:
+        for node in nodes:
+            if waiting[node] == 0:
+                release(node)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                try:
+                    future.result()
+                    logging.info(f"[批处理:执行器] Node {node.node_id} ({node.agent_name}) completed.")
+                except Exception as e:
+                    node.error = str(e)
+                    logging.error(f"[批处理:执行器] Node {node.node_id} ({node.agent_name}) failed: {e}")
+                for dependent in node.dependents:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        release(dependent)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_batch(goals, client, pc, index_name, generation_model, embedding_model, namespace_context,
+              namespace_knowledge, max_planners=DEFAULT_MAX_PLANNERS, max_workers=DEFAULT_MAX_WORKERS,
+              blob_store=None):
+    """
+    Runs many goals as one batch. Goals are planned up to `max_planners` at a time
+    (identical goals are planned once), identical steps across plans are merged,
+    and the merged graph runs on `max_workers` threads. Returns a list of
+    (final_output, trace) in the order of `goals`, like context_engine for each goal.
+    """
+    registry = AGENT_TOOLKIT
+    store = blob_store or BlobStore()
+    traces = [ExecutionTrace(goal, store=store) for goal in goals]
+    logging.info(f"\n=== [批处理] Starting a batch of {len(goals)} goals ===")
+    with tracing.start_run(f"batch of {len(goals)} goals") as tracer:
+        for trace in traces:
+            trace.tracer = tracer
+        with tracing.span("batch.run", goals=len(goals)) as run_span:
+            try:
+                index = pc.Index(index_name)
+            except Exception as e:
+                logging.error(f"Failed to connect to Pinecone index '{index_name}': {e}")
+                for trace in traces:
+                    trace.finalize("Failed during Initialization (Pinecone Connection)")
+                return _finish(traces)
+            pointer = get_namespace_pointer()
+            bound_agents = registry.bind(client=client, index=index, generation_model=generation_model,
+                                         embedding_model=embedding_model,
+                                         namespace_context=pointer.resolve(namespace_context),
+                                         namespace_knowledge=pointer.resolve(namespace_knowledge))
+
+            # Phase 1: Plan each distinct goal once; duplicates share the plan.
+            first_trace = {}
+            for trace in traces:
+                first_trace.setdefault(trace.goal, trace)
+            plan_one = tracing.in_current_context(
+                lambda trace: plan_and_compile(trace, trace.goal, registry, client, generation_model))
+            with ThreadPoolExecutor(max_workers=max_planners) as pool:
+                compiled = dict(zip(first_trace, pool.map(plan_one, first_trace.values())))
+            for trace in traces:
+                planned = first_trace[trace.goal]
+                if trace is not planned:
+                    trace.log_plan(planned.plan)
+                    if compiled[trace.goal] is None:
+                        trace.finalize(planned.status)
+            compiled_plans = [compiled[trace.goal] for trace in traces]
+
+            # Phase 2: Merge the plans and run the shared graph.
+            nodes, step_nodes = build_graph(compiled_plans)
+            total_steps = sum(len(plan) for plan in compiled_plans if plan is not None)
+            logging.info(f"[批处理] {len(first_trace)} distinct goals planned; {total_steps} steps merged "
+                         f"into {len(nodes)} nodes.")
+            run_span.set("distinct_goals", len(first_trace))
+            run_span.set("steps", total_steps)
+            run_span.set("nodes", len(nodes))
+            execute_graph(nodes, bound_agents, store, max_workers=max_workers)
+
+            # Phase 3: Give every goal its own trace of the steps it ran.
+            for trace, compiled_plan, plan_nodes in zip(traces, compiled_plans, step_nodes):
+                if compiled_plan is not None:
+                    _record_goal(trace, compiled_plan, plan_nodes)
+    return _finish(traces)
+
+
+def _record_goal(trace, compiled_plan, plan_nodes):
+    for step, node in zip(compiled_plan, plan_nodes):
+        if node.error is not None:
+            logging.error(f"[批处理:执行器] Goal '{trace.goal[:60]}' failed at step {step.step_num} "
+                          f"({step.agent_name}): {node.error}")
+            trace.finalize(f"Failed at Step {step.step_num}")
+            return
+        trace.log_step(step.step_num, step.agent_name, step.planned_input, {"content": node.output},
+                       node.resolved_input)
+    trace.finalize("Success", plan_nodes[-1].output)
+
+
+def _finish(traces):
+    for trace in traces:
+        metrics.ENGINE_RUNS.inc(status=trace.status)
+        metrics.ENGINE_RUN_LATENCY.observe(trace.duration)
+    logging.info(f"=== [批处理] Batch finished: {sum(trace.status == 'Success' for trace in traces)}"
+                 f"/{len(traces)} goals succeeded ===")
+    return [(trace.final_output, trace) for trace in traces]
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+
+# Strings shorter than this stay inline in records; longer ones are stored once as blobs.
+BLOB_INLINE_BYTES = 256
+# Blobs at least this large are written to disk instead of kept in memory (0 disables spilling).
+SPILL_BYTES_ENV = "TRACE_SPILL_BYTES"
+SPILL_DIR_ENV = "TRACE_SPILL_DIR"
+DEFAULT_SPILL_BYTES = 0
+
+# `length` is the length of the string in characters.
+BlobRef = namedtuple("BlobRef", ["digest", "length"])
+
+
+class BlobStore:
+    """
+    A content-addressed table of large strings. Records keep a BlobRef in place of
+    each large string, so a text referenced from many steps (as output, as resolved
+    input of the next step, ...) is held once. Blobs of at least `spill_bytes` are
+    written to `spill_dir` and read back on demand.
+    """
+
+    def __init__(self, inline_bytes=BLOB_INLINE_BYTES, spill_bytes=None, spill_dir=None):
+        self.inline_bytes = inline_bytes
+        self.spill_bytes = int(os.getenv(SPILL_BYTES_ENV, DEFAULT_SPILL_BYTES)) if spill_bytes is None else spill_bytes
+        self.spill_dir = spill_dir or os.getenv(SPILL_DIR_ENV)
+        self._owns_spill_dir = False
+        self._blobs = {}      # digest -> text, or None once spilled to disk
+        self._by_id = {}      # id(text) -> digest, for texts held in _blobs (so the id stays valid)
+        self._lock = threading.Lock()
+        self.references = 0
+        self.spilled = 0
+        self.unique_bytes = 0
+
+    def _spill_path(self, digest):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="trace-blobs-")
+            self._owns_spill_dir = True
+        return os.path.join(self.spill_dir, digest)
+
+    def put(self, text):
+        """Stores a string and returns its BlobRef; identical content is stored once."""
+        with self._lock:
+            digest = self._by_id.get(id(text))
+        data = None
+        if digest is None:
+            data = text.encode("utf-8")
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self._lock:
+            self.references += 1
+            if digest in self._blobs:
+                return BlobRef(digest, len(text))
+            size = len(data)
+            if self.spill_bytes and size >= self.spill_bytes:
+                path = self._spill_path(digest)
+                if not os.path.exists(path):
+                    with open(path, "wb") as f:
+                        f.write(data)
+                self._blobs[digest] = None
+                self.spilled += 1
+            else:
+                self._blobs[digest] = text
+                self._by_id[id(text)] = digest
+            self.unique_bytes += size
+        return BlobRef(digest, len(text))
+
+    def get(self, ref):
+        text = self._blobs.get(ref.digest)
+        if text is not None:
+            return text
+        if ref.digest not in self._blobs:
+            raise KeyError(f"Blob {ref.digest} is not in this store.")
+        with open(os.path.join(self.spill_dir, ref.digest), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def intern(self, text):
+        """Returns the stored copy of a string's content, so duplicates can be dropped."""
+        if not isinstance(text, str) or len(text) < self.inline_bytes:
+            return text
+        ref = self.put(text)
+        return self._blobs.get(ref.digest) or text
+
+    def dehydrate(self, value):
+        """Replaces every large string inside dicts/lists with a BlobRef."""
+        if isinstance(value, str):
+            return self.put(value) if len(value) >= self.inline_bytes else value
+        if isinstance(value, BlobRef):
+            return value
+        if isinstance(value, Mapping):
+            return {key: self.dehydrate(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.dehydrate(item) for item in value]
+        return value
+
+    def materialize(self, value):
+        """The inverse of dehydrate: resolves every BlobRef back to its string."""
+        if isinstance(value, BlobRef):
+            return self.get(value)
+        if isinstance(value, dict):
+            return {key: self.materialize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.materialize(item) for item in value]
+        return value
+
+    def stats(self):
+        return {"blobs": len(self._blobs), "references": self.references,
+                "unique_bytes": self.unique_bytes, "spilled": self.spilled}
+
+    def close(self):
+        """Drops every blob and removes the spill directory if the store created it."""
+        with self._lock:
+            self._blobs.clear()
+            self._by_id.clear()
+        if self._owns_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
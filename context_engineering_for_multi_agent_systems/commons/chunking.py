@@ -0,0 +1,121 @@
+import functools
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(encoding_name=DEFAULT_ENCODING):
+    """Returns a cached tiktoken encoder, so chunking never rebuilds it."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _iter_token_windows(tokens, tokenizer, chunk_size, overlap, with_token_counts=False):
+    """
+    Yields overlapping chunk texts for an already tokenized document.
+    Byte offsets of the window starts are found by decoding each stride once, so
+    the document is decoded exactly once and every window is a byte slice.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("Chunk overlap must be smaller than the chunk size.")
+    if not tokens:
+        return
+    stride = chunk_size - overlap
+    num_tokens = len(tokens)
+    # offsets[k] is the byte offset of token k * stride; the last entry is the end of the document.
+    segments = [tokenizer.decode_bytes(tokens[i:i + stride]) for i in range(0, num_tokens, stride)]
+    data = b"".join(segments)
+    offsets = list(itertools.accumulate(map(len, segments), initial=0))
+    # A window spans `chunk_size` tokens: whole strides plus the first `overlap` tokens of the next one.
+    whole, rest = divmod(chunk_size, stride)
+    for k in range(len(segments)):
+        end_k = k + whole
+        if end_k >= len(segments):
+            end = offsets[-1]
+        elif rest:
+            end = offsets[end_k] + len(tokenizer.decode_bytes(tokens[end_k * stride:end_k * stride + rest]))
+        else:
+            end = offsets[end_k]
+        # Windows may split a multi-byte character, exactly like decoding the tokens would.
+        chunk = data[offsets[k]:end].decode("utf-8", errors="replace")
+        # Basic cleanup
+        chunk = chunk.replace("\n", " ").strip()
+        if chunk:
+            yield (chunk, min(chunk_size, num_tokens - k * stride)) if with_token_counts else chunk
+
+
+def iter_chunks(text, chunk_size=400, overlap=50, encoding_name=DEFAULT_ENCODING, with_token_counts=False):
+    """
+    Streams token-based chunks of a text with overlap (Best practice for RAG).
+    With `with_token_counts`, yields (chunk, token_count) so callers never re-tokenize.
+    """
+    tokenizer = get_tokenizer(encoding_name)
+    yield from _iter_token_windows(tokenizer.encode(text), tokenizer, chunk_size, overlap, with_token_counts)
+
+
+def chunk_text(text, chunk_size=400, overlap=50, encoding_name=DEFAULT_ENCODING):
+    """Chunks text based on token count with overlap, returning a list."""
+    return list(iter_chunks(text, chunk_size, overlap, encoding_name))
+
+
+def chunk_many(texts, chunk_size=400, overlap=50, encoding_name=DEFAULT_ENCODING,
+               num_threads=8, processes=None):
+    """
+    Chunks many documents in parallel and returns one list of chunks per document.
+    By default tiktoken's encode_batch tokenizes across threads; pass `processes`
+    to spread the whole chunking work over a process pool instead.
+    """
+    texts = list(texts)
+    if processes:
+        worker = functools.partial(chunk_text, chunk_size=chunk_size, overlap=overlap,
+                                   encoding_name=encoding_name)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(worker, texts, chunksize=max(1, len(texts) // (processes * 4))))
+    tokenizer = get_tokenizer(encoding_name)
+    all_tokens = tokenizer.encode_batch(texts, num_threads=num_threads)
+    return [list(_iter_token_windows(tokens, tokenizer, chunk_size, overlap)) for tokens in all_tokens]
+
+
+def _legacy_chunk_text(text, chunk_size=400, overlap=50):
+    """The original chunker, kept as the benchmark baseline."""
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    tokens = tokenizer.encode(text)
+    chunks = []
+    for i in range(0, len(tokens), chunk_size - overlap):
+        chunk_tokens = tokens[i:i + chunk_size]
+        chunk_text = tokenizer.decode(chunk_tokens)
+        chunk_text = chunk_text.replace("\n", " ").strip()
+        if chunk_text:
+            chunks.append(chunk_text)
+    return chunks
+
+
+def benchmark_chunkers(texts, processes=4):
+    """Measures documents per second for the legacy and the fast chunkers."""
+    texts = list(texts)
+    get_tokenizer()  # Warm the encoder cache so it isn't billed to the first run
+    runs = {
+        "legacy": lambda: [_legacy_chunk_text(t) for t in texts],
+        "iter_chunks": lambda: [chunk_text(t) for t in texts],
+        "chunk_many_threads": lambda: chunk_many(texts),
+        "chunk_many_processes": lambda: chunk_many(texts, processes=processes),
+    }
+    results = {}
+    for name, run in runs.items():
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": elapsed, "docs_per_second": len(texts) / elapsed if elapsed else float("inf")}
+        logging.info(f"[Chunker Benchmark] {name}: {results[name]['docs_per_second']:.1f} docs/s")
+    return results
+
+
+if __name__ == "__main__":
+    sample = ("Juno is a NASA space probe orbiting the planet Jupiter. It entered a polar orbit "
+              "of Jupiter on July 5, 2016.\n") * 200
+    print(benchmark_chunkers([sample] * 500))
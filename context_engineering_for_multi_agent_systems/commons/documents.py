@@ -0,0 +1,99 @@
+import hashlib
+import mmap
+import os
+
+# Files at least this large are memory-mapped and read in windows of WINDOW_BYTES,
+# so a single huge document never has to sit in memory as one string.
+WINDOW_BYTES = 1024 * 1024
+
+
+class TextDocument:
+    """An in-memory document, used to feed plain {source: text} corpora to the same pipeline."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def content_hash(self):
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+    def iter_segments(self):
+        yield self.text
+
+
+class FileDocument:
+    """A document on disk that is only read while it is being hashed or chunked."""
+
+    def __init__(self, name, path, window_bytes=WINDOW_BYTES):
+        self.name = name
+        self.path = path
+        self.window_bytes = window_bytes
+
+    def content_hash(self):
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= self.window_bytes:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    digest.update(mm)
+            else:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def iter_segments(self):
+        """
+        Yields the document text. Small files come back whole; large ones are
+        memory-mapped and cut into windows at whitespace, or, in a window with none,
+        at the start of a UTF-8 character, so no character is ever split. Chunk
+        overlap does not carry across window edges.
+        """
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.window_bytes:
+                yield f.read().decode("utf-8", errors="replace")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < size:
+                    end = min(start + self.window_bytes, size)
+                    if end < size:
+                        cut = max(mm.rfind(b"\n", start, end), mm.rfind(b" ", start, end))
+                        if cut > start:
+                            end = cut + 1
+                        else:
+                            # No whitespace: back off to a UTF-8 lead byte (not 0b10xxxxxx).
+                            while end > start + 1 and (mm[end] & 0xC0) == 0x80:
+                                end -= 1
+                    yield mm[start:end].decode("utf-8", errors="replace")
+                    start = end
+
+
+class DocumentSource:
+    """
+    Lazily walks a directory tree and yields FileDocuments for matching files.
+    Nothing is read until a document is consumed, so chunking can start on the
+    first file while the rest of the corpus is still on disk.
+    """
+
+    def __init__(self, root, suffix=".txt", window_bytes=WINDOW_BYTES):
+        self.root = root
+        self.suffix = suffix
+        self.window_bytes = window_bytes
+
+    def __iter__(self):
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and entry.name.endswith(self.suffix):
+                        name = os.path.relpath(entry.path, self.root)
+                        yield FileDocument(name, entry.path, self.window_bytes)
+
+
+def as_documents(corpus):
+    """Accepts a DocumentSource, an iterable of documents or a {source: text} dict."""
+    if isinstance(corpus, dict):
+        return (TextDocument(name, text) for name, text in corpus.items())
+    return iter(corpus)
@@ -2,6 +2,11 @@ from .helpers import call_llm_robust, create_mcp_message
 import json, copy, time, logging
 from .registry import AGENT_TOOLKIT
 from .utils import initialize_clients
+from .namespaces import get_namespace_pointer
+from .plans import PlanValidationError, compile_plan
+from .blobstore import BlobStore
+from . import tracing
+from . import metrics
 
 
 def planner(goal, capabilities, client, generation_model):
@@ -96,28 +101,40 @@ def resolve_dependencies(input_params, state):
 
 
 class ExecutionTrace:
-    """Logs the entire execution flow for debugging and analysis."""
+    """
+    Logs the entire execution flow for debugging and analysis.
+    Step records keep large texts in a content-addressed BlobStore, so a text that
+    is an output, then the resolved input of later steps, is held only once.
+    """
 
-    def __init__(self, goal):
+    def __init__(self, goal, store=None):
         self.goal = goal
         self.plan = None
-        self.steps = []
+        self.store = store or BlobStore()
+        self.step_records = []
         self.status = "Initialized"
         self.final_output = None
         self.start_time = time.time()
         self.duration = None
+        # The run's span timeline (a tracing.Tracer), set by context_engine.
+        self.tracer = None
+
+    @property
+    def steps(self):
+        """The step records with every blob reference resolved back to its text."""
+        return [self.store.materialize(record) for record in self.step_records]
 
     def log_plan(self, plan):
         self.plan = plan
 
     def log_step(self, step_num, agent, planned_input, mcp_output, resolved_input):
         """Logs the details of a single execution step."""
-        self.steps.append({
+        self.step_records.append({
             "step": step_num,
             "agent": agent,
-            "planned_input": planned_input,
-            "resolved_context": resolved_input,
-            "output": mcp_output['content']
+            "planned_input": self.store.dehydrate(planned_input),
+            "resolved_context": self.store.dehydrate(resolved_input),
+            "output": self.store.dehydrate(mcp_output['content'])
         })
 
     def finalize(self, status, final_output=None):
@@ -126,12 +143,60 @@ class ExecutionTrace:
         self.duration = time.time() - self.start_time
 
 
-def context_engine(goal, client, pc, index_name, generation_model, embedding_model, namespace_context, namespace_knowledge):
+def context_engine(goal, client, pc, index_name, generation_model, embedding_model, namespace_context, namespace_knowledge,
+                   blob_store=None):
     """
      The main entry point for the Context Engine. Manages Planning and Execution.
+     Pass a BlobStore as `blob_store` to share (or spill to disk) trace content across runs.
+     The run's timeline is recorded on `trace.tracer` (see commons/tracing.py).
      """
     logging.info(f"\n=== [上下文引擎] Starting New Task ===\nGoal: {goal}\n")
-    trace = ExecutionTrace(goal)
+    trace = ExecutionTrace(goal, store=blob_store)
+    with tracing.start_run(goal[:80]) as tracer:
+        trace.tracer = tracer
+        with tracing.span("engine.run", goal=goal) as run_span:
+            final_output, trace = _run_engine(trace, goal, client, pc, index_name, generation_model,
+                                              embedding_model, namespace_context, namespace_knowledge)
+            run_span.set("status", trace.status)
+    metrics.ENGINE_RUNS.inc(status=trace.status)
+    metrics.ENGINE_RUN_LATENCY.observe(trace.duration)
+    return final_output, trace
+
+
+def plan_and_compile(trace, goal, registry, client, generation_model):
+    """
+    Plans a goal and compiles the plan against the registry. Returns the CompiledPlan,
+    or None after finalizing the trace with the phase that failed.
+    """
+    # Phase 1: Plan
+    try:
+        start = time.perf_counter()
+        with tracing.span("engine.plan", model=generation_model) as span:
+            # Only the agents relevant to this goal are described to the planner.
+            capabilities = registry.get_capabilities_description(goal)
+            plan = planner(goal, capabilities, client=client, generation_model=generation_model)
+            if span:
+                span.set("steps", len(plan))
+        # Timed here rather than from the span, which is None outside a traced run.
+        metrics.ENGINE_PLAN_LATENCY.observe(time.perf_counter() - start, model=generation_model)
+        trace.log_plan(plan)
+    except Exception as e:
+        logging.error(f"[引擎:规划器] Planning Failed: {e}")
+        trace.finalize("Failed during Planning")
+        return None
+
+    # Phase 2: Validate and compile the plan, before any agent spends a call on it.
+    try:
+        with tracing.span("engine.compile"):
+            return compile_plan(plan, registry)
+    except PlanValidationError as e:
+        logging.error(f"[引擎:规划器] Plan Validation Failed: {e}")
+        trace.finalize("Failed during Plan Validation")
+        return None
+
+
+def _run_engine(trace, goal, client, pc, index_name, generation_model, embedding_model,
+                namespace_context, namespace_knowledge):
     registry = AGENT_TOOLKIT
     try:
         index = pc.Index(index_name)
@@ -139,44 +204,45 @@ def context_engine(goal, client, pc, index_name, generation_model, embedding_mod
         logging.error(f"Failed to connect to Pinecone index '{index_name}': {e}")
         trace.finalize("Failed during Initialization (Pinecone Connection)")
         return None, trace
-    # Phase 1: Plan
-    try:
-        capabilities = registry.get_capabilities_description()
-        plan = planner(goal, capabilities, client=client, generation_model=generation_model)
-        trace.log_plan(plan)
-    except Exception as e:
-        logging.error(f"[引擎:规划器] Planning Failed: {e}")
-        trace.finalize("Failed during Planning")
+    # Resolve logical namespaces through the blue/green pointer once per run, so a
+    # reindex swapping versions mid-run never mixes two versions in one answer.
+    pointer = get_namespace_pointer()
+    namespace_context = pointer.resolve(namespace_context)
+    namespace_knowledge = pointer.resolve(namespace_knowledge)
+    # Bind every agent to this run's clients and namespaces once; steps reuse the bindings.
+    bound_agents = registry.bind(client=client, index=index, generation_model=generation_model,
+                                 embedding_model=embedding_model, namespace_context=namespace_context,
+                                 namespace_knowledge=namespace_knowledge)
+    # Phases 1 and 2: Plan, then validate and compile the plan
+    compiled_plan = plan_and_compile(trace, goal, registry, client, generation_model)
+    if compiled_plan is None:
         # Return the trace even in failure for debugging
         return None, trace
 
-    # Phase 2: Execute
+    # Phase 3: Execute
     # State stores the raw outputs (strings) of each step: { "STEP_X_OUTPUT": data_string }
     state = {}
-    for step in plan:
-        step_num = step.get("step")
-        agent_name = step.get("agent")
-        planned_input = step.get("input")
+    for step in compiled_plan:
+        step_num = step.step_num
+        agent_name = step.agent_name
+        planned_input = step.planned_input
         logging.info(f"\n[引擎:执行器] Starting Step {step_num}: {agent_name}")
         try:
-            agent = registry.get_agent(agent_name,
-                client=client,
-                index=index,
-                generation_model=generation_model,
-                embedding_model=embedding_model,
-                namespace_context=namespace_context,
-                namespace_knowledge=namespace_knowledge)
-            # Context Assembly: Resolve dependencies
-            resolved_input = resolve_dependencies(planned_input, state)
-            # Execute Agent via MCP
-            # Create an MCP message with the RESOLVED input for the agent
-            mcp_resolved_input = create_mcp_message(
-                "Engine", resolved_input)
-            mcp_output = agent(mcp_resolved_input)
+            start = time.perf_counter()
+            with tracing.span("engine.step", step=step_num, agent=agent_name):
+                agent = bound_agents.get(agent_name)
+                # Context Assembly: fill the precomputed reference slots
+                resolved_input = step.resolve(state)
+                # Execute Agent via MCP
+                # Create an MCP message with the RESOLVED input for the agent
+                mcp_resolved_input = create_mcp_message(
+                    "Engine", resolved_input)
+                mcp_output = agent(mcp_resolved_input)
+            metrics.ENGINE_STEP_LATENCY.observe(time.perf_counter() - start, agent=agent_name)
             # Update State and Log Trace
             output_data = mcp_output["content"]
-            # Store the output data (the context itself)
-            state[f"STEP_{step_num}_OUTPUT"] = output_data
+            # Store the output data (the context itself); repeated texts share one copy
+            state[step.output_key] = trace.store.intern(output_data)
             trace.log_step(step_num, agent_name, planned_input,
                            mcp_output, resolved_input)
             logging.info(f"[引擎:执行器] Step {step_num} completed.")
@@ -187,7 +253,7 @@ def context_engine(goal, client, pc, index_name, generation_model, embedding_mod
             # Return the trace for debugging the failure
             return None, trace
 
-    final_output = state.get(f"STEP_{len(plan)}_OUTPUT")
+    final_output = state.get(compiled_plan.output_key)
     trace.finalize("Success", final_output)
     logging.info("\n=== [上下文引擎]任务完成 ===")
     return final_output, trace
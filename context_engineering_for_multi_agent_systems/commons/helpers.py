@@ -2,24 +2,33 @@ from .utils import initialize_clients
 import logging
 from openai import APIError
 import textwrap
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-import tiktoken
-import re
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_random_exponential
+from . import tokens
+from .sanitizer import get_default_sanitizer
+from .mcp import MCPMessage
+from . import tracing
+from . import metrics
+from .metrics import hot_path_log
+from .namespaces import logical_namespace
+from .replay import ReplayMissError
+import time
 
 # === Configure Production-Level Logging ===
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
 
+
+def _on_retry(retry_state):
+    """tenacity `before_sleep` hook: records the retry on the current span and in the metrics."""
+    tracing.record_retry(retry_state)
+    metrics.record_retry(retry_state)
+
 def create_mcp_message(sender, content, metadata=None):
     """
     Create a standardized message for the MCP.
+    Returns an immutable MCPMessage, which is validated here and reads like a dict.
     """
-    return {
-        "protocol_version": "1.0",
-        "sender": sender,
-        "content": content,
-        "metadata": metadata or {}
-    }
+    return MCPMessage(sender, content, metadata)
 
 
 def call_llm(system_prompt, user_prompt):
@@ -58,51 +67,95 @@ def call_llm(system_prompt, user_prompt, client, temperature=1, json_mode=False)
         return f"LLM Error: {e}"
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6),
+       retry=retry_if_not_exception_type(ReplayMissError), before_sleep=_on_retry)
 def call_llm_robust(system_prompt, user_prompt, client, generation_model='qwen-plus', json_mode=False):
     """
     A centralized function to handle all LLM interactions with retries.
     UPGRADE: Now requires the 'client' and 'generation_model' objects to be passed in.
     """
-    logging.info("Attempting to call LLM...")
+    hot_path_log.info("Attempting to call LLM...")
+    start = time.perf_counter()
     try:
         response_format = {"type": "json_object"} if json_mode else {"type": "text"}
-        # UPGRADE: Uses the passed-in client and model name for the API call.
-        response = client.chat.completions.create(
-            model=generation_model,
-            response_format=response_format,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-        )
-        logging.info("LLM call successful.")
+        with tracing.span("llm.chat", model=generation_model, json_mode=json_mode) as span:
+            # UPGRADE: Uses the passed-in client and model name for the API call.
+            response = client.chat.completions.create(
+                model=generation_model,
+                response_format=response_format,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+            )
+            usage = getattr(response, "usage", None)
+            if span and usage is not None:
+                span.set("tokens_in", usage.prompt_tokens)
+                span.set("tokens_out", usage.completion_tokens)
+        metrics.LLM_LATENCY.observe(time.perf_counter() - start, model=generation_model)
+        if usage is not None:
+            metrics.LLM_TOKENS.inc(usage.prompt_tokens, model=generation_model, direction="in")
+            metrics.LLM_TOKENS.inc(usage.completion_tokens, model=generation_model, direction="out")
+        hot_path_log.info("LLM call successful.")
         return response.choices[0].message.content.strip()
     except APIError as e:
+        metrics.LLM_ERRORS.inc(model=generation_model, kind=metrics.error_kind(e))
         logging.error(f"OpenAI API Error in call_llm_robust: {e}")
         raise e
     except Exception as e:
+        metrics.LLM_ERRORS.inc(model=generation_model, kind=metrics.error_kind(e))
         logging.error(f"An unexpected error occurred in call_llm_robust: {e}")
         raise e
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6),
+       retry=retry_if_not_exception_type(ReplayMissError), before_sleep=_on_retry)
 def get_embedding(text, client, embedding_model='text-embedding-v2'):
     """
     Generates embeddings for a single text query with retries.
     """
     text = text.replace("\n", " ")
+    start = time.perf_counter()
     try:
-        response = client.embeddings.create(input=[text], model=embedding_model)
+        with tracing.span("embedding.create", model=embedding_model, batch_size=1):
+            response = client.embeddings.create(input=[text], model=embedding_model)
+        metrics.EMBEDDING_LATENCY.observe(time.perf_counter() - start, model=embedding_model)
+        metrics.EMBEDDING_BATCH.observe(1, model=embedding_model)
         return response.data[0].embedding
     except APIError as e:
+        metrics.EMBEDDING_ERRORS.inc(model=embedding_model, kind=metrics.error_kind(e))
         logging.error(f"LLM API Error in get_embedding: {e}")
         raise e
     except Exception as e:
+        metrics.EMBEDDING_ERRORS.inc(model=embedding_model, kind=metrics.error_kind(e))
         logging.error(f"An unexpected error occurred in get_embedding: {e}")
         raise e
 
 
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6),
+       retry=retry_if_not_exception_type(ReplayMissError), before_sleep=_on_retry)
+def get_embeddings(texts, client, embedding_model='text-embedding-v2'):
+    """
+    Generates embeddings for several texts in a single API call with retries.
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    start = time.perf_counter()
+    try:
+        with tracing.span("embedding.create", model=embedding_model, batch_size=len(texts)):
+            response = client.embeddings.create(input=texts, model=embedding_model)
+        metrics.EMBEDDING_LATENCY.observe(time.perf_counter() - start, model=embedding_model)
+        metrics.EMBEDDING_BATCH.observe(len(texts), model=embedding_model)
+        return [item.embedding for item in response.data]
+    except APIError as e:
+        metrics.EMBEDDING_ERRORS.inc(model=embedding_model, kind=metrics.error_kind(e))
+        logging.error(f"LLM API Error in get_embeddings: {e}")
+        raise e
+    except Exception as e:
+        metrics.EMBEDDING_ERRORS.inc(model=embedding_model, kind=metrics.error_kind(e))
+        logging.error(f"An unexpected error occurred in get_embeddings: {e}")
+        raise e
+
+
 def display_mcp(message, title="MCP Message"):
     """Helper function to display MCP messages clearly during the trace."""
     logging.info(f"\n--- {title} (Sender: {message['sender']}) ---")
@@ -116,17 +169,45 @@ def display_mcp(message, title="MCP Message"):
     print("-" * (len(title) + 25))
 
 
+def _query_index(query_embedding, namespace, top_k, index):
+    """Runs one vector query, timed for tracing and metrics."""
+    label = logical_namespace(namespace)
+    start = time.perf_counter()
+    try:
+        with tracing.span("pinecone.query", namespace=namespace, top_k=top_k) as span:
+            response = index.query(
+                vector=query_embedding,
+                namespace=namespace,
+                top_k=top_k,
+                include_metadata=True
+            )
+            if span:
+                span.set("matches", len(response['matches']))
+    except Exception:
+        metrics.PINECONE_ERRORS.inc(namespace=label)
+        raise
+    metrics.PINECONE_LATENCY.observe(time.perf_counter() - start, namespace=label)
+    return response['matches']
+
+
 def query_pinecone(query_text, namespace, top_k, index, client, embedding_model):
     """Embeds the query text and searches the specified Pinecone namespace."""
     try:
         query_embedding = get_embedding(query_text,client, embedding_model)
-        response = index.query(
-            vector=query_embedding,
-            namespace=namespace,
-            top_k=top_k,
-            include_metadata=True
-        )
-        return response['matches']
+        return _query_index(query_embedding, namespace, top_k, index)
+    except ReplayMissError:
+        raise
+    except Exception as e:
+        logging.error(f"Error querying Pinecone (Namespace: {namespace}): {e}")
+        return []
+
+
+def query_pinecone_by_vector(query_embedding, namespace, top_k, index):
+    """Searches the specified Pinecone namespace with an already computed query embedding."""
+    try:
+        return _query_index(query_embedding, namespace, top_k, index)
+    except ReplayMissError:
+        raise
     except Exception as e:
         logging.error(f"Error querying Pinecone (Namespace: {namespace}): {e}")
         return []
@@ -134,12 +215,13 @@ def query_pinecone(query_text, namespace, top_k, index, client, embedding_model)
 
 def count_tokens(text, model="qwen-plus"):
     """Counts the number of tokens in a text string for a given model."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        # Fallback for models that might not be in the tiktoken registry
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+    # Encoders are cached per model and counts are memoized; see commons/tokens.py.
+    return tokens.count_tokens(text, model)
+
+
+def detect_injection(text):
+    """Returns the first injection pattern found in the text, or None if it is clean."""
+    return get_default_sanitizer().scan(text).rule
 
 
 def helper_sanitize_input(text):
@@ -147,21 +229,10 @@ def helper_sanitize_input(text):
     A simple sanitization function to detect and flag potential prompt injection patterns.
     Returns the text if clean, or raises a ValueError if a threat is detected.
     """
-    # List of simple, high-confidence patterns to detect injection attempts
-    injection_patterns = [
-        r"ignore previous instructions",
-        r"ignore all prior commands",
-        r"you are now in.*mode",
-        r"act as",
-        r"print your instructions",
-        # A simple pattern to catch attempts to inject system-level commands
-        r"sudo|apt-get|yum|pip install"
-    ]
-
-    for pattern in injection_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            logging.warning(f"[Sanitizer] Potential threat detected with pattern: '{pattern}'")
-            raise ValueError(f"Input sanitization failed. Potential threat detected.")
-
-    logging.info("[Sanitizer] Input passed sanitization check.")
+    verdict = get_default_sanitizer().scan(text)
+    if not verdict.clean:
+        logging.warning(f"[Sanitizer] Potential threat detected with pattern: '{verdict.rule}'")
+        raise ValueError(f"Input sanitization failed. Potential threat detected.")
+
+    logging.debug("[Sanitizer] Input passed sanitization check.")
     return text
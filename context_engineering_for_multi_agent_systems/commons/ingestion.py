@@ -0,0 +1,328 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential
+
+from .documents import as_documents
+from .sanitizer import get_default_sanitizer
+
+# Request limits for a single embedding / upsert call. Chunks from many documents
+# are packed together until either limit is reached.
+EMBED_BATCH_MAX_ITEMS = 100
+EMBED_BATCH_MAX_BYTES = 256 * 1024
+# Pinecone rejects upsert requests above 2 MB or 1000 vectors; stay a little below.
+UPSERT_BATCH_MAX_BYTES = 2 * 1000 * 1000
+UPSERT_BATCH_MAX_VECTORS = 1000
+
+
+def text_size_bytes(text):
+    """Returns the UTF-8 payload size of a text, used to size embedding batches."""
+    return len(text.encode("utf-8"))
+
+
+def pack_batches(items, max_items=EMBED_BATCH_MAX_ITEMS, max_size=EMBED_BATCH_MAX_BYTES, size_fn=None):
+    """
+    Packs a stream of items into batches bounded by item count and total size.
+    Items are taken in order, so batches can span many documents. An item larger
+    than max_size on its own is emitted as a single-item batch.
+    """
+    size_fn = size_fn or (lambda item: text_size_bytes(item["text"]))
+    batch = []
+    batch_size = 0
+    for item in items:
+        item_size = size_fn(item)
+        if batch and (len(batch) >= max_items or batch_size + item_size > max_size):
+            yield batch
+            batch = []
+            batch_size = 0
+        if item_size > max_size:
+            logging.warning(f"[Ingestion] Item of {item_size} bytes exceeds the batch limit of {max_size} bytes.")
+        batch.append(item)
+        batch_size += item_size
+    if batch:
+        yield batch
+
+
+def content_hash(text):
+    """Returns the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(source, text):
+    """Deterministic chunk ID derived from the source name and the chunk content."""
+    return f"{source}_chunk_{content_hash(text)[:16]}"
+
+
+def iter_document_chunks(document, chunker):
+    """Streams the chunks of one document, segment by segment."""
+    for segment in document.iter_segments():
+        yield from chunker(segment)
+
+
+def iter_knowledge_records(knowledge_base, chunker):
+    """
+    Flattens a corpus (a DocumentSource or a {source: text} dict) into chunk
+    records that keep their source, ready to be packed across documents.
+    Chunkers may yield plain strings or (text, token_count) pairs.
+    """
+    for document in as_documents(knowledge_base):
+        for position, chunk in enumerate(iter_document_chunks(document, chunker)):
+            token_count = None
+            if isinstance(chunk, tuple):
+                chunk, token_count = chunk
+            yield {"id": make_chunk_id(document.name, chunk), "source": document.name,
+                   "position": position, "text": chunk, "token_count": token_count}
+
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?。！？])\s+")
+_WORD = re.compile(r"\w+")
+
+
+def extractive_summary(text, max_sentences=2):
+    """
+    A cheap extractive summary: the sentences with the highest average word
+    frequency within the chunk, returned in their original order.
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip()]
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+    frequencies = {}
+    for word in _WORD.findall(text.lower()):
+        frequencies[word] = frequencies.get(word, 0) + 1
+
+    def score(sentence):
+        words = _WORD.findall(sentence.lower())
+        return sum(frequencies[w] for w in words) / len(words) if words else 0
+
+    best = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)[:max_sentences]
+    return " ".join(sentences[i] for i in sorted(best))
+
+
+def enrich_chunk_metadata(record, summarize=False):
+    """
+    Computes, once at ingestion, the per-chunk facts the agents would otherwise
+    recompute on every query: token count, sanitization verdict and, optionally,
+    a short extractive summary. Pinecone metadata can't hold nulls, so the
+    matched rule is only present on flagged chunks. The verdict is stored with the
+    fingerprint of the rules that produced it, so it is rescanned if the rules change.
+    """
+    text = record["text"]
+    metadata = {"text": text, "source": record["source"]}
+    if record.get("token_count") is not None:
+        metadata["token_count"] = record["token_count"]
+    sanitizer = get_default_sanitizer()
+    rule = sanitizer.scan(text).rule
+    metadata["sanitization"] = "flagged" if rule else "clean"
+    metadata["sanitization_rules"] = sanitizer.fingerprint
+    if rule:
+        metadata["sanitization_rule"] = rule
+    if summarize:
+        metadata["summary"] = extractive_summary(text)
+    return metadata
+
+
+class IngestionDiff:
+    """
+    The result of comparing a corpus against the manifest. Records are streamed
+    by iter_records(); deleted_ids and documents are complete once it is exhausted.
+    """
+
+    def __init__(self, known_documents, corpus, chunker):
+        self.known_documents = known_documents
+        self.corpus = corpus
+        self.chunker = chunker
+        self.deleted_ids = []      # Chunk IDs that vanished from the corpus
+        self.documents = {}        # The manifest entries describing the new corpus
+        self.unchanged_documents = 0
+        self.changed_records = 0
+
+    def iter_records(self):
+        """Yields new or changed chunk records to embed and upsert."""
+        for document in as_documents(self.corpus):
+            doc_hash = document.content_hash()
+            previous = self.known_documents.get(document.name)
+            if previous and previous["hash"] == doc_hash:
+                self.documents[document.name] = previous
+                self.unchanged_documents += 1
+                continue
+            previous_ids = set(previous["chunks"]) if previous else set()
+            chunk_ids = []
+            seen_ids = set()
+            for record in iter_knowledge_records([document], self.chunker):
+                if record["id"] in seen_ids:
+                    continue
+                seen_ids.add(record["id"])
+                chunk_ids.append(record["id"])
+                if record["id"] not in previous_ids:
+                    self.changed_records += 1
+                    yield record
+            self.deleted_ids.extend(sorted(previous_ids - seen_ids))
+            self.documents[document.name] = {"hash": doc_hash, "chunks": chunk_ids}
+        for name, entry in self.known_documents.items():
+            if name not in self.documents:
+                self.deleted_ids.extend(entry["chunks"])
+
+
+class IngestionManifest:
+    """
+    A local record of what has been indexed: per namespace, the content hash of
+    every document and the IDs of its chunks. Used to re-index incrementally.
+    """
+
+    def __init__(self, path, embedding_model):
+        self.path = path
+        self.embedding_model = embedding_model
+        self.namespaces = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            # Vectors from another embedding model are not comparable; start over.
+            if data.get("embedding_model") == embedding_model:
+                self.namespaces = data.get("namespaces", {})
+            else:
+                logging.warning(f"[Manifest] Embedding model changed, ignoring manifest '{path}'.")
+
+    def is_empty(self):
+        return not any(self.namespaces.values())
+
+    def documents(self, namespace):
+        return self.namespaces.get(namespace, {})
+
+    def diff(self, namespace, corpus, chunker):
+        """
+        Compares a corpus with the manifest. Unchanged documents are skipped
+        without chunking; changed ones are re-chunked and only chunks with new
+        IDs are streamed for embedding.
+        """
+        return IngestionDiff(self.documents(namespace), corpus, chunker)
+
+    def update(self, namespace, documents):
+        self.namespaces[namespace] = documents
+
+    def drop(self, namespace):
+        self.namespaces.pop(namespace, None)
+
+    def vector_count(self, namespace):
+        """Number of vectors the manifest expects in a namespace."""
+        return sum(len(entry["chunks"]) for entry in self.documents(namespace).values())
+
+    def save(self):
+        """Writes the manifest atomically so an interrupted run keeps the old one."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"embedding_model": self.embedding_model, "namespaces": self.namespaces}, f)
+        os.replace(tmp_path, self.path)
+
+
+def delete_vectors(index, ids, namespace, batch_size=1000):
+    """Deletes vectors by ID in batches."""
+    for i in range(0, len(ids), batch_size):
+        index.delete(ids=ids[i:i + batch_size], namespace=namespace)
+
+
+def vector_size_bytes(vector):
+    """Size of a vector record as it is serialized in an upsert request."""
+    return len(json.dumps(vector, separators=(",", ":")).encode("utf-8"))
+
+
+class UpsertEngine:
+    """
+    Uploads vectors to one namespace with several upserts in flight. Batches
+    are sized by serialized bytes rather than a fixed count, because chunk text
+    in the metadata makes vectors vary a lot in size. Failed batches are retried;
+    upserts are keyed by ID, so a retry never duplicates data.
+
+    Use as a context manager, or call flush() when done submitting.
+    """
+
+    def __init__(self, index, namespace, max_workers=4, max_batch_bytes=UPSERT_BATCH_MAX_BYTES,
+                 max_batch_vectors=UPSERT_BATCH_MAX_VECTORS, max_attempts=6):
+        self.index = index
+        self.namespace = namespace
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_vectors = max_batch_vectors
+        self.max_attempts = max_attempts
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Bounds buffered work so a fast producer can't queue the whole corpus in memory.
+        self._in_flight = threading.BoundedSemaphore(max_workers * 2)
+        self._futures = []
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._lock = threading.Lock()
+        self.vectors_uploaded = 0
+        self.bytes_uploaded = 0
+        self.retries = 0
+        self._start = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        self._pool.shutdown()
+
+    def submit(self, vectors):
+        """Queues vectors for upload; full batches are dispatched immediately."""
+        if self._start is None:
+            self._start = time.perf_counter()
+        for vector in vectors:
+            size = vector_size_bytes(vector)
+            if self._buffer and (len(self._buffer) >= self.max_batch_vectors
+                                 or self._buffer_bytes + size > self.max_batch_bytes):
+                self._dispatch()
+            self._buffer.append(vector)
+            self._buffer_bytes += size
+
+    def _dispatch(self):
+        batch, batch_bytes = self._buffer, self._buffer_bytes
+        self._buffer, self._buffer_bytes = [], 0
+        self._in_flight.acquire()
+        future = self._pool.submit(self._upsert, batch, batch_bytes)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _upsert(self, batch, batch_bytes):
+        for attempt in Retrying(wait=wait_random_exponential(min=1, max=60),
+                                stop=stop_after_attempt(self.max_attempts), reraise=True):
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    with self._lock:
+                        self.retries += 1
+                self.index.upsert(vectors=batch, namespace=self.namespace)
+        with self._lock:
+            self.vectors_uploaded += len(batch)
+            self.bytes_uploaded += batch_bytes
+
+    def flush(self):
+        """Uploads anything still buffered and waits for every batch in flight."""
+        if self._buffer:
+            self._dispatch()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        if self._start is not None:
+            self.elapsed = time.perf_counter() - self._start
+
+    def stats(self):
+        elapsed = self.elapsed or 1e-9
+        return {
+            "vectors": self.vectors_uploaded,
+            "bytes": self.bytes_uploaded,
+            "retries": self.retries,
+            "seconds": self.elapsed,
+            "vectors_per_second": self.vectors_uploaded / elapsed,
+            "bytes_per_second": self.bytes_uploaded / elapsed,
+        }
+
+    def report(self, label):
+        stats = self.stats()
+        logging.info(f"[Upsert] {label}: {stats['vectors']} vectors, {stats['bytes'] / 1e6:.1f} MB in "
+                     f"{stats['seconds']:.1f}s ({stats['vectors_per_second']:.0f} vectors/s, "
+                     f"{stats['bytes_per_second'] / 1e6:.2f} MB/s, {stats['retries']} retries).")
@@ -0,0 +1,135 @@
+import json
+from collections.abc import Mapping
+
+PROTOCOL_VERSION = "1.0"
+MCP_KEYS = ("protocol_version", "sender", "content", "metadata")
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("MCP message content is immutable.")
+
+
+class FrozenDict(dict):
+    """A dict that refuses mutation; still a dict for isinstance checks and JSON."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # Copies (copy.deepcopy, pickle) come back as plain, mutable dicts.
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """A list that refuses mutation; still a list for isinstance checks and JSON."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value):
+    """
+    A deep, read-only copy of `value`: dicts and mappings become FrozenDicts, lists
+    and tuples FrozenLists. Parts that are already frozen are shared, not copied.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
+
+
+class MCPMessage(Mapping):
+    """
+    A standardized, immutable message for the MCP.
+
+    The message is validated and its content frozen once, when it is built, and
+    never copied afterwards: the content is a read-only deep copy of what was passed
+    in, so neither the caller nor a reader can change it under the cached JSON, and
+    passing the message between agents or keeping it in a trace costs nothing. It
+    still reads like the old dict messages (message['content'],
+    message.get('metadata'), dict(message)), and it is only
+    serialized when it has to cross a process boundary or be persisted; the JSON
+    form is computed once and cached.
+    """
+
+    __slots__ = ("protocol_version", "sender", "content", "metadata", "_json")
+
+    def __init__(self, sender, content, metadata=None, protocol_version=PROTOCOL_VERSION):
+        if not isinstance(sender, str) or not sender:
+            raise ValueError("MCP message requires a non-empty 'sender'.")
+        if metadata is not None and not isinstance(metadata, Mapping):
+            raise ValueError("MCP message 'metadata' must be a mapping.")
+        object.__setattr__(self, "protocol_version", protocol_version)
+        object.__setattr__(self, "sender", sender)
+        object.__setattr__(self, "content", freeze(content))
+        object.__setattr__(self, "metadata", freeze(metadata or {}))
+        object.__setattr__(self, "_json", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MCP messages are immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("MCP messages are immutable.")
+
+    # --- dict compatibility for existing agents ---
+    def __getitem__(self, key):
+        if key not in MCP_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(MCP_KEYS)
+
+    def __len__(self):
+        return len(MCP_KEYS)
+
+    def __repr__(self):
+        return f"MCPMessage(sender={self.sender!r}, content={self.content!r}, metadata={dict(self.metadata)!r})"
+
+    # --- lazy serialization ---
+    def to_dict(self):
+        return {"protocol_version": self.protocol_version, "sender": self.sender,
+                "content": self.content, "metadata": dict(self.metadata)}
+
+    def to_json(self):
+        """The JSON encoding of the message, computed on first use and cached."""
+        if self._json is None:
+            object.__setattr__(self, "_json", json.dumps(self.to_dict(), ensure_ascii=False, default=_json_default))
+        return self._json
+
+    def to_msgpack(self):
+        """The msgpack encoding of the message. Requires the optional 'msgpack' package."""
+        import msgpack
+        return msgpack.packb(self.to_dict(), default=_json_default, use_bin_type=True)
+
+    @classmethod
+    def from_dict(cls, data):
+        missing = [key for key in MCP_KEYS if key not in data]
+        if missing:
+            raise ValueError(f"MCP message is missing keys: {missing}")
+        return cls(data["sender"], data["content"], data["metadata"], data["protocol_version"])
+
+    @classmethod
+    def from_json(cls, raw):
+        message = cls.from_dict(json.loads(raw))
+        object.__setattr__(message, "_json", raw if isinstance(raw, str) else None)
+        return message
+
+    @classmethod
+    def from_msgpack(cls, raw):
+        import msgpack
+        return cls.from_dict(msgpack.unpackb(raw, raw=False))
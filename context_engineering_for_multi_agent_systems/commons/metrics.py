@@ -0,0 +1,271 @@
+# Process-wide performance metrics: counters and histograms with labels, rendered
+# in the Prometheus text format. Serve them with start_metrics_server(port) and
+# scrape http://host:port/metrics, or read get_registry().snapshot() in-process.
+import bisect
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100, 256, 1024)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+# Per-call INFO lines on the hot path (every LLM, embedding and query call) go to
+# this logger, so they can be silenced without touching the rest of the logging.
+HOT_PATH_LOGGER = "commons.hotpath"
+LOW_OVERHEAD_ENV = "ENGINE_LOW_OVERHEAD"
+hot_path_log = logging.getLogger(HOT_PATH_LOGGER)
+
+
+def set_low_overhead(enabled=True):
+    """Turns the per-call INFO logging on the hot path off (or back on)."""
+    hot_path_log.setLevel(logging.WARNING if enabled else logging.NOTSET)
+
+
+if os.getenv(LOW_OVERHEAD_ENV, "").lower() in ("1", "true", "yes"):
+    set_low_overhead(True)
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {list(labelnames)}, got {sorted(labels)}.")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {",".join(key): value for key, value in self._values.items()}
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {series[-1]}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {",".join(key): {"count": series[-1], "sum": series[-2]} for key, series in self._series.items()}
+
+
+class Gauge:
+    """A value read from a callback when the metrics are rendered (e.g. a cache hit ratio)."""
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(self.callback())}"]
+
+    def snapshot(self):
+        return self.callback()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' is already registered as a {type(metric).__name__}.")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name, help, callback):
+        return self._get_or_create(Gauge, name, help, callback)
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in metrics.items()}
+
+
+_REGISTRY = MetricsRegistry()
+
+
+def get_registry():
+    """The process-wide metrics registry."""
+    return _REGISTRY
+
+
+# --- Engine metrics ---
+LLM_LATENCY = _REGISTRY.histogram("llm_request_seconds", "LLM chat completion latency.", ["model"])
+LLM_TOKENS = _REGISTRY.counter("llm_tokens_total", "Tokens sent to and received from the LLM.", ["model", "direction"])
+LLM_ERRORS = _REGISTRY.counter("llm_errors_total", "Failed LLM calls by kind (rate_limited or error).",
+                               ["model", "kind"])
+EMBEDDING_LATENCY = _REGISTRY.histogram("embedding_request_seconds", "Embedding request latency.", ["model"])
+EMBEDDING_BATCH = _REGISTRY.histogram("embedding_batch_size", "Texts per embedding request.", ["model"],
+                                      buckets=SIZE_BUCKETS)
+EMBEDDING_ERRORS = _REGISTRY.counter("embedding_errors_total", "Failed embedding calls by kind.", ["model", "kind"])
+PINECONE_LATENCY = _REGISTRY.histogram("pinecone_query_seconds", "Vector query latency.", ["namespace"])
+PINECONE_ERRORS = _REGISTRY.counter("pinecone_errors_total", "Failed vector queries.", ["namespace"])
+RETRIES = _REGISTRY.counter("retries_total", "Retried calls (tenacity) by function.", ["function", "kind"])
+ENGINE_RUNS = _REGISTRY.counter("engine_runs_total", "Context engine runs by final status.", ["status"])
+ENGINE_RUN_LATENCY = _REGISTRY.histogram("engine_run_seconds", "End-to-end context engine run latency.")
+ENGINE_PLAN_LATENCY = _REGISTRY.histogram("engine_plan_seconds", "Planner latency.", ["model"])
+ENGINE_STEP_LATENCY = _REGISTRY.histogram("engine_step_seconds", "Plan step latency per agent.", ["agent"])
+
+
+def error_kind(error):
+    """
+    Classifies an API error as 'rate_limited' (HTTP 429) or 'error', by status code
+    or exception type; the message is not looked at, since ids and counts in it may
+    contain "429".
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429 or type(error).__name__ == "RateLimitError":
+        return "rate_limited"
+    return "error"
+
+
+def record_retry(retry_state):
+    """tenacity `before_sleep` hook: counts the retry by function and error kind."""
+    outcome = retry_state.outcome
+    error = outcome.exception() if outcome is not None else None
+    RETRIES.inc(function=getattr(retry_state.fn, "__name__", "call"),
+                kind=error_kind(error) if error is not None else "error")
+
+
+def _cache_ratio(stats):
+    hits, misses = stats()
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+def _register_cache_gauges():
+    from . import tokens
+    from .sanitizer import get_default_sanitizer
+
+    def token_stats():
+        stats = tokens.count_cache_stats()
+        return stats["hits"], stats["misses"]
+
+    def sanitizer_stats():
+        engine = get_default_sanitizer()
+        return engine.cache_hits, engine.cache_misses
+
+    _REGISTRY.gauge("token_count_cache_hit_ratio", "Hit ratio of the token-count cache.",
+                    lambda: _cache_ratio(token_stats))
+    _REGISTRY.gauge("sanitizer_cache_hit_ratio", "Hit ratio of the sanitizer verdict cache.",
+                    lambda: _cache_ratio(sanitizer_stats))
+
+
+_register_cache_gauges()
+
+
+# --- Exposition ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = _REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"[Metrics] {format % args}")
+
+
+def start_metrics_server(port=9464, host="127.0.0.1", registry=None):
+    """Serves /metrics in the Prometheus text format on a daemon thread. Returns the server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or _REGISTRY})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"[Metrics] Serving Prometheus metrics on http://{host}:{server.server_port}/metrics")
+    return server
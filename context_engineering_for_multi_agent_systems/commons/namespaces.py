@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# The pointer file maps each logical namespace (e.g. 'KnowledgeStore') to the
+# versioned namespace that currently serves it. It lives next to the ingestion
+# manifest unless NAMESPACE_POINTER_PATH says otherwise.
+DEFAULT_POINTER_PATH = os.getenv("NAMESPACE_POINTER_PATH", "namespace_pointer.json")
+VERSION_SEPARATOR = "__"
+# Retired namespaces kept for rollback, and how long a retired namespace must have
+# been out of service before it is deleted: the engine resolves namespaces once per
+# run, so runs started before a swap keep reading the previous version.
+DEFAULT_KEEP_VERSIONS = 1
+RETIRE_GRACE_SECONDS = 3600
+
+_version_lock = threading.Lock()
+_last_version = None
+
+
+def new_version():
+    """A sortable version tag for a freshly built namespace, unique within the process."""
+    global _last_version
+    with _version_lock:
+        now_ns = time.time_ns()
+        if _last_version is not None and now_ns <= _last_version:
+            now_ns = _last_version + 1000
+        _last_version = now_ns
+    seconds, nanos = divmod(now_ns, 1_000_000_000)
+    return time.strftime("v%Y%m%dT%H%M%S", time.gmtime(seconds)) + f"{nanos // 1000:06d}"
+
+
+def versioned_namespace(alias, version):
+    return f"{alias}{VERSION_SEPARATOR}{version}"
+
+
+def logical_namespace(namespace):
+    """Strips the version suffix, e.g. 'KnowledgeStore__v20260101T000000' -> 'KnowledgeStore'."""
+    return namespace.split(VERSION_SEPARATOR, 1)[0]
+
+
+class NamespacePointer:
+    """
+    Resolves logical namespaces to the versioned namespaces that serve them.
+    Swaps rewrite the whole file with os.replace, so readers see either the old
+    or the new mapping, never a mix. Reads are cached until the file changes.
+    """
+
+    def __init__(self, path=DEFAULT_POINTER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._aliases = {}
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._aliases = None, {}
+            return self._aliases
+        if mtime != self._mtime:
+            with open(self.path, "r") as f:
+                self._aliases = json.load(f)
+            self._mtime = mtime
+        return self._aliases
+
+    def resolve(self, alias):
+        """Returns the serving namespace for an alias, or the alias itself if it was never swapped."""
+        with self._lock:
+            entry = self._load().get(alias)
+        return entry["current"] if entry else alias
+
+    def history(self, alias):
+        """Versioned namespaces that served the alias before the current one, oldest first."""
+        with self._lock:
+            entry = self._load().get(alias)
+        return list(entry["previous"]) if entry else []
+
+    def retired_at(self, alias, namespace):
+        """When `namespace` stopped serving the alias (epoch seconds), or None if unknown."""
+        with self._lock:
+            entry = self._load().get(alias)
+        return entry.get("retired_at", {}).get(namespace) if entry else None
+
+    def swap(self, new_namespaces):
+        """Atomically points every alias in {alias: namespace} at its new namespace."""
+        with self._lock:
+            aliases = {alias: dict(entry) for alias, entry in self._load().items()}
+            now = time.time()
+            for alias, namespace in new_namespaces.items():
+                entry = aliases.get(alias)
+                previous = (entry["previous"] + [entry["current"]]) if entry else [alias]
+                retired_at = dict(entry.get("retired_at", {})) if entry else {}
+                retired_at[previous[-1]] = now
+                aliases[alias] = {"current": namespace, "previous": previous, "retired_at": retired_at}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(aliases, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self._mtime = None
+        logging.info(f"[Namespaces] Swapped {new_namespaces}.")
+
+    def forget(self, alias, namespaces):
+        """Drops garbage-collected namespaces from an alias's history."""
+        with self._lock:
+            aliases = self._load()
+            if alias not in aliases:
+                return
+            aliases = {a: dict(entry) for a, entry in aliases.items()}
+            aliases[alias]["previous"] = [ns for ns in aliases[alias]["previous"] if ns not in namespaces]
+            aliases[alias]["retired_at"] = {ns: retired for ns, retired in aliases[alias].get("retired_at", {}).items()
+                                            if ns not in namespaces}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(aliases, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self._mtime = None
+
+
+_default_pointer = None
+
+
+def get_namespace_pointer():
+    """The process-wide pointer used by the Context Engine."""
+    global _default_pointer
+    if _default_pointer is None:
+        _default_pointer = NamespacePointer()
+    return _default_pointer
+
+
+def validate_namespace(index, namespace, expected_count, smoke_vectors=(), timeout=120, poll_interval=2):
+    """
+    Checks a freshly built namespace before it is swapped in: it must report at
+    least `expected_count` vectors and every smoke query vector must return a match.
+    Returns True when the namespace is ready to serve.
+    """
+    deadline = time.time() + timeout
+    while True:
+        stats = index.describe_index_stats()
+        count = stats.namespaces[namespace].vector_count if namespace in stats.namespaces else 0
+        if count >= expected_count:
+            break
+        if time.time() > deadline:
+            logging.error(f"[Namespaces] '{namespace}' holds {count}/{expected_count} vectors after {timeout}s.")
+            return False
+        time.sleep(poll_interval)
+    for vector in smoke_vectors:
+        response = index.query(vector=vector, namespace=namespace, top_k=1)
+        if not response['matches']:
+            logging.error(f"[Namespaces] Smoke query against '{namespace}' returned no matches.")
+            return False
+    logging.info(f"[Namespaces] '{namespace}' validated with {count} vectors.")
+    return True
+
+
+def garbage_collect(index, pointer, alias, keep=DEFAULT_KEEP_VERSIONS, grace_seconds=RETIRE_GRACE_SECONDS):
+    """
+    Deletes namespaces that used to serve an alias, keeping the `keep` most recent
+    ones for rollback. A namespace is deleted only once it has been retired for
+    `grace_seconds`, so engine runs that resolved it before the swap can finish.
+    """
+    previous = pointer.history(alias)
+    now = time.time()
+    stale = [namespace for namespace in previous[:max(0, len(previous) - keep)]
+             if now - (pointer.retired_at(alias, namespace) or 0) >= grace_seconds]
+    for namespace in stale:
+        logging.info(f"[Namespaces] Deleting retired namespace '{namespace}'.")
+        try:
+            index.delete(delete_all=True, namespace=namespace)
+        except Exception as e:
+            # The namespace may never have existed (e.g. the un-versioned original).
+            logging.warning(f"[Namespaces] Could not delete '{namespace}': {e}")
+    if stale:
+        pointer.forget(alias, stale)
+    return stale
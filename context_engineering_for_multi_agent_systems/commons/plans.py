@@ -0,0 +1,148 @@
+import re
+
+from .metrics import hot_path_log
+
+# Context Chaining references are whole-string placeholders: "$$STEP_X_OUTPUT$$".
+REFERENCE_PATTERN = re.compile(r"^\$\$(STEP_(\d+)_OUTPUT)\$\$$")
+
+
+class PlanValidationError(ValueError):
+    """Raised when a plan breaks the registry's input contracts. `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("Invalid plan: " + "; ".join(self.errors))
+
+
+def _is_reference(value):
+    return isinstance(value, str) and value.startswith("$$") and value.endswith("$$") and len(value) >= 4
+
+
+def _slot_tree(value, on_reference):
+    """
+    Returns where a planned input holds references: the state key for a reference,
+    {key_or_index: subtree} for a container holding some, or None if there are none.
+    """
+    if _is_reference(value):
+        return on_reference(value)
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return None
+    tree = {}
+    for key, item in items:
+        subtree = _slot_tree(item, on_reference)
+        if subtree is not None:
+            tree[key] = subtree
+    return tree or None
+
+
+def _fill(value, tree, state):
+    # Only the containers on the way to a reference are copied; everything else is shared.
+    if isinstance(tree, str):
+        hot_path_log.info(f"[引擎:执行器] Resolved dependency {tree}.")
+        return state[tree]
+    filled = dict(value) if isinstance(value, dict) else list(value)
+    for key, subtree in tree.items():
+        filled[key] = _fill(value[key], subtree, state)
+    return filled
+
+
+class CompiledStep:
+    """One validated step with its reference slots precomputed."""
+
+    def __init__(self, step_num, agent_name, planned_input, slots, depends_on):
+        self.step_num = step_num
+        self.agent_name = agent_name
+        self.planned_input = planned_input
+        self.slots = slots
+        self.depends_on = depends_on
+        self.output_key = f"STEP_{step_num}_OUTPUT"
+
+    def resolve(self, state):
+        """Fills the reference slots from the execution state; the planned input is never modified."""
+        if self.slots is None:
+            return self.planned_input
+        return _fill(self.planned_input, self.slots, state)
+
+
+class CompiledPlan:
+    """An executable plan: steps in order, each knowing which earlier outputs it reads."""
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.output_key = steps[-1].output_key
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+
+def compile_plan(plan, registry):
+    """
+    Validates a plan against the registry's agent specs before anything runs and
+    compiles it into a CompiledPlan. Checks unknown agents, unknown or missing
+    input keys, `requires_one_of` groups and references to steps that don't run
+    earlier. Raises PlanValidationError listing every problem.
+    """
+    if not isinstance(plan, list) or not plan:
+        raise PlanValidationError(["The plan must be a non-empty list of steps."])
+    errors = []
+    steps = []
+    seen_steps = set()
+    for position, step in enumerate(plan, start=1):
+        if not isinstance(step, dict):
+            errors.append(f"Step #{position} is not an object.")
+            continue
+        step_num = step.get("step")
+        label = f"Step {step_num}" if step_num is not None else f"Step #{position}"
+        if isinstance(step_num, str) and step_num.isdigit():
+            step_num = int(step_num)
+        if not isinstance(step_num, int) or isinstance(step_num, bool):
+            errors.append(f"{label} has no integer 'step' number.")
+            continue
+        if step_num in seen_steps:
+            errors.append(f"{label} is numbered twice.")
+        agent_name = step.get("agent")
+        planned_input = step.get("input")
+        spec = registry.get_spec(agent_name) if isinstance(agent_name, str) else None
+        if spec is None:
+            errors.append(f"{label} uses unknown agent '{agent_name}'.")
+        if not isinstance(planned_input, dict):
+            errors.append(f"{label} ({agent_name}) has no 'input' object.")
+            planned_input = {}
+        elif spec is not None:
+            unknown = [key for key in planned_input if key not in spec.input_names]
+            if unknown:
+                errors.append(f"{label} ({agent_name}) has unknown input keys {unknown}; "
+                              f"expected {spec.input_names}.")
+            missing = [key for key in spec.required_inputs if key not in planned_input]
+            if missing:
+                errors.append(f"{label} ({agent_name}) is missing required inputs {missing}.")
+            if spec.requires_one_of and not any(planned_input.get(key) for key in spec.requires_one_of):
+                errors.append(f"{label} ({agent_name}) needs one of {list(spec.requires_one_of)}.")
+
+        depends_on = []
+
+        def on_reference(value):
+            match = REFERENCE_PATTERN.match(value)
+            if not match:
+                errors.append(f"{label} ({agent_name}) has a malformed reference {value}.")
+                return None
+            ref_step = int(match.group(2))
+            if ref_step not in seen_steps:
+                errors.append(f"{label} ({agent_name}) references {match.group(1)}, "
+                              f"which does not run before it.")
+            depends_on.append(ref_step)
+            return match.group(1)
+
+        slots = _slot_tree(planned_input, on_reference)
+        seen_steps.add(step_num)
+        steps.append(CompiledStep(step_num, agent_name, planned_input, slots, depends_on))
+    if errors:
+        raise PlanValidationError(errors)
+    return CompiledPlan(steps)
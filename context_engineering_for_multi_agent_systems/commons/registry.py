@@ -1,76 +1,248 @@
 from . import agents
+import functools
 import logging
+import re
+import threading
+from collections import OrderedDict
+
+# Everything the engine can hand to an agent. Each agent declares the subset it needs.
+ENGINE_CONTEXT_KEYS = ("client", "index", "generation_model", "embedding_model",
+                       "namespace_context", "namespace_knowledge")
+# How many distinct engine contexts keep their bound agents around.
+BINDING_CACHE_SIZE = 8
+
+
+class AgentInput:
+    """One declared input key of an agent."""
+
+    def __init__(self, name, type, description, required=True):
+        self.name = name
+        self.type = type
+        self.description = description
+        self.required = required
+
+
+class AgentSpec:
+    """
+    Declares an agent: the function that runs it, its input/output contract and the
+    engine dependencies it needs. `requires_one_of` lists optional inputs of which at
+    least one must be given. The planner only sees agents that are `always_available`
+    or whose `keywords` appear in the goal as whole words; a keyword ending in '*'
+    also matches longer words starting with it ("summar*" matches "summarize").
+    """
+
+    def __init__(self, name, func, role, inputs, output, needs=(), requires_one_of=(),
+                 keywords=(), always_available=True):
+        unknown = set(needs) - set(ENGINE_CONTEXT_KEYS)
+        if unknown:
+            raise ValueError(f"Agent '{name}' needs unknown engine dependencies: {sorted(unknown)}")
+        self.name = name
+        self.func = func
+        self.role = role
+        self.inputs = list(inputs)
+        self.output = output
+        self.needs = tuple(needs)
+        self.requires_one_of = tuple(requires_one_of)
+        self.keywords = tuple(keyword.lower() for keyword in keywords)
+        self.always_available = always_available
+        self._keyword_pattern = _compile_keywords(self.keywords) if self.keywords else None
+
+    @property
+    def input_names(self):
+        return [agent_input.name for agent_input in self.inputs]
+
+    @property
+    def required_inputs(self):
+        return [agent_input.name for agent_input in self.inputs if agent_input.required]
+
+    def is_relevant(self, goal):
+        if self.always_available or goal is None:
+            return True
+        return self._keyword_pattern is not None and self._keyword_pattern.search(goal.lower()) is not None
+
+    def bind(self, context):
+        """Returns the agent as a one-argument callable with its dependencies filled in."""
+        return functools.partial(self.func, **{key: context[key] for key in self.needs})
+
+    def describe(self, number):
+        lines = [f"{number}. AGENT: {self.name}",
+                 f"   ROLE: {self.role}",
+                 "   INPUTS:"]
+        for agent_input in self.inputs:
+            lines.append(f'     - "{agent_input.name}": ({agent_input.type}) {agent_input.description}')
+        if self.requires_one_of:
+            keys = " or ".join(f'"{key}"' for key in self.requires_one_of)
+            lines.append(f"   Provide {keys}.")
+        lines.append(f"   OUTPUT: {self.output}")
+        return "\n".join(lines)
+
+
+def _compile_keywords(keywords):
+    # Word edges are ASCII letters and digits, so CJK keywords still match inside a sentence.
+    alternatives = [re.escape(keyword[:-1]) + r"[a-z0-9_]*" if keyword.endswith("*") else re.escape(keyword)
+                    for keyword in keywords]
+    return re.compile(r"(?<![a-z0-9_])(?:" + "|".join(alternatives) + r")(?![a-z0-9_])")
+
+
+# Goals that mention any of these get the Summarizer offered to the planner.
+SUMMARIZER_KEYWORDS = ("summar*", "condens*", "shorten*", "concise", "brief*", "digest", "tl;dr",
+                       "long", "lengthy", "reduce", "摘要", "总结", "概括", "精简", "简要")
+
+DEFAULT_AGENT_SPECS = [
+    AgentSpec(
+        "Librarian", agents.context_librarian_agent,
+        role="Retrieves Semantic Blueprints (style/structure instructions).",
+        inputs=[AgentInput("intent_query", "String", "A descriptive phrase of the desired style.")],
+        output="The blueprint structure (JSON string).",
+        needs=("client", "index", "embedding_model", "namespace_context"),
+    ),
+    AgentSpec(
+        "Researcher", agents.researcher_agent,
+        role="Retrieves and synthesizes factual information on a topic.",
+        inputs=[AgentInput("topic_query", "String", "The subject matter to research.")],
+        output="Synthesized facts (String).",
+        needs=("client", "index", "generation_model", "embedding_model", "namespace_knowledge"),
+    ),
+    AgentSpec(
+        "Summarizer", agents.summarizer_agent,
+        role="Reduces large text to a concise summary based on a specific objective. "
+             "Ideal for managing token counts before a generation step.",
+        inputs=[AgentInput("text_to_summarize", "String/Reference", "The long text to be summarized."),
+                AgentInput("summary_objective", "String",
+                           'A clear goal for the summary (e.g., "Extract key technical specifications").')],
+        output='A dictionary containing the summary: {"summary": "..."}.',
+        needs=("client", "generation_model"),
+        keywords=SUMMARIZER_KEYWORDS,
+        always_available=False,
+    ),
+    AgentSpec(
+        "Writer", agents.writer_agent,
+        role="Generates or rewrites content by applying a Blueprint to source material.",
+        inputs=[AgentInput("blueprint", "String/Reference", "The style instructions (usually from Librarian)."),
+                AgentInput("facts", "String/Reference",
+                           "Factual information (usually from Researcher or Summarizer).", required=False),
+                AgentInput("previous_content", "String/Reference", "Existing text for rewriting.", required=False)],
+        output="The final generated text (String).",
+        needs=("client", "generation_model"),
+        requires_one_of=("facts", "previous_content"),
+    ),
+]
+
+
+class BoundAgents:
+    """The registry's agents bound to one engine context, built once and reused across steps."""
+
+    def __init__(self, registry, context):
+        self.registry = registry
+        self.context = context
+        self._agents = {name: spec.bind(context) for name, spec in registry.specs.items()}
+        # What a worker subprocess gets of the context: the model names and resolved namespaces.
+        self._worker_context = {key: value for key, value in context.items() if isinstance(value, str)}
+
+    def get(self, agent_name):
+        # Worker pools are looked up per call so enabling them takes effect immediately.
+        pool = self.registry.worker_pools.get(agent_name)
+        if pool is not None:
+            return functools.partial(pool, context=self._worker_context)
+        agent = self._agents.get(agent_name)
+        if agent is None:
+            logging.error(f"Agent '{agent_name}' not found in registry.")
+            raise ValueError(f"Agent '{agent_name}' not found in registry.")
+        return agent
 
 
 class AgentRegistry:
-    def __init__(self):
-        self.agents = {
-            "Researcher": agents.researcher_agent,
-            "Writer": agents.writer_agent,
-            "Librarian": agents.context_librarian_agent,
-            "Summarizer": agents.summarizer_agent
-        }
+    def __init__(self, specs=None):
+        self.specs = {}
+        # Agents served by out-of-process worker pools: { agent_name: AgentWorkerPool }
+        self.worker_pools = {}
+        self._bindings = OrderedDict()
+        self._descriptions = {}
+        self._lock = threading.Lock()
+        for spec in specs if specs is not None else DEFAULT_AGENT_SPECS:
+            self.register(spec)
+
+    def register(self, spec):
+        """Adds (or replaces) an agent and invalidates cached bindings and descriptions."""
+        with self._lock:
+            self.specs[spec.name] = spec
+            self._bindings = OrderedDict()
+            self._descriptions = {}
+
+    @property
+    def agents(self):
+        return {name: spec.func for name, spec in self.specs.items()}
+
+    def get_spec(self, agent_name):
+        return self.specs.get(agent_name)
+
+    def enable_workers(self, pool_sizes, config, factory_path=None, timeout=None):
+        """
+        Runs the given agents in worker subprocesses, e.g. {"Researcher": 4, "Summarizer": 2}.
+        `config` holds index_name, generation_model, embedding_model and the namespaces;
+        `timeout` is the per-call limit in seconds (default DEFAULT_CALL_TIMEOUT).
+        """
+        from .workers import AgentWorkerPool, DEFAULT_CALL_TIMEOUT
+        timeout = DEFAULT_CALL_TIMEOUT if timeout is None else timeout
+        for agent_name, size in pool_sizes.items():
+            if agent_name not in self.specs:
+                raise ValueError(f"Agent '{agent_name}' not found in registry.")
+            self.worker_pools[agent_name] = AgentWorkerPool(agent_name, size, config, factory_path, timeout)
+
+    def disable_workers(self):
+        """Stops every worker pool; agents run in-process again."""
+        pools, self.worker_pools = self.worker_pools, {}
+        for pool in pools.values():
+            pool.close()
+
+    def bind(self, client, index, generation_model, embedding_model, namespace_context, namespace_knowledge):
+        """
+        Returns the agents bound to an engine context. Bindings are cached by the
+        model and namespace names and the identity of the clients, so repeated runs
+        with the same clients reuse them. A cached binding is only reused when it holds
+        the very same client objects, so a recycled id() never returns stale agents.
+        """
+        context = {"client": client, "index": index, "generation_model": generation_model,
+                   "embedding_model": embedding_model, "namespace_context": namespace_context,
+                   "namespace_knowledge": namespace_knowledge}
+        key = tuple(value if isinstance(value, str) else id(value)
+                    for value in (context[name] for name in ENGINE_CONTEXT_KEYS))
+        with self._lock:
+            bound = self._bindings.get(key)
+            if bound is not None and all(bound.context[name] is context[name] for name in ENGINE_CONTEXT_KEYS
+                                         if not isinstance(context[name], str)):
+                self._bindings.move_to_end(key)
+                return bound
+            bound = BoundAgents(self, context)
+            self._bindings[key] = bound
+            if len(self._bindings) > BINDING_CACHE_SIZE:
+                self._bindings.popitem(last=False)
+            return bound
 
     def get_agent(self, agent_name, client, index, generation_model,
                   embedding_model, namespace_context, namespace_knowledge):
-        agent = self.agents.get(agent_name)
-        if not agent:
-            logging.error(f"Agent '{agent_name}' not found in registry.")
-            raise ValueError(f"Agent '{agent_name}' not found in registry.")
-        if 'Librarian' in agent_name:
-            return lambda mcp_message: agent(mcp_message, client=client, index=index,
-                                             embedding_model=embedding_model,
-                                             namespace_context=namespace_context
-                                             )
-        elif 'Researcher' in agent_name:
-            return lambda mcp_message: agent(mcp_message, client=client, index=index,
-                                             generation_model=generation_model,
-                                             embedding_model=embedding_model,
-                                             namespace_knowledge=namespace_knowledge
-                                             )
-        elif agent_name == "Summarizer":
-            return lambda mcp_message: agent(mcp_message, client=client,
-                                             generation_model=generation_model
-                                             )
-        elif 'Writer' in agent_name:
-            return lambda mcp_message: agent(mcp_message, client=client, generation_model=generation_model)
-
-        else:
-            return agent
-
-    def get_capabilities_description(self):
-        """Returns a structured description of the agents for the Planner LLM."""
-        # --- UPDATED: Add the Summarizer's capabilities ---
-        return """
-            Available Agents and their required inputs.
-            CRITICAL: You MUST use the exact input key names provided for each agent.
-        
-            1. AGENT: Librarian
-               ROLE: Retrieves Semantic Blueprints (style/structure instructions).
-               INPUTS:
-                 - "intent_query": (String) A descriptive phrase of the desired style.
-               OUTPUT: The blueprint structure (JSON string).
-        
-            2. AGENT: Researcher
-               ROLE: Retrieves and synthesizes factual information on a topic.
-               INPUTS:
-                 - "topic_query": (String) The subject matter to research.
-               OUTPUT: Synthesized facts (String).
-        
-            3. AGENT: Summarizer
-               ROLE: Reduces large text to a concise summary based on a specific objective. Ideal for managing token counts before a generation step.
-               INPUTS:
-                 - "text_to_summarize": (String/Reference) The long text to be summarized.
-                 - "summary_objective": (String) A clear goal for the summary (e.g., "Extract key technical specifications").
-               OUTPUT: A dictionary containing the summary: {"summary": "..."}.
-        
-            4. AGENT: Writer
-               ROLE: Generates or rewrites content by applying a Blueprint to source material.
-               INPUTS:
-                 - "blueprint": (String/Reference) The style instructions (usually from Librarian).
-                 - "facts": (String/Reference) Factual information (usually from Researcher or Summarizer).
-                 - "previous_content": (String/Reference) Existing text for rewriting.
-               OUTPUT: The final generated text (String).
+        return self.bind(client, index, generation_model, embedding_model,
+                         namespace_context, namespace_knowledge).get(agent_name)
+
+    def select_agents(self, goal=None):
+        """The specs worth offering the planner for a goal (all of them when goal is None)."""
+        return [spec for spec in self.specs.values() if spec.is_relevant(goal)]
+
+    def get_capabilities_description(self, goal=None):
+        """
+        Returns a structured description of the agents for the Planner LLM, generated
+        from the registered specs and limited to the agents relevant to `goal`.
         """
+        names = tuple(spec.name for spec in self.select_agents(goal))
+        description = self._descriptions.get(names)
+        if description is None:
+            blocks = [self.specs[name].describe(number) for number, name in enumerate(names, start=1)]
+            description = ("Available Agents and their required inputs.\n"
+                           "CRITICAL: You MUST use the exact input key names provided for each agent.\n\n"
+                           + "\n\n".join(blocks))
+            self._descriptions[names] = description
+        return description
+
+
 AGENT_TOOLKIT = AgentRegistry()
 logging.info("Agent Registry initialized and fully upgraded.")
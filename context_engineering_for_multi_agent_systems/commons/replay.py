@@ -0,0 +1,327 @@
+# Record/replay for engine runs. Wrap the real clients to record every LLM,
+# embedding and vector-query request with its response and latency into a JSONL
+# log; later, serve the same run from the log with no network access:
+#
+#   client, pc = recording_clients(client, pc, "runs/2024-06-01.jsonl")
+#   context_engine(goal, client=client, pc=pc, ...)
+#   ...
+#   client, pc = replay_clients("runs/2024-06-01.jsonl", replay_latency=True)
+#   context_engine(goal, client=client, pc=pc, ...)   # same answers, no API calls
+#
+# Entries are keyed by a hash of the request, so replay does not depend on call
+# order and concurrent runs replay correctly. Queries are keyed on the logical
+# namespace, not the blue/green version serving it, so a log replays on a machine
+# whose pointer names other versions. Embeddings are stored as base64 float32.
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from .namespaces import logical_namespace
+
+
+class ReplayMissError(KeyError):
+    """
+    Raised in replay when a request was never recorded. The helpers let it through
+    their catch-alls and retries, so a miss fails the run instead of looking like an
+    empty result.
+    """
+
+
+class ReplayedAPIError(Exception):
+    """Re-raises a failure that was recorded, with the original HTTP status code."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _encode_vector(values):
+    return base64.b64encode(np.asarray(values, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
+
+
+def request_key(kind, request):
+    """A stable hash of a request. Vectors are hashed by their float32 bytes."""
+    canonical = dict(request)
+    if "vector" in canonical:
+        canonical["vector"] = hashlib.sha256(np.asarray(canonical["vector"], dtype=np.float32).tobytes()).hexdigest()
+    payload = json.dumps([kind, canonical], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _query_request(index_name, vector, namespace, top_k, include_metadata):
+    return {"index": index_name, "namespace": logical_namespace(namespace), "top_k": top_k,
+            "include_metadata": include_metadata, "vector": vector}
+
+
+def _open(path, mode):
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+
+class RecordLog:
+    """
+    The JSONL log of one or more recorded runs. Each line holds kind, key, latency_ms
+    and either a response or an error. Repeated identical requests are replayed in
+    the order they were recorded (the last one is reused after that).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._entries = None
+        self._positions = {}
+
+    # --- recording ---
+    def append(self, kind, key, latency_ms, response=None, error=None):
+        entry = {"kind": kind, "key": key, "latency_ms": round(latency_ms, 3)}
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["response"] = response
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self._file = _open(self.path, "a")
+                atexit.register(self.close)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # --- replay ---
+    def _load(self):
+        entries = {}
+        with _open(self.path, "r") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries.setdefault(entry["key"], []).append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # A log still being written (or cut off by a crash) ends mid-record; keep what is complete.
+                logging.warning(f"[Replay] '{self.path}' ends with an incomplete record; it was ignored.")
+        return entries
+
+    def lookup(self, key):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            recorded = self._entries.get(key)
+            if not recorded:
+                return None
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return recorded[min(position, len(recorded) - 1)]
+
+    def stats(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            counts = {}
+            for recorded in self._entries.values():
+                for entry in recorded:
+                    counts[entry["kind"]] = counts.get(entry["kind"], 0) + 1
+            return counts
+
+
+def _error_record(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return {"type": type(error).__name__, "message": str(error), "status_code": status}
+
+
+def _record_call(log, kind, request, call, serialize):
+    key = request_key(kind, request)
+    start = time.perf_counter()
+    try:
+        response = call()
+    except Exception as e:
+        log.append(kind, key, (time.perf_counter() - start) * 1000, error=_error_record(e))
+        raise
+    log.append(kind, key, (time.perf_counter() - start) * 1000, response=serialize(response))
+    return response
+
+
+# --- Serialization of the response fields the engine reads ---
+
+def _serialize_chat(response):
+    usage = getattr(response, "usage", None)
+    return {"content": response.choices[0].message.content,
+            "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+            if usage is not None else None}
+
+
+def _deserialize_chat(data):
+    usage = SimpleNamespace(**data["usage"]) if data.get("usage") else None
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=data["content"]))], usage=usage)
+
+
+def _serialize_embeddings(response):
+    return {"embeddings": [_encode_vector(item.embedding) for item in response.data]}
+
+
+def _deserialize_embeddings(data):
+    return SimpleNamespace(data=[SimpleNamespace(embedding=_decode_vector(vector), index=i)
+                                 for i, vector in enumerate(data["embeddings"])])
+
+
+def _serialize_query(response):
+    matches = []
+    for match in response["matches"]:
+        metadata = match.get("metadata") if hasattr(match, "get") else match["metadata"]
+        matches.append({"id": match["id"], "score": float(match["score"]), "metadata": dict(metadata or {})})
+    return {"matches": matches}
+
+
+# --- Recording wrappers ---
+
+class _RecordingChatCompletions:
+    def __init__(self, completions, log):
+        self._completions = completions
+        self._log = log
+
+    def create(self, **kwargs):
+        request = {key: kwargs.get(key) for key in ("model", "messages", "response_format")}
+        return _record_call(self._log, "chat", request, lambda: self._completions.create(**kwargs), _serialize_chat)
+
+
+class _RecordingEmbeddings:
+    def __init__(self, embeddings, log):
+        self._embeddings = embeddings
+        self._log = log
+
+    def create(self, **kwargs):
+        request = {"model": kwargs.get("model"), "input": kwargs.get("input")}
+        return _record_call(self._log, "embeddings", request, lambda: self._embeddings.create(**kwargs),
+                            _serialize_embeddings)
+
+
+class RecordingClient:
+    """Wraps an OpenAI client; chat and embedding calls are recorded, everything else passes through."""
+
+    def __init__(self, client, log):
+        self._client = client
+        self.log = log
+        self.chat = SimpleNamespace(completions=_RecordingChatCompletions(client.chat.completions, log))
+        self.embeddings = _RecordingEmbeddings(client.embeddings, log)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class RecordingIndex:
+    """Wraps a Pinecone index; queries are recorded, everything else passes through."""
+
+    def __init__(self, index, name, log):
+        self._index = index
+        self._name = name
+        self._log = log
+
+    def query(self, vector, namespace="", top_k=10, include_metadata=False, **kwargs):
+        request = _query_request(self._name, vector, namespace, top_k, include_metadata)
+        return _record_call(self._log, "query", request,
+                            lambda: self._index.query(vector=vector, namespace=namespace, top_k=top_k,
+                                                      include_metadata=include_metadata, **kwargs),
+                            _serialize_query)
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+
+class RecordingPinecone:
+    def __init__(self, pc, log):
+        self._pc = pc
+        self._log = log
+
+    def Index(self, name, *args, **kwargs):
+        return RecordingIndex(self._pc.Index(name, *args, **kwargs), name, self._log)
+
+    def __getattr__(self, name):
+        return getattr(self._pc, name)
+
+
+# --- Replay stand-ins ---
+
+class _Replayer:
+    def __init__(self, log, replay_latency, latency_scale):
+        self.log = log
+        self.replay_latency = replay_latency
+        self.latency_scale = latency_scale
+
+    def serve(self, kind, request, deserialize):
+        entry = self.log.lookup(request_key(kind, request))
+        if entry is None:
+            raise ReplayMissError(f"No recorded '{kind}' response for this request in '{self.log.path}'.")
+        if self.replay_latency and entry["latency_ms"]:
+            time.sleep(entry["latency_ms"] * self.latency_scale / 1000)
+        if "error" in entry:
+            error = entry["error"]
+            raise ReplayedAPIError(f"{error['type']}: {error['message']}", error.get("status_code"))
+        return deserialize(entry["response"])
+
+
+class ReplayClient:
+    """Serves chat and embedding responses from a RecordLog."""
+
+    def __init__(self, replayer):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: replayer.serve(
+                "chat", {key: kwargs.get(key) for key in ("model", "messages", "response_format")},
+                _deserialize_chat)))
+        self.embeddings = SimpleNamespace(
+            create=lambda **kwargs: replayer.serve(
+                "embeddings", {"model": kwargs.get("model"), "input": kwargs.get("input")},
+                _deserialize_embeddings))
+
+
+class ReplayIndex:
+    def __init__(self, replayer, name):
+        self._replayer = replayer
+        self._name = name
+
+    def query(self, vector, namespace="", top_k=10, include_metadata=False, **kwargs):
+        request = _query_request(self._name, vector, namespace, top_k, include_metadata)
+        return self._replayer.serve("query", request, lambda data: data)
+
+
+class ReplayPinecone:
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    def Index(self, name, *args, **kwargs):
+        return ReplayIndex(self._replayer, name)
+
+
+def recording_clients(client, pc, path):
+    """
+    Wraps real clients so every request made through them is recorded to `path`.
+    The log is closed at exit, or explicitly with `client.log.close()`.
+    """
+    log = RecordLog(path)
+    logging.info(f"[Replay] Recording API traffic to '{path}'.")
+    return RecordingClient(client, log), RecordingPinecone(pc, log)
+
+
+def replay_clients(path, replay_latency=False, latency_scale=1.0):
+    """
+    Stand-ins that serve the responses recorded in `path`. With replay_latency,
+    each response is delayed by its recorded latency times `latency_scale`.
+    """
+    replayer = _Replayer(RecordLog(path), replay_latency, latency_scale)
+    logging.info(f"[Replay] Serving API traffic from '{path}' (latency replay: {replay_latency}).")
+    return ReplayClient(replayer), ReplayPinecone(replayer)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from .tracing import current_span
+
+# List of simple, high-confidence patterns to detect injection attempts
+DEFAULT_INJECTION_PATTERNS = [
+    r"ignore previous instructions",
+    r"ignore all prior commands",
+    r"you are now in.*mode",
+    r"act as",
+    r"print your instructions",
+    # A simple pattern to catch attempts to inject system-level commands
+    r"sudo|apt-get|yum|pip install"
+]
+
+# Set SANITIZER_PATTERNS_PATH to a JSON file (a list of patterns, or {"patterns": [...]})
+# to replace the default rules without a code change.
+PATTERNS_PATH_ENV = "SANITIZER_PATTERNS_PATH"
+
+SanitizationVerdict = namedtuple("SanitizationVerdict", ["clean", "rule"])
+CLEAN = SanitizationVerdict(True, None)
+
+# A numbered backreference (\1 to \99) not preceded by an escaping backslash.
+_NUMBERED_BACKREFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]")
+
+
+def _check_pattern(pattern):
+    """Compiles one rule on its own, returning its group count. Raises ValueError for rules that can't be combined."""
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid sanitizer pattern {pattern!r}: {e}") from e
+    if _NUMBERED_BACKREFERENCE.search(pattern):
+        # Group numbers shift once the rules are joined into one alternation.
+        raise ValueError(f"Sanitizer pattern {pattern!r} uses a numbered backreference; use (?P<name>...) and (?P=name).")
+    return compiled.groups
+
+
+def _top_level_branches(pattern):
+    """Splits a pattern on '|' outside of groups, character classes and escapes."""
+    branches, current, depth, in_class, escaped = [], [], 0, False, False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            branches.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    branches.append("".join(current))
+    return branches
+
+
+def _leading_characters(patterns):
+    """
+    The set of characters any match must start with, or None if some rule doesn't
+    start with a plain required letter or digit. Used as a lookahead prefilter so
+    the scanner only tries the alternation at plausible positions.
+    """
+    chars = set()
+    for pattern in patterns:
+        for branch in _top_level_branches(pattern):
+            if not branch or not branch[0].isalnum() or branch[1:2] in ("*", "?", "{"):
+                return None
+            chars.add(branch[0].lower())
+    return chars
+
+
+class SanitizerEngine:
+    """
+    Scans text for prompt-injection patterns in a single pass. All rules are
+    compiled once into one case-insensitive alternation with a group per rule,
+    guarded by a lookahead on the characters a match can start with. Rules may
+    hold groups of their own; matches are mapped back to rules by group number.
+    Verdicts are kept in an LRU keyed by a hash of the text, so chunks that are
+    retrieved again are never rescanned.
+    """
+
+    def __init__(self, patterns=None, cache_size=4096):
+        self.patterns = list(patterns or DEFAULT_INJECTION_PATTERNS)
+        # Each rule's wrapping group is the outermost group closed by its match, so
+        # match.lastindex names the wrapping group even when the rule has inner groups.
+        self._rule_by_group = {}
+        group = 1
+        for pattern in self.patterns:
+            self._rule_by_group[group] = pattern
+            group += 1 + _check_pattern(pattern)
+        alternation = "|".join(f"({pattern})" for pattern in self.patterns)
+        leading = _leading_characters(self.patterns)
+        if leading:
+            alternation = f"(?=[{re.escape(''.join(sorted(leading)))}])(?:{alternation})"
+        try:
+            self._regex = re.compile(alternation, re.IGNORECASE)
+        except re.error as e:
+            # e.g. two rules defining the same group name
+            raise ValueError(f"Sanitizer patterns can't be combined: {e}") from e
+        # Identifies the rule set, so verdicts stored at ingestion can be checked against the active rules.
+        self.fingerprint = hashlib.blake2b(json.dumps(self.patterns).encode("utf-8"), digest_size=8).hexdigest()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_config(cls, path, **kwargs):
+        """Builds an engine from a JSON file holding a list of patterns or {"patterns": [...]}."""
+        with open(path, "r") as f:
+            config = json.load(f)
+        patterns = config["patterns"] if isinstance(config, dict) else config
+        return cls(patterns, **kwargs)
+
+    def _scan(self, text):
+        match = self._regex.search(text)
+        if match is None:
+            return CLEAN
+        return SanitizationVerdict(False, self._rule_by_group[match.lastindex])
+
+    def scan(self, text):
+        """Returns the verdict for one text, using the cache when possible."""
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            verdict = self._cache.get(key)
+            if verdict is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        span = current_span()
+        if span is not None:
+            span.add("sanitizer_cache_hits" if verdict is not None else "sanitizer_cache_misses")
+        if verdict is not None:
+            return verdict
+        verdict = self._scan(text)
+        with self._lock:
+            self._cache[key] = verdict
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return verdict
+
+    def sanitize_many(self, texts):
+        """Returns one verdict per text, in order."""
+        return [self.scan(text) for text in texts]
+
+
+_default_engine = None
+_default_lock = threading.Lock()
+
+
+def get_default_sanitizer():
+    """The process-wide engine, loaded from SANITIZER_PATTERNS_PATH if it is set."""
+    global _default_engine
+    if _default_engine is None:
+        with _default_lock:
+            if _default_engine is None:
+                path = os.getenv(PATTERNS_PATH_ENV)
+                _default_engine = SanitizerEngine.from_config(path) if path else SanitizerEngine()
+    return _default_engine
+
+
+def benchmark_sanitizer(texts, patterns=None):
+    """Compares chunks per second of the per-pattern loop and the compiled engine (cold and cached)."""
+    texts = list(texts)
+    patterns = list(patterns or DEFAULT_INJECTION_PATTERNS)
+
+    def legacy():
+        for text in texts:
+            for pattern in patterns:
+                if re.search(pattern, text, re.IGNORECASE):
+                    break
+
+    engine = SanitizerEngine(patterns, cache_size=len(texts) + 1)
+    runs = {
+        "legacy": legacy,
+        "compiled_cold": lambda: engine.sanitize_many(texts),
+        "compiled_cached": lambda: engine.sanitize_many(texts),
+    }
+    results = {}
+    for name, run in runs.items():
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": elapsed, "chunks_per_second": len(texts) / elapsed if elapsed else float("inf")}
+        logging.info(f"[Sanitizer Benchmark] {name}: {results[name]['chunks_per_second']:.0f} chunks/s")
+    return results
+
+
+if __name__ == "__main__":
+    chunk = ("The Perseverance rover's primary mission on Mars is to seek signs of ancient life "
+             "and collect samples of rock and regolith for possible return to Earth. ") * 20
+    print(benchmark_sanitizer([f"{i} {chunk}" for i in range(5000)]))
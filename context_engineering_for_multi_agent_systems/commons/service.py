@@ -0,0 +1,381 @@
+# A long-running Context Engine service. Clients, the index handle, tokenizers and
+# the registry's agent bindings are built once and stay warm; goals wait in a
+# bounded, priority-ordered admission queue (commons/admission.py) and run on a pool
+# of worker threads. Serve it over HTTP or a Unix socket from the project directory:
+#
+#   python -m commons.service --port 8080              # real clients (initialize_clients)
+#   python main.py --offline --socket /tmp/engine.sock  # from the repository root
+#
+#   POST /requests            {"goal": "...", "tenant": "...", "priority": "interactive", "wait": 30}
+#                             -> 202 (200 once done within `wait` seconds, 503 when shed)
+#   GET  /requests/<id>       status, timings and the result
+#   GET  /requests/<id>/plan  the plan the engine made for it
+#   GET  /status              queue depth, in-flight requests and totals
+#   GET  /metrics             Prometheus metrics (commons/metrics.py)
+#
+# --offline runs against stand-in clients injected by the caller (main.py passes
+# the ones from benchmarks/fakes.py) and estimates token counts instead of loading
+# a tokenizer, so the service starts with no network access.
+import argparse
+import itertools
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .admission import DEFAULT_PRIORITY, DEFAULT_TENANT, AdmissionController, AdmissionRejected
+from .engine import context_engine
+from .metrics import get_registry
+from .namespaces import get_namespace_pointer
+from .registry import AGENT_TOOLKIT
+from .tokens import exact_counts_enabled, get_encoder, use_exact_counts
+
+DEFAULT_CONFIG = {
+    "index_name": "genai-mas-mcp-ch3",
+    "generation_model": "qwen-plus",
+    "embedding_model": "text-embedding-v2",
+    "namespace_context": "ContextLibrary",
+    "namespace_knowledge": "KnowledgeStore",
+}
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+# Finished requests kept for status lookups; the oldest are dropped first.
+HISTORY_SIZE = 1000
+
+# Started services; the queue-depth gauge sums over all of them.
+_RUNNING_SERVICES = weakref.WeakSet()
+
+
+def _total_queue_depth():
+    return sum(sum(service.admission.status()["waiting"].values()) for service in list(_RUNNING_SERVICES))
+
+
+class EngineRequest:
+    """One goal submitted to the service, with its status and timings."""
+
+    def __init__(self, request_id, goal, tenant=DEFAULT_TENANT, priority=DEFAULT_PRIORITY):
+        self.request_id = request_id
+        self.goal = goal
+        self.tenant = tenant
+        self.priority = priority
+        self.ticket = None
+        self.status = "queued"
+        self.result = None
+        self.trace = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def timings(self):
+        """Milliseconds spent queued and running so far; run_ms is None until the request starts."""
+        end = self.finished_at or time.time()
+        started = self.started_at or end
+        return {"queued_ms": round((started - self.submitted_at) * 1000, 3),
+                "run_ms": round((end - self.started_at) * 1000, 3) if self.started_at else None,
+                "total_ms": round((end - self.submitted_at) * 1000, 3)}
+
+    def to_dict(self, include_result=True):
+        data = {"id": self.request_id, "goal": self.goal, "tenant": self.tenant, "priority": self.priority,
+                "status": self.status, "timings": self.timings()}
+        if self.ticket is not None:
+            data["estimated_tokens"] = self.ticket.cost
+        if self.trace is not None:
+            data["engine_status"] = self.trace.status
+            if self.trace.tracer is not None:
+                data["spans_ms"] = self.trace.tracer.summary()
+        if self.error:
+            data["error"] = self.error
+        if include_result and self.status == "done":
+            data["result"] = self.result
+        return data
+
+
+class EngineService:
+    """
+    Runs goals through context_engine on a worker pool, admitted by an
+    AdmissionController (by default `workers` at a time in arrival order, with at
+    most `queue_size` waiting). Everything the engine builds per client is warmed
+    once in start() and reused by every request.
+    """
+
+    def __init__(self, client, pc, config=None, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 admission=None):
+        self.client = client
+        self.pc = pc
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.admission = admission or AdmissionController(max_concurrent=workers, max_waiting=queue_size)
+        # Admission bounds the work in flight, so the pool never queues.
+        self.workers = self.admission.max_concurrent
+        self._pool = None
+        self._requests = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.totals = {"submitted": 0, "rejected": 0, "shed": 0, "done": 0, "failed": 0}
+        self.started_at = None
+
+    # --- lifecycle ---
+    def warm_up(self):
+        """
+        Builds the tokenizer (unless token counts are estimated), the index handle,
+        the agent bindings and the capability cache.
+        """
+        start = time.perf_counter()
+        if exact_counts_enabled():
+            get_encoder(self.config["generation_model"])
+        index = self.pc.Index(self.config["index_name"])
+        pointer = get_namespace_pointer()
+        AGENT_TOOLKIT.bind(client=self.client, index=index, generation_model=self.config["generation_model"],
+                           embedding_model=self.config["embedding_model"],
+                           namespace_context=pointer.resolve(self.config["namespace_context"]),
+                           namespace_knowledge=pointer.resolve(self.config["namespace_knowledge"]))
+        AGENT_TOOLKIT.get_capabilities_description()
+        logging.info(f"[服务] Warmed up in {(time.perf_counter() - start) * 1000:.1f} ms.")
+
+    def start(self):
+        self.warm_up()
+        self.started_at = time.time()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="engine-worker")
+        get_registry().gauge("engine_service_queue_depth", "Requests waiting in the service queues.",
+                             _total_queue_depth)
+        _RUNNING_SERVICES.add(self)
+        logging.info(f"[服务] Started {self.workers} workers (queue size {self.admission.max_waiting}).")
+        return self
+
+    def stop(self, timeout=None):
+        """Lets queued requests finish, then stops the workers."""
+        self.admission.drain(timeout)
+        self._pool.shutdown(wait=False)
+        _RUNNING_SERVICES.discard(self)
+
+    # --- requests ---
+    def submit(self, goal, tenant=DEFAULT_TENANT, priority=DEFAULT_PRIORITY):
+        """
+        Queues a goal for admission and returns its EngineRequest. Raises
+        AdmissionRejected when the queue is full, ValueError for an unknown priority.
+        """
+        request = EngineRequest(f"req-{next(self._ids)}", goal, tenant, priority)
+        # Registered before it is queued, so a worker never finishes a request that can't be looked up.
+        with self._lock:
+            self._requests[request.request_id] = request
+        try:
+            request.ticket = self.admission.submit(
+                goal, tenant, priority, on_admit=lambda ticket: self._pool.submit(self._run, request, ticket),
+                on_shed=lambda ticket: self._shed(request, ticket))
+        except (AdmissionRejected, ValueError):
+            with self._lock:
+                del self._requests[request.request_id]
+                self.totals["rejected"] += 1
+            raise
+        with self._lock:
+            self.totals["submitted"] += 1
+            while len(self._requests) > HISTORY_SIZE:
+                oldest_id = next(iter(self._requests))
+                if not self._requests[oldest_id].done.is_set():
+                    break
+                del self._requests[oldest_id]
+        return request
+
+    def get(self, request_id):
+        with self._lock:
+            return self._requests.get(request_id)
+
+    def status(self):
+        admission = self.admission.status()
+        with self._lock:
+            totals = dict(self.totals)
+        return {"queue_depth": sum(admission["waiting"].values()), "queue_size": admission["max_waiting"],
+                "running": sum(admission["running"].values()), "workers": self.workers, "totals": totals,
+                "admission": admission,
+                "uptime_seconds": round(time.time() - self.started_at, 3) if self.started_at else None}
+
+    def _shed(self, request, ticket):
+        request.status = "shed"
+        request.error = ticket.reason
+        request.finished_at = time.time()
+        with self._lock:
+            self.totals["shed"] += 1
+        request.done.set()
+
+    def _run(self, request, ticket):
+        request.status = "running"
+        request.started_at = time.time()
+        try:
+            request.result, request.trace = context_engine(request.goal, client=self.client, pc=self.pc,
+                                                           **self.config)
+            request.status = "done" if request.trace.status == "Success" else "failed"
+        except Exception as e:
+            logging.error(f"[服务] Request {request.request_id} failed: {e}")
+            request.error = str(e)
+            request.status = "failed"
+        finally:
+            self.admission.release(ticket, request.trace)
+        request.finished_at = time.time()
+        with self._lock:
+            self.totals[request.status] += 1
+        request.done.set()
+        logging.info(f"[服务] {request.request_id} {request.status} in {request.timings()['total_ms']:.0f} ms.")
+
+
+# --- HTTP API ---
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _request_from_path(self, parts):
+        request = self.service.get(parts[1])
+        if request is None:
+            self._send_json(404, {"error": f"Unknown request '{parts[1]}'."})
+        return request
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["status"]:
+            self._send_json(200, self.service.status())
+        elif parts == ["metrics"]:
+            body = get_registry().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif len(parts) == 2 and parts[0] == "requests":
+            request = self._request_from_path(parts)
+            if request is not None:
+                self._send_json(200, request.to_dict())
+        elif len(parts) == 3 and parts[0] == "requests" and parts[2] == "plan":
+            request = self._request_from_path(parts)
+            if request is not None:
+                plan = request.trace.plan if request.trace is not None else None
+                self._send_json(200, {"id": request.request_id, "status": request.status, "plan": plan})
+        else:
+            self._send_json(404, {"error": f"No route for GET {self.path}."})
+
+    def do_POST(self):
+        if self.path.split("?")[0].rstrip("/") != "/requests":
+            self._send_json(404, {"error": f"No route for POST {self.path}."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            goal = body["goal"]
+            if not isinstance(goal, str) or not goal.strip():
+                raise ValueError("'goal' must be a non-empty string.")
+            wait_seconds = float(body.get("wait") or 0)
+            tenant = str(body.get("tenant") or DEFAULT_TENANT)
+            priority = body.get("priority") or DEFAULT_PRIORITY
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {"error": f"Expected a JSON body with a 'goal': {e}"})
+            return
+        try:
+            request = self.service.submit(goal, tenant, priority)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except AdmissionRejected as e:
+            self._send_json(503, {"error": str(e), **self.service.status()})
+            return
+        if wait_seconds > 0:
+            request.done.wait(wait_seconds)
+        payload = request.to_dict()
+        payload["queue_depth"] = self.service.status()["queue_depth"]
+        if request.status == "shed":
+            self._send_json(503, payload)
+        else:
+            self._send_json(200 if request.done.is_set() else 202, payload)
+
+    def address_string(self):
+        # Unix-socket peers have no (host, port) address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logging.debug(f"[服务] {self.address_string()} {format % args}")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, host="127.0.0.1", port=8080, socket_path=None):
+    """
+    Starts the HTTP API for a started EngineService on a daemon thread, on
+    `socket_path` (a Unix socket) if given, else on host:port. Returns the server.
+    """
+    handler = type("ServiceHandler", (_ServiceHandler,), {"service": service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _UnixHTTPServer(socket_path, handler)
+        where = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        where = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, name="engine-service", daemon=True).start()
+    logging.info(f"[服务] Serving the Context Engine on {where}")
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Context Engine as a long-running service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--socket", default=None, help="Serve on this Unix socket instead of host:port.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--tenant-limit", action="append", default=[], metavar="TENANT=N",
+                        help="Cap a tenant's concurrent goals (repeatable).")
+    parser.add_argument("--default-tenant-limit", type=int, default=None)
+    parser.add_argument("--token-budget", type=int, default=None, help="Estimated tokens allowed in flight.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Use the injected stand-in clients and estimated token counts (see main.py).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, offline_clients=None):
+    """
+    Runs the service until interrupted. `offline_clients` is a callable returning
+    (client, pc, config) stand-ins; --offline requires it.
+    """
+    args = parse_args(argv)
+    if args.offline:
+        if offline_clients is None:
+            raise SystemExit("--offline needs stand-in clients; start it with `python main.py --offline`.")
+        # No tokenizer download: token counts are estimated.
+        use_exact_counts(False)
+        client, pc, config = offline_clients()
+    else:
+        from .utils import initialize_clients
+        client, pc = initialize_clients()
+        config = None
+    tenant_limits = {tenant: int(limit) for tenant, limit in (item.split("=", 1) for item in args.tenant_limit)}
+    admission = AdmissionController(max_concurrent=args.workers, max_waiting=args.queue_size,
+                                    tenant_limits=tenant_limits, default_tenant_limit=args.default_tenant_limit,
+                                    token_budget=args.token_budget)
+    service = EngineService(client, pc, config=config, admission=admission).start()
+    server = serve(service, host=args.host, port=args.port, socket_path=args.socket)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        logging.info("[服务] Shutting down.")
+    finally:
+        server.shutdown()
+        service.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from .ingestion import UpsertEngine
+from .namespaces import logical_namespace
+
+# A snapshot is a directory holding:
+#   embeddings-00000.npy ...  float32 matrices, one row per vector
+#   metadata.jsonl            one line per vector: id, namespace, content_hash, part, row, metadata
+#   snapshot.json             embedding model, dimension, vector count and part files
+SNAPSHOT_PART_ROWS = 10000
+
+
+class SnapshotWriter:
+    """
+    Writes embeddings produced during ingestion to a snapshot directory, so the
+    index can later be rebuilt or cloned without calling the embedding API.
+    Namespaces are recorded by their logical name, without the version suffix.
+    """
+
+    def __init__(self, directory, embedding_model, part_rows=SNAPSHOT_PART_ROWS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.embedding_model = embedding_model
+        self.part_rows = part_rows
+        self.parts = []
+        self.count = 0
+        self.dimension = None
+        self._rows = []
+        self._metadata = open(os.path.join(directory, "metadata.jsonl"), "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, namespace, vectors, content_hashes):
+        """Appends upserted vectors, each with the content hash it was embedded from."""
+        for vector, content_hash in zip(vectors, content_hashes):
+            if self.dimension is None:
+                self.dimension = len(vector["values"])
+            self._metadata.write(json.dumps({
+                "id": vector["id"],
+                "namespace": logical_namespace(namespace),
+                "content_hash": content_hash,
+                "part": len(self.parts),
+                "row": len(self._rows),
+                "metadata": vector.get("metadata", {}),
+            }) + "\n")
+            self._rows.append(vector["values"])
+            self.count += 1
+            if len(self._rows) >= self.part_rows:
+                self._write_part()
+
+    def _write_part(self):
+        name = f"embeddings-{len(self.parts):05d}.npy"
+        np.save(os.path.join(self.directory, name), np.asarray(self._rows, dtype=np.float32))
+        self.parts.append(name)
+        self._rows = []
+
+    def close(self):
+        if self._metadata.closed:
+            return
+        if self._rows:
+            self._write_part()
+        self._metadata.close()
+        with open(os.path.join(self.directory, "snapshot.json"), "w") as f:
+            json.dump({"embedding_model": self.embedding_model, "dimension": self.dimension,
+                       "count": self.count, "parts": self.parts}, f, indent=2)
+        logging.info(f"[Snapshot] Wrote {self.count} embeddings to '{self.directory}'.")
+
+
+def read_snapshot_info(directory):
+    with open(os.path.join(directory, "snapshot.json"), "r") as f:
+        return json.load(f)
+
+
+def iter_snapshot_entries(directory):
+    """Streams the metadata lines of a snapshot without touching the embeddings."""
+    with open(os.path.join(directory, "metadata.jsonl"), "r") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_snapshot(directory):
+    """
+    Streams (namespace, vector record, content_hash) from a snapshot. Embedding
+    parts are memory-mapped, so loading large snapshots stays I/O bound.
+    """
+    info = read_snapshot_info(directory)
+    parts = [np.load(os.path.join(directory, name), mmap_mode="r") for name in info["parts"]]
+    for entry in iter_snapshot_entries(directory):
+        values = parts[entry["part"]][entry["row"]].tolist()
+        vector = {"id": entry["id"], "values": values, "metadata": entry["metadata"]}
+        yield entry["namespace"], vector, entry["content_hash"]
+
+
+def load_snapshot(directory, index, namespace_map=None, embedding_model=None):
+    """
+    Bulk-loads a snapshot into an index (Pinecone or LocalIndex) without any
+    embedding calls. `namespace_map` renames logical namespaces on the way in,
+    e.g. to load into a fresh blue/green version. Returns vectors per namespace.
+    """
+    info = read_snapshot_info(directory)
+    if embedding_model and info["embedding_model"] != embedding_model:
+        raise ValueError(f"Snapshot was embedded with '{info['embedding_model']}', not '{embedding_model}'.")
+    namespace_map = namespace_map or {}
+    engines = {}
+    try:
+        for namespace, vector, _ in iter_snapshot(directory):
+            target = namespace_map.get(namespace, namespace)
+            if target not in engines:
+                engines[target] = UpsertEngine(index, target)
+            engines[target].submit([vector])
+    finally:
+        for engine in engines.values():
+            engine.flush()
+    counts = {namespace: engine.vectors_uploaded for namespace, engine in engines.items()}
+    logging.info(f"[Snapshot] Loaded {counts} from '{directory}'.")
+    return counts
+
+
+class LocalIndex:
+    """
+    A small in-memory vector index exposing the subset of the Pinecone Index API
+    used by this project (upsert, query, delete, describe_index_stats). Scores are
+    cosine similarities, matching the 'cosine' metric of the Pinecone index.
+    """
+
+    def __init__(self):
+        self._namespaces = {}
+
+    def _namespace(self, namespace):
+        return self._namespaces.setdefault(namespace, {"ids": [], "rows": {}, "values": [], "metadata": [],
+                                                       "matrix": None})
+
+    def upsert(self, vectors, namespace=""):
+        ns = self._namespace(namespace)
+        for vector in vectors:
+            values = np.asarray(vector["values"], dtype=np.float32)
+            row = ns["rows"].get(vector["id"])
+            if row is None:
+                ns["rows"][vector["id"]] = len(ns["ids"])
+                ns["ids"].append(vector["id"])
+                ns["values"].append(values)
+                ns["metadata"].append(vector.get("metadata", {}))
+            else:
+                ns["values"][row] = values
+                ns["metadata"][row] = vector.get("metadata", {})
+        ns["matrix"] = None
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, delete_all=False, namespace=""):
+        if delete_all:
+            self._namespaces.pop(namespace, None)
+            return {}
+        ns = self._namespace(namespace)
+        removed = set(ids or [])
+        keep = [i for i, vector_id in enumerate(ns["ids"]) if vector_id not in removed]
+        ns["ids"] = [ns["ids"][i] for i in keep]
+        ns["values"] = [ns["values"][i] for i in keep]
+        ns["metadata"] = [ns["metadata"][i] for i in keep]
+        ns["rows"] = {vector_id: i for i, vector_id in enumerate(ns["ids"])}
+        ns["matrix"] = None
+        return {}
+
+    def query(self, vector, namespace="", top_k=10, include_metadata=False, **kwargs):
+        ns = self._namespaces.get(namespace)
+        if not ns or not ns["ids"]:
+            return {"matches": []}
+        if ns["matrix"] is None:
+            matrix = np.vstack(ns["values"])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            ns["matrix"] = matrix / np.where(norms == 0, 1, norms)
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = ns["matrix"] @ query
+        top = np.argsort(-scores)[:top_k]
+        matches = []
+        for i in top:
+            match = {"id": ns["ids"][i], "score": float(scores[i])}
+            if include_metadata:
+                match["metadata"] = ns["metadata"][i]
+            matches.append(match)
+        return {"matches": matches}
+
+    def describe_index_stats(self):
+        return SimpleNamespace(namespaces={name: SimpleNamespace(vector_count=len(ns["ids"]))
+                                           for name, ns in self._namespaces.items()})
@@ -0,0 +1,161 @@
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+
+from .chunking import chunk_text, get_tokenizer
+from .tracing import current_span
+
+FALLBACK_ENCODING = "cl100k_base"
+COUNT_CACHE_SIZE = 8192
+# When False, "exact" counts fall back to estimate_tokens and no tokenizer is ever
+# loaded (tiktoken downloads its encodings on first use); see use_exact_counts.
+_exact_counts = True
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder(model="qwen-plus"):
+    """Returns the tiktoken encoder for a model, resolved and built once per model."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Fallback for models that might not be in the tiktoken registry
+        return get_tokenizer(FALLBACK_ENCODING)
+
+
+class _CountCache:
+    """A thread-safe LRU of exact token counts keyed by (model, text)."""
+
+    def __init__(self, maxsize=COUNT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def put(self, key, count):
+        with self._lock:
+            self._entries[key] = count
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Strings are immutable, so a text's count never changes; blueprints and step
+# outputs are counted over and over while a plan runs.
+_COUNT_CACHE = _CountCache()
+
+
+def estimate_tokens(text):
+    """
+    A fast estimate for pre-checks, with no tokenizer involved: roughly four
+    ASCII characters per token, and one token per non-ASCII (e.g. CJK) character.
+    """
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
+
+
+def use_exact_counts(enabled):
+    """Switches exact counting on or off process-wide, e.g. off for a service with no network access."""
+    global _exact_counts
+    _exact_counts = enabled
+
+
+def exact_counts_enabled():
+    return _exact_counts
+
+
+def count_tokens(text, model="qwen-plus", exact=True):
+    """Counts the tokens of a text for a model, memoized. Pass exact=False for a cheap estimate."""
+    if not exact or not _exact_counts:
+        return estimate_tokens(text)
+    key = (model, text)
+    count = _COUNT_CACHE.get(key)
+    span = current_span()
+    if span is not None:
+        span.add("token_cache_hits" if count is not None else "token_cache_misses")
+    if count is None:
+        count = len(get_encoder(model).encode(text))
+        _COUNT_CACHE.put(key, count)
+    return count
+
+
+def split_text(text, max_tokens, overlap=0):
+    """
+    Splits a text into overlapping pieces of at most `max_tokens` tokens. Uses the
+    token chunker, or, when exact counts are off, cuts by the estimate_tokens cost
+    of each character (at whitespace where possible) so no tokenizer is loaded.
+    """
+    if _exact_counts:
+        return chunk_text(text, chunk_size=max_tokens, overlap=overlap)
+    if overlap >= max_tokens:
+        raise ValueError("Chunk overlap must be smaller than the chunk size.")
+
+    # Costs in quarter tokens: an ASCII character is 1, anything else 4 (see estimate_tokens).
+    def cost(char):
+        return 1 if char < "\x80" else 4
+
+    pieces = []
+    start, length = 0, len(text)
+    while start < length:
+        end, budget = start, max_tokens * 4
+        while end < length and budget >= cost(text[end]):
+            budget -= cost(text[end])
+            end += 1
+        end = max(end, start + 1)
+        if end < length:
+            cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+            if cut > start:
+                end = cut + 1
+        pieces.append(text[start:end])
+        if end >= length:
+            break
+        next_start, budget = end, overlap * 4
+        while next_start > start + 1 and budget >= cost(text[next_start - 1]):
+            next_start -= 1
+            budget -= cost(text[next_start])
+        start = next_start
+    return pieces
+
+
+def count_tokens_many(texts, model="qwen-plus", num_threads=8, use_thread_pool=False):
+    """
+    Counts tokens for many texts at once. Cached counts are reused; the rest are
+    encoded together with encode_batch, or on a thread pool if use_thread_pool is set.
+    """
+    texts = list(texts)
+    if not _exact_counts:
+        return [estimate_tokens(text) for text in texts]
+    counts = [_COUNT_CACHE.get((model, text)) for text in texts]
+    missing = [i for i, count in enumerate(counts) if count is None]
+    if missing:
+        encoder = get_encoder(model)
+        pending = [texts[i] for i in missing]
+        if use_thread_pool:
+            with ThreadPoolExecutor(max_workers=num_threads) as pool:
+                new_counts = list(pool.map(lambda text: len(encoder.encode(text)), pending))
+        else:
+            new_counts = [len(tokens) for tokens in encoder.encode_batch(pending, num_threads=num_threads)]
+        for i, count in zip(missing, new_counts):
+            counts[i] = count
+            _COUNT_CACHE.put((model, texts[i]), count)
+    return counts
+
+
+def count_cache_stats():
+    return {"hits": _COUNT_CACHE.hits, "misses": _COUNT_CACHE.misses}
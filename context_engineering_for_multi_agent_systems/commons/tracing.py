@@ -0,0 +1,205 @@
+# Span-based timeline tracing for engine runs. A Tracer is activated per run
+# (context_engine does this) and every span opened below it, in any agent or
+# helper, is recorded with its parent, timing and attributes. Work handed to
+# thread pools keeps its parent span when wrapped with in_current_context().
+# Export a run with tracer.export_chrome(path) (chrome://tracing, Perfetto) or
+# tracer.export_otlp(path) (OTLP/JSON, for OpenTelemetry collectors and viewers).
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+SERVICE_NAME = "context-engine"
+
+_active_tracer = contextvars.ContextVar("active_tracer", default=None)
+_active_span = contextvars.ContextVar("active_span", default=None)
+
+
+class Span:
+    """One timed operation. `attributes` hold counts such as tokens, retries and cache hits."""
+
+    __slots__ = ("tracer", "name", "span_id", "parent_id", "start_ns", "end_ns", "thread_id",
+                 "attributes", "events", "error")
+
+    def __init__(self, tracer, name, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = dict(attributes)
+        self.events = []
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount=1):
+        """Increments a numeric attribute, e.g. span.add("cache_hits")."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def event(self, name, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Tracer:
+    """Collects the spans of one run."""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Total milliseconds per span name, longest first."""
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def to_chrome_trace(self):
+        """The spans as Chrome trace events ('X' complete events plus instant events)."""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span.attributes)
+            if span.error:
+                args["error"] = span.error
+            events.append({"name": span.name, "cat": span.name.split(".")[0], "ph": "X", "pid": pid,
+                           "tid": span.thread_id, "ts": span.start_ns / 1000,
+                           "dur": ((span.end_ns or span.start_ns) - span.start_ns) / 1000, "args": args})
+            for time_ns, name, attributes in span.events:
+                events.append({"name": name, "cat": span.name.split(".")[0], "ph": "i", "s": "t", "pid": pid,
+                               "tid": span.thread_id, "ts": time_ns / 1000, "args": attributes})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"trace_id": self.trace_id, "name": self.name}}
+
+    def to_otlp(self):
+        """The spans as an OTLP/JSON ExportTraceServiceRequest."""
+        spans = []
+        for span in self.spans:
+            record = {"traceId": self.trace_id, "spanId": span.span_id, "name": span.name, "kind": 1,
+                      "startTimeUnixNano": str(span.start_ns),
+                      "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                      "attributes": _otlp_attributes(span.attributes),
+                      "events": [{"timeUnixNano": str(time_ns), "name": name,
+                                  "attributes": _otlp_attributes(attributes)}
+                                 for time_ns, name, attributes in span.events],
+                      "status": {"code": 2, "message": span.error} if span.error else {"code": 1}}
+            if span.parent_id:
+                record["parentSpanId"] = span.parent_id
+            spans.append(record)
+        resource = {"attributes": _otlp_attributes({"service.name": SERVICE_NAME, "run.name": self.name})}
+        return {"resourceSpans": [{"resource": resource,
+                                   "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]}]}
+
+    def export_chrome(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False, default=str)
+        return path
+
+    def export_otlp(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False, default=str)
+        return path
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+@contextlib.contextmanager
+def start_run(name="run"):
+    """Activates a new Tracer for the current context and yields it."""
+    tracer = Tracer(name)
+    tracer_token = _active_tracer.set(tracer)
+    span_token = _active_span.set(None)
+    try:
+        yield tracer
+    finally:
+        _active_span.reset(span_token)
+        _active_tracer.reset(tracer_token)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times a block as a child of the current span. Yields the Span, or None when no
+    run is being traced, so callers guard attribute updates with `if s:`.
+    """
+    tracer = _active_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    parent = _active_span.get()
+    current = Span(tracer, name, parent.span_id if parent else None, attributes)
+    token = _active_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _active_span.reset(token)
+        tracer._record(current)
+
+
+def current_span():
+    return _active_span.get()
+
+
+def current_tracer():
+    return _active_tracer.get()
+
+
+def record_retry(retry_state):
+    """tenacity `before_sleep` hook: records the failed attempt on the current span."""
+    current = _active_span.get()
+    if current is None:
+        return
+    current.add("retries")
+    outcome = retry_state.outcome
+    error = outcome.exception() if outcome is not None else None
+    sleep = retry_state.next_action.sleep if retry_state.next_action else None
+    current.event("retry", function=getattr(retry_state.fn, "__name__", "call"),
+                  attempt=retry_state.attempt_number, error=f"{type(error).__name__}: {error}" if error else "",
+                  sleep_seconds=sleep)
+
+
+def in_current_context(fn):
+    """
+    Wraps `fn` to run in a copy of the caller's context, so thread-pool tasks
+    record their spans under the span that submitted them.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
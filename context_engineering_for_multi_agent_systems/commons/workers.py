@@ -0,0 +1,227 @@
+# Out-of-process agent workers: each worker is a subprocess running one agent,
+# talking to the engine over stdin/stdout with length-prefixed frames. A request
+# frame carries the serialized MCP message and the run's context: the namespaces
+# the engine resolved for the run and its model names, so a worker serves every
+# step of a run from the same namespace versions. Run one by hand with:
+#   python -m commons.workers --agent Researcher --config '{"index_name": "...", ...}'
+import argparse
+import importlib
+import json
+import logging
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+
+from .mcp import MCPMessage
+
+_HEADER = struct.Struct(">I")
+# Seconds a worker gets to answer one request before it is killed and replaced.
+DEFAULT_CALL_TIMEOUT = 120
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_frame(stream, payload):
+    """Writes one length-prefixed UTF-8 frame."""
+    data = payload.encode("utf-8")
+    stream.write(_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def read_frame(stream):
+    """Reads one frame, or returns None when the stream is closed."""
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (length,) = _HEADER.unpack(header)
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return data.decode("utf-8")
+
+
+class WorkerError(RuntimeError):
+    """Raised in the engine when a worker reports a failure, dies or times out."""
+
+
+# --- Worker side ---
+
+def default_agent_factory(agent_name, config):
+    """
+    Builds the agent the way the engine would: real API clients and the shared
+    registry. Returns run(mcp_message, context). Model and namespace names come from
+    the run's context; names missing from it fall back to `config`. Namespaces from
+    `config` are resolved through the blue/green pointer.
+    """
+    from .namespaces import get_namespace_pointer
+    from .registry import AGENT_TOOLKIT
+    from .utils import initialize_clients
+
+    client, pc = initialize_clients()
+    index = pc.Index(config["index_name"])
+    pointer = get_namespace_pointer()
+
+    def run(mcp_message, context):
+        agent = AGENT_TOOLKIT.get_agent(
+            agent_name, client=client, index=index,
+            generation_model=context.get("generation_model") or config["generation_model"],
+            embedding_model=context.get("embedding_model") or config["embedding_model"],
+            namespace_context=context.get("namespace_context") or pointer.resolve(config["namespace_context"]),
+            namespace_knowledge=context.get("namespace_knowledge") or pointer.resolve(config["namespace_knowledge"]))
+        return agent(mcp_message)
+
+    return run
+
+
+def load_factory(path):
+    """Imports a 'module:function' agent factory."""
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def serve(agent_name, config, factory_path=None):
+    """Worker main loop: one request frame in, one response frame out."""
+    frames_in, frames_out = sys.stdin.buffer, sys.stdout.buffer
+    # Agents print progress; keep stdout clean for frames.
+    sys.stdout = sys.stderr
+    factory = load_factory(factory_path) if factory_path else default_agent_factory
+    agent = factory(agent_name, config)
+    while True:
+        raw = read_frame(frames_in)
+        if raw is None:
+            break
+        try:
+            request = json.loads(raw)
+            response = agent(MCPMessage.from_dict(request["message"]), request.get("context") or {})
+            if not isinstance(response, MCPMessage):
+                response = MCPMessage.from_dict(response)
+            reply = {"ok": True, "message": json.loads(response.to_json())}
+        except Exception as e:
+            logging.error(f"[Worker:{agent_name}] An error occurred: {e}")
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        write_frame(frames_out, json.dumps(reply, ensure_ascii=False))
+
+
+# --- Engine side ---
+
+class AgentWorker:
+    """One worker subprocess and the pipe protocol to talk to it."""
+
+    def __init__(self, agent_name, config, factory_path=None, timeout=DEFAULT_CALL_TIMEOUT):
+        self.agent_name = agent_name
+        self.timeout = timeout
+        command = [sys.executable, "-m", "commons.workers", "--agent", agent_name, "--config", json.dumps(config)]
+        if factory_path:
+            command += ["--factory", factory_path]
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [_PROJECT_DIR, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def call(self, mcp_message, context=None):
+        """
+        Sends one request with the run's context (resolved namespaces and model
+        names) and waits for the reply. A worker that does not answer within
+        `timeout` seconds is killed, which closes the pipe and ends the read.
+        """
+        # The message's cached JSON is embedded as is.
+        frame = f'{{"context": {json.dumps(context or {}, ensure_ascii=False)}, "message": {mcp_message.to_json()}}}'
+        timed_out = threading.Event()
+
+        def kill_hung_worker():
+            timed_out.set()
+            self.process.kill()
+
+        timer = threading.Timer(self.timeout, kill_hung_worker) if self.timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            write_frame(self.process.stdin, frame)
+            raw = read_frame(self.process.stdout)
+        except BrokenPipeError:
+            raw = None
+        finally:
+            if timer:
+                timer.cancel()
+        if raw is None:
+            # The pipe closed mid-request: make sure the process is gone so the pool replaces it.
+            self.process.kill()
+            code = self.process.wait()
+            if timed_out.is_set():
+                raise WorkerError(f"Worker for '{self.agent_name}' timed out after {self.timeout}s and was killed.")
+            raise WorkerError(f"Worker for '{self.agent_name}' exited with code {code}.")
+        reply = json.loads(raw)
+        if not reply["ok"]:
+            raise WorkerError(f"Worker for '{self.agent_name}' failed: {reply['error']}")
+        return MCPMessage.from_dict(reply["message"])
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class AgentWorkerPool:
+    """
+    A fixed-size pool of workers for one agent type. Calling the pool with an MCP
+    message (and the run's context) sends it to an idle worker and blocks until the
+    reply arrives, so the pool can stand in for the in-process agent callable. Dead workers, and workers
+    killed for not answering within `timeout` seconds, are replaced.
+    """
+
+    def __init__(self, agent_name, size, config, factory_path=None, timeout=DEFAULT_CALL_TIMEOUT):
+        if size < 1:
+            raise ValueError(f"A worker pool for '{agent_name}' needs at least one worker, got {size}.")
+        self.agent_name = agent_name
+        self.config = config
+        self.factory_path = factory_path
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._add_worker()
+        logging.info(f"[Workers] Started {size} worker(s) for agent '{agent_name}'.")
+
+    def _add_worker(self):
+        worker = AgentWorker(self.agent_name, self.config, self.factory_path, self.timeout)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def __call__(self, mcp_message, context=None):
+        worker = self._idle.get()
+        try:
+            return worker.call(mcp_message, context)
+        finally:
+            if worker.alive():
+                self._idle.put(worker)
+            else:
+                logging.warning(f"[Workers] A worker for '{self.agent_name}' died or hung; starting a replacement.")
+                with self._lock:
+                    self._workers.remove(worker)
+                self._add_worker()
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an agent as an out-of-process MCP worker.")
+    parser.add_argument("--agent", required=True)
+    parser.add_argument("--config", default="{}", help="JSON engine configuration for the agent.")
+    parser.add_argument("--factory", default=None, help="Optional 'module:function' agent factory.")
+    args = parser.parse_args()
+    serve(args.agent, json.loads(args.config), args.factory)
@@ -1,17 +1,32 @@
 import json
 import time
 from tqdm.auto import tqdm
-import tiktoken
 from pinecone import Pinecone, ServerlessSpec
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 import re
 import textwrap
 import copy
 import os
+from functools import partial
 from commons.utils import initialize_clients
+from commons.chunking import chunk_text as fast_chunk_text, iter_chunks
+from commons.documents import DocumentSource
+from commons.snapshot import SnapshotWriter, load_snapshot, read_snapshot_info, iter_snapshot_entries
+from commons.namespaces import (
+    get_namespace_pointer, new_version, versioned_namespace, validate_namespace, garbage_collect)
+from commons.ingestion import (
+    pack_batches, content_hash, IngestionManifest, delete_vectors, UpsertEngine, enrich_chunk_metadata)
 
 
-def create_index(pc):
+MANIFEST_PATH = "ingestion_manifest.json"
+# One smoke query per logical namespace, run against a new index version before it is swapped in.
+SMOKE_QUERIES = {
+    "ContextLibrary": "technical explanation blueprint",
+    "KnowledgeStore": "Juno mission objectives",
+}
+
+
+def create_index(pc, clear_namespaces=True):
     EMBEDDING_DIM = 1536  # Dimension for text-embedding-3-small
     # --- Define Index and Namespaces (assuming this is already done) ---
     INDEX_NAME = 'genai-mas-mcp-ch3'
@@ -32,6 +47,8 @@ def create_index(pc):
             print("Waiting for index to be ready...")
             time.sleep(1)
         print("Index created successfully. It is new and empty.")
+    elif not clear_namespaces:
+        print(f"Index '{INDEX_NAME}' already exists. Keeping namespaces for incremental ingestion.")
     else:
         print(f"Index '{INDEX_NAME}' already exists. Clearing namespaces for a fresh start...")
         index = pc.Index(INDEX_NAME)
@@ -105,14 +122,12 @@ def data_preparation():
     # @title Updating the Data Loading and Processing Logic
     # -------------------------------------------------------------------------
     # Load all documents from our new directory
-    knowledge_base = {}
+    # Documents are streamed from disk during ingestion instead of being read up front,
+    # so memory stays bounded and chunking starts with the first file.
     doc_dir = "nasa_documents"
-    for filename in os.listdir(doc_dir):
-        if filename.endswith(".txt"):
-            with open(os.path.join(doc_dir, filename), 'r') as f:
-                knowledge_base[filename] = f.read()
+    knowledge_base = DocumentSource(doc_dir, suffix=".txt")
 
-    print(f"📚 Loaded {len(knowledge_base)} documents into the knowledge base.")  # We use sample data related to space exploration.
+    print(f"📚 Streaming knowledge base documents from '{doc_dir}'.")  # We use sample data related to space exploration.
 
     knowledge_data_raw = """
     Space exploration is the use of astronomy and space technology to explore outer space. The early era of space exploration was driven by a "Space Race" between the Soviet Union and the United States. The launch of the Soviet Union's Sputnik 1 in 1957, and the first Moon landing by the American Apollo 11 mission in 1969 are key landmarks.
@@ -154,17 +169,8 @@ def create_nasa_documents():
 
 def chunk_text(text, chunk_size=400, overlap=50):
     """Chunks text based on token count with overlap (Best practice for RAG)."""
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-    tokens = tokenizer.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), chunk_size - overlap):
-        chunk_tokens = tokens[i:i + chunk_size]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        # Basic cleanup
-        chunk_text = chunk_text.replace("\n", " ").strip()
-        if chunk_text:
-            chunks.append(chunk_text)
-    return chunks
+    # The cached, offset-based chunker avoids re-decoding every overlapping window.
+    return fast_chunk_text(text, chunk_size=chunk_size, overlap=overlap)
 
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
 def get_embeddings_batch(texts, client, model):
@@ -175,16 +181,30 @@ def get_embeddings_batch(texts, client, model):
     return [item.embedding for item in response.data]
 
 
-def upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base, client, embedding_model):
+def upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base, client, embedding_model, manifest,
+                 namespace_context="ContextLibrary", namespace_knowledge="KnowledgeStore", snapshot=None,
+                 summarize_chunks=False, save_manifest=True):
     # @title 6.Process and Upload Data
     # -------------------------------------------------------------------------
-    NAMESPACE_CONTEXT = "ContextLibrary"
-    NAMESPACE_KNOWLEDGE = "KnowledgeStore"
+    # Only new or changed content is embedded: the manifest remembers the content
+    # hash of every blueprint and document, and chunk IDs are derived from content.
+    # If a SnapshotWriter is given, every uploaded embedding is also written to it.
+    # With save_manifest=False the manifest is only updated in memory; blue/green
+    # rebuilds save it once the new version has been validated and swapped in.
+    NAMESPACE_CONTEXT = namespace_context
+    NAMESPACE_KNOWLEDGE = namespace_knowledge
     # --- 6.1. Context Library ---
     print(f"\nProcessing and uploading Context Library to namespace: {NAMESPACE_CONTEXT}")
 
+    known_blueprints = manifest.documents(NAMESPACE_CONTEXT)
+    context_documents = {}
     vectors_context = []
     for item in tqdm(context_blueprints):
+        item_hash = content_hash(item['description'] + item['blueprint'])
+        context_documents[item['id']] = {"hash": item_hash, "chunks": [item['id']]}
+        previous = known_blueprints.get(item['id'])
+        if previous and previous["hash"] == item_hash:
+            continue
         # We embed the DESCRIPTION (the intent)
         embedding = get_embeddings_batch([item['description']], client, embedding_model)[0]
         vectors_context.append({
@@ -199,60 +219,176 @@ def upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base,
 
     # Upsert data
     if vectors_context:
-        index.upsert(vectors=vectors_context, namespace=NAMESPACE_CONTEXT)
+        with UpsertEngine(index, NAMESPACE_CONTEXT) as upserter:
+            upserter.submit(vectors_context)
+        if snapshot:
+            snapshot.add(NAMESPACE_CONTEXT, vectors_context,
+                         [context_documents[vector["id"]]["hash"] for vector in vectors_context])
         print(f"Successfully uploaded {len(vectors_context)} context vectors.")
+    removed_blueprints = [bp_id for bp_id in known_blueprints if bp_id not in context_documents]
+    if removed_blueprints:
+        delete_vectors(index, removed_blueprints, NAMESPACE_CONTEXT)
+        print(f"Deleted {len(removed_blueprints)} removed context vectors.")
+    manifest.update(NAMESPACE_CONTEXT, context_documents)
 
     # --- 6.2. Knowledge Base ---
     print(f"\nProcessing and uploading Knowledge Base to namespace: {NAMESPACE_KNOWLEDGE}")
-    batch_size = 100
-    total_vectors_uploaded = 0
 
     # Chunk the knowledge data
     knowledge_chunks = chunk_text(knowledge_data_raw)
     print(f"Created {len(knowledge_chunks)} knowledge chunks.")
 
-    vectors_knowledge = []
-    batch_size = 100  # Process in batches
+    diff = manifest.diff(NAMESPACE_KNOWLEDGE, knowledge_base, partial(iter_chunks, with_token_counts=True))
 
-    for doc_name, doc_content in knowledge_base.items():
-        print(f"  - Processing document: {doc_name}")
-        # Chunk the document content
-        knowledge_chunks = chunk_text(doc_content)
-
-        # Process in batches
-        for i in tqdm(range(0, len(knowledge_chunks), batch_size), desc=f"  Uploading {doc_name}"):
-            batch_texts = knowledge_chunks[i:i + batch_size]
-            batch_embeddings = get_embeddings_batch(batch_texts,client, embedding_model)
+    # Pack chunks from all documents into full batches (bounded by item count and
+    # payload size) so small documents don't each cost their own API calls.
+    # Upserts run concurrently in byte-sized batches while the next batch is embedded.
+    with UpsertEngine(index, NAMESPACE_KNOWLEDGE) as upserter:
+        for batch in tqdm(pack_batches(diff.iter_records()), desc="  Uploading knowledge batches"):
+            batch_texts = [record["text"] for record in batch]
+            batch_embeddings = get_embeddings_batch(batch_texts, client, embedding_model)
 
             batch_vectors = []
-            for j, embedding in enumerate(batch_embeddings):
-                chunk_id = f"{doc_name}_chunk_{total_vectors_uploaded + j}"
-
-                # CRITICAL UPGRADE: Add the 'source' document name to the metadata
+            for record, embedding in zip(batch, batch_embeddings):
+                # CRITICAL UPGRADE: Add the 'source' document name to the metadata. Token counts
+                # and sanitization verdicts are precomputed here so agents don't redo them per query.
                 batch_vectors.append({
-                    "id": chunk_id,
+                    "id": record["id"],
                     "values": embedding,
-                    "metadata": {
-                        "text": batch_texts[j],
-                        "source": doc_name  # This is the key to verifiability
-                    }
+                    "metadata": enrich_chunk_metadata(record, summarize=summarize_chunks)
                 })
 
-            # Upsert the batch
-            index.upsert(vectors=batch_vectors, namespace=NAMESPACE_KNOWLEDGE)
-        total_vectors_uploaded += len(knowledge_chunks)
-
-    print(f"Successfully uploaded {len(knowledge_chunks)} knowledge vectors.")
+            upserter.submit(batch_vectors)
+            if snapshot:
+                snapshot.add(NAMESPACE_KNOWLEDGE, batch_vectors, [content_hash(text) for text in batch_texts])
+    upserter.report(NAMESPACE_KNOWLEDGE)
+    total_vectors_uploaded = upserter.vectors_uploaded
+
+    print(f"{diff.unchanged_documents} documents unchanged, {diff.changed_records} new or changed chunks, "
+          f"{len(diff.deleted_ids)} chunks to delete.")
+    # Vanished chunks are deleted only after their replacements are uploaded.
+    if diff.deleted_ids:
+        delete_vectors(index, diff.deleted_ids, NAMESPACE_KNOWLEDGE)
+    manifest.update(NAMESPACE_KNOWLEDGE, diff.documents)
+    if save_manifest:
+        manifest.save()
+
+    print(f"Successfully uploaded {total_vectors_uploaded} knowledge vectors "
+          f"and deleted {len(diff.deleted_ids)} stale ones.")
+
+
+def _discard_version(index, manifest, namespaces):
+    # A version that failed validation is never swapped in: forget and delete it,
+    # so the saved manifest never points at an orphaned namespace.
+    for namespace in namespaces:
+        manifest.drop(namespace)
+        try:
+            index.delete(delete_all=True, namespace=namespace)
+        except Exception as e:
+            print(f"Could not delete unvalidated namespace '{namespace}': {e}")
+
+
+def rebuild_blue_green(index, context_blueprints, knowledge_data_raw, knowledge_base, client, embedding_model,
+                       manifest, pointer, snapshot_dir=None, summarize_chunks=False):
+    """
+    Builds a complete new version of both namespaces next to the serving ones,
+    validates it, and swaps the pointer that the Context Engine reads. The old
+    version keeps serving throughout; after the swap it is kept for rollback and
+    for runs still reading it, and only older versions past their grace period are deleted.
+    A full rebuild embeds everything, so it can also write an embedding snapshot.
+    """
+    version = new_version()
+    targets = {alias: versioned_namespace(alias, version) for alias in SMOKE_QUERIES}
+    print(f"\nBuilding index version '{version}' into namespaces {list(targets.values())}")
+    snapshot = SnapshotWriter(snapshot_dir, embedding_model) if snapshot_dir else None
+    try:
+        upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base, client, embedding_model, manifest,
+                     namespace_context=targets["ContextLibrary"], namespace_knowledge=targets["KnowledgeStore"],
+                     snapshot=snapshot, summarize_chunks=summarize_chunks, save_manifest=False)
+    finally:
+        if snapshot:
+            snapshot.close()
+
+    aliases = list(targets)
+    smoke_vectors = get_embeddings_batch([SMOKE_QUERIES[alias] for alias in aliases], client, embedding_model)
+    for alias, vector in zip(aliases, smoke_vectors):
+        if not validate_namespace(index, targets[alias], manifest.vector_count(targets[alias]), [vector]):
+            print(f"🛑 Validation of '{targets[alias]}' failed. The serving namespaces were left untouched.")
+            _discard_version(index, manifest, targets.values())
+            return False
+
+    pointer.swap(targets)
+    for alias in aliases:
+        for retired in garbage_collect(index, pointer, alias):
+            manifest.drop(retired)
+    manifest.save()
+    print(f"✅ Index version '{version}' is now serving.")
+    return True
+
+
+def restore_from_snapshot(snapshot_dir, pc=None, index=None):
+    """
+    Rebuilds the index from an embedding snapshot into a fresh blue/green version,
+    without any embedding calls. Pass a LocalIndex as `index` to load offline.
+    """
+    info = read_snapshot_info(snapshot_dir)
+    manifest = IngestionManifest(MANIFEST_PATH, info["embedding_model"])
+    pointer = get_namespace_pointer()
+    index = index or create_index(pc, clear_namespaces=False)
+    version = new_version()
+    targets = {alias: versioned_namespace(alias, version) for alias in SMOKE_QUERIES}
+    counts = load_snapshot(snapshot_dir, index, namespace_map=targets)
+    for alias, namespace in targets.items():
+        if not validate_namespace(index, namespace, counts.get(namespace, 0)):
+            print(f"🛑 Validation of '{namespace}' failed. The serving namespaces were left untouched.")
+            _discard_version(index, manifest, targets.values())
+            return index
+
+    # Rebuild the manifest from the snapshot. Document hashes are unknown, so the next
+    # incremental run re-chunks each document once, but content-derived chunk IDs
+    # still match and nothing is re-embedded.
+    documents = {namespace: {} for namespace in targets.values()}
+    for entry in iter_snapshot_entries(snapshot_dir):
+        namespace = targets.get(entry["namespace"])
+        if namespace is None:
+            continue
+        if entry["namespace"] == "KnowledgeStore":
+            source = entry["metadata"]["source"]
+            documents[namespace].setdefault(source, {"hash": None, "chunks": []})["chunks"].append(entry["id"])
+        else:
+            documents[namespace][entry["id"]] = {"hash": entry["content_hash"], "chunks": [entry["id"]]}
+    for namespace, entries in documents.items():
+        manifest.update(namespace, entries)
+
+    pointer.swap(targets)
+    for alias in targets:
+        for retired in garbage_collect(index, pointer, alias):
+            manifest.drop(retired)
+    manifest.save()
+    print(f"✅ Restored {sum(counts.values())} vectors from '{snapshot_dir}' as version '{version}'.")
+    return index
 
 
-def pipeline():
+def pipeline(rebuild=False, snapshot_dir=None, summarize_chunks=False):
     EMBEDDING_MODEL = "text-embedding-v2"
     client, pc = initialize_clients()
     # 创建NASA 文档
     create_nasa_documents()
-    index = create_index(pc)
+    manifest = IngestionManifest(MANIFEST_PATH, EMBEDDING_MODEL)
+    pointer = get_namespace_pointer()
+    # Namespaces are never cleared in place: full rebuilds go to a fresh version.
+    index = create_index(pc, clear_namespaces=False)
     context_blueprints, knowledge_data_raw, knowledge_base = data_preparation()
-    upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base, client, EMBEDDING_MODEL)
+
+    serving = {alias: pointer.resolve(alias) for alias in SMOKE_QUERIES}
+    # Without a manifest we can't know what the serving namespaces hold, so rebuild them.
+    if rebuild or not all(manifest.documents(namespace) for namespace in serving.values()):
+        rebuild_blue_green(index, context_blueprints, knowledge_data_raw, knowledge_base, client, EMBEDDING_MODEL,
+                           manifest, pointer, snapshot_dir=snapshot_dir, summarize_chunks=summarize_chunks)
+    else:
+        upsert_index(index, context_blueprints, knowledge_data_raw, knowledge_base, client, EMBEDDING_MODEL, manifest,
+                     namespace_context=serving["ContextLibrary"], namespace_knowledge=serving["KnowledgeStore"],
+                     summarize_chunks=summarize_chunks)
 
 
 if __name__ == "__main__":
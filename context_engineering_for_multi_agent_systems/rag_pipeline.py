@@ -1,9 +1,10 @@
 import json
 import time
 from tqdm.auto import tqdm
-import tiktoken
 from pinecone import Pinecone, ServerlessSpec
 from commons.utils import initialize_clients
+from commons.chunking import chunk_text as fast_chunk_text
+from commons.ingestion import UpsertEngine
 
 
 def create_index(pc):
@@ -112,17 +113,8 @@ def data_preparation():
 
 def chunk_text(text, chunk_size=400, overlap=50):
     """Chunks text based on token count with overlap (Best practice for RAG)."""
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-    tokens = tokenizer.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), chunk_size - overlap):
-        chunk_tokens = tokens[i:i + chunk_size]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        # Basic cleanup
-        chunk_text = chunk_text.replace("\n", " ").strip()
-        if chunk_text:
-            chunks.append(chunk_text)
-    return chunks
+    # The cached, offset-based chunker avoids re-decoding every overlapping window.
+    return fast_chunk_text(text, chunk_size=chunk_size, overlap=overlap)
 
 
 def get_embeddings_batch(texts, client, model):
@@ -158,7 +150,8 @@ def upsert_index(index, context_blueprints, knowledge_data_raw, client, embeddin
 
     # Upsert data
     if vectors_context:
-        index.upsert(vectors=vectors_context, namespace=NAMESPACE_CONTEXT)
+        with UpsertEngine(index, NAMESPACE_CONTEXT) as upserter:
+            upserter.submit(vectors_context)
         print(f"Successfully uploaded {len(vectors_context)} context vectors.")
 
     # --- 6.2. Knowledge Base ---
@@ -168,25 +161,25 @@ def upsert_index(index, context_blueprints, knowledge_data_raw, client, embeddin
     knowledge_chunks = chunk_text(knowledge_data_raw)
     print(f"Created {len(knowledge_chunks)} knowledge chunks.")
 
-    vectors_knowledge = []
-    batch_size = 100  # Process in batches
-
-    for i in tqdm(range(0, len(knowledge_chunks), batch_size)):
-        batch_texts = knowledge_chunks[i:i + batch_size]
-        batch_embeddings = get_embeddings_batch(batch_texts, client, embedding_model)
-
-        batch_vectors = []
-        for j, embedding in enumerate(batch_embeddings):
-            chunk_id = f"knowledge_chunk_{i + j}"
-            batch_vectors.append({
-                "id": chunk_id,
-                "values": embedding,
-                "metadata": {
-                    "text": batch_texts[j]
-                }
-            })
-        # Upsert the batch
-        index.upsert(vectors=batch_vectors, namespace=NAMESPACE_KNOWLEDGE)
+    batch_size = 100  # Embed in batches; upserts are sized by payload and run concurrently
+
+    with UpsertEngine(index, NAMESPACE_KNOWLEDGE) as upserter:
+        for i in tqdm(range(0, len(knowledge_chunks), batch_size)):
+            batch_texts = knowledge_chunks[i:i + batch_size]
+            batch_embeddings = get_embeddings_batch(batch_texts, client, embedding_model)
+
+            batch_vectors = []
+            for j, embedding in enumerate(batch_embeddings):
+                chunk_id = f"knowledge_chunk_{i + j}"
+                batch_vectors.append({
+                    "id": chunk_id,
+                    "values": embedding,
+                    "metadata": {
+                        "text": batch_texts[j]
+                    }
+                })
+            upserter.submit(batch_vectors)
+    upserter.report(NAMESPACE_KNOWLEDGE)
 
     print(f"Successfully uploaded {len(knowledge_chunks)} knowledge vectors.")
 
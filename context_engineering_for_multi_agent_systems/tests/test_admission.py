@@ -0,0 +1,45 @@
+import pytest
+
+from commons.admission import AdmissionController, AdmissionRejected
+
+
+def test_cancel_reports_whether_it_withdrew():
+    controller = AdmissionController(max_concurrent=1)
+    running = controller.submit("first goal")
+    waiting = controller.submit("second goal")
+    assert running.status == "admitted" and waiting.status == "waiting"
+    assert controller.cancel(waiting) is True
+    assert controller.cancel(running) is False
+    controller.release(running)
+    assert sum(controller.status()["running"].values()) == 0
+
+
+def test_admitted_after_timeout_is_not_leaked(monkeypatch):
+    controller = AdmissionController(max_concurrent=1)
+    blocker = controller.submit("blocker")
+    original_cancel = controller.cancel
+
+    def release_then_cancel(ticket):
+        # The slot frees up and the ticket is admitted between the timeout and cancel().
+        controller.release(blocker)
+        return original_cancel(ticket)
+
+    monkeypatch.setattr(controller, "cancel", release_then_cancel)
+    with controller.admit("late goal", timeout=0.01) as ticket:
+        assert ticket.status == "admitted"
+    assert sum(controller.status()["running"].values()) == 0
+    # The slot is free again for the next goal.
+    with controller.admit("next goal", timeout=1):
+        pass
+
+
+def test_timed_out_ticket_is_withdrawn():
+    controller = AdmissionController(max_concurrent=1)
+    blocker = controller.submit("blocker")
+    with pytest.raises(AdmissionRejected, match="Timed out"):
+        with controller.admit("late goal", timeout=0.01):
+            pass
+    assert sum(controller.status()["waiting"].values()) == 0
+    controller.release(blocker)
+    with controller.admit("next goal", timeout=1) as ticket:
+        assert ticket.status == "admitted"
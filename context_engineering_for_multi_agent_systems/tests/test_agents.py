@@ -0,0 +1,35 @@
+import pytest
+
+from commons.agents import retrieve_for_sub_queries, split_topic_query
+
+
+@pytest.mark.parametrize("topic", [
+    "Mars rovers and Juno",
+    "The history of space telescopes and their design",
+    "Research and development of the Apollo 11 guidance computer",
+    "Juno mission technology and results",
+    "木星探测的历史和成果",
+    "朱诺号任务及其成果",
+    "Juno, its instruments",
+])
+def test_noun_phrases_and_short_lists_stay_whole(topic):
+    assert split_topic_query(topic) == [topic]
+
+
+@pytest.mark.parametrize("topic, parts", [
+    ("Mars rovers, Juno and Apollo 11", ["Mars rovers", "Juno", "Apollo 11"]),
+    ("Juno, Cassini, and Voyager 2", ["Juno", "Cassini", "Voyager 2"]),
+    ("朱诺号、卡西尼号和旅行者2号", ["朱诺号", "卡西尼号", "旅行者2号"]),
+    ("朱诺号、卡西尼号、和平号空间站", ["朱诺号", "卡西尼号", "和平号空间站"]),
+    ("Juno's instruments; Cassini's findings at Saturn", ["Juno's instruments", "Cassini's findings at Saturn"]),
+])
+def test_explicit_lists_and_clauses_split_without_copying(topic, parts):
+    assert split_topic_query(topic) == [topic] + parts
+
+
+def test_sub_queries_are_capped():
+    assert split_topic_query("A, B, C, D, E", max_sub_queries=3) == ["A, B, C, D, E", "A", "B"]
+
+
+def test_no_sub_queries_retrieves_nothing():
+    assert retrieve_for_sub_queries([], index=None, client=None, embedding_model="m", namespace="n") == []
@@ -0,0 +1,16 @@
+from commons.batch import build_graph
+from commons.blobstore import BlobStore
+from commons.plans import compile_plan
+from commons.registry import AGENT_TOOLKIT
+
+
+class _StubAgents:
+    def get(self, agent_name):
+        return lambda message: {"content": {"blueprint": "{}"}}
+
+
+def test_node_runs_outside_a_traced_run():
+    plan = [{"step": 1, "agent": "Librarian", "input": {"intent_query": "casual"}}]
+    nodes, _ = build_graph([compile_plan(plan, AGENT_TOOLKIT)])
+    nodes[0].run(_StubAgents(), BlobStore())
+    assert nodes[0].output == {"blueprint": "{}"}
@@ -0,0 +1,21 @@
+from commons.documents import FileDocument
+
+
+def test_windows_without_whitespace_keep_utf8_characters(tmp_path):
+    # 3-byte characters and a window size that is not a multiple of 3.
+    text = "火星探测器" * 400 + "é" * 301 + "🚀" * 101
+    path = tmp_path / "long.txt"
+    path.write_bytes(text.encode("utf-8"))
+    segments = list(FileDocument("long.txt", str(path), window_bytes=100).iter_segments())
+    assert len(segments) > 1
+    assert "".join(segments) == text
+    assert all("�" not in segment for segment in segments)
+
+
+def test_windows_cut_at_whitespace(tmp_path):
+    text = " ".join(f"word{i}" for i in range(500))
+    path = tmp_path / "words.txt"
+    path.write_text(text, encoding="utf-8")
+    segments = list(FileDocument("words.txt", str(path), window_bytes=64).iter_segments())
+    assert "".join(segments) == text
+    assert all(segment.endswith(" ") for segment in segments[:-1])
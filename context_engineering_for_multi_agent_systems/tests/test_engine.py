@@ -0,0 +1,11 @@
+from benchmarks.fakes import FakeOpenAI
+from commons.engine import ExecutionTrace, plan_and_compile
+from commons.registry import AGENT_TOOLKIT
+
+
+def test_plan_and_compile_outside_a_traced_run():
+    goal = "Write a short overview of the Juno mission."
+    trace = ExecutionTrace(goal)
+    compiled = plan_and_compile(trace, goal, AGENT_TOOLKIT, FakeOpenAI(dimension=8), "qwen-plus")
+    assert compiled is not None, trace.status
+    assert len(compiled) == len(trace.plan)
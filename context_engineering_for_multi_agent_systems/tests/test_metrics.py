@@ -0,0 +1,27 @@
+from benchmarks.fakes import FakeAPIError, FakeRateLimitError
+from commons.metrics import error_kind
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def test_rate_limits_are_classified_by_status_or_type():
+    assert error_kind(FakeRateLimitError()) == "rate_limited"
+    assert error_kind(RateLimitError("slow down")) == "rate_limited"
+
+
+def test_429_in_the_message_is_not_a_rate_limit():
+    assert error_kind(FakeAPIError("request req_4291 failed after 1429 tokens", status_code=500)) == "error"
+    assert error_kind(ValueError("model qwen-429-preview not found")) == "error"
+
+
+def test_a_retried_429_counts_once_toward_saturation():
+    from commons import metrics
+    from commons.admission import RateLimitMonitor
+
+    before = RateLimitMonitor.rate_limited_total()
+    # What call_llm_robust records for one 429 followed by a retry.
+    metrics.LLM_ERRORS.inc(model="test-model", kind=error_kind(FakeRateLimitError()))
+    metrics.RETRIES.inc(function="call_llm_robust", kind=error_kind(FakeRateLimitError()))
+    assert RateLimitMonitor.rate_limited_total() - before == 1
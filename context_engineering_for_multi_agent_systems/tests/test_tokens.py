@@ -0,0 +1,30 @@
+import pytest
+
+from commons import tokens
+
+
+@pytest.fixture
+def estimated_counts():
+    tokens.use_exact_counts(False)
+    yield
+    tokens.use_exact_counts(True)
+
+
+def test_split_text_without_tokenizer(estimated_counts, monkeypatch):
+    monkeypatch.setattr(tokens, "chunk_text", lambda *args, **kwargs: pytest.fail("tokenizer used"))
+    text = " ".join(f"word{i}" for i in range(2000)) + " " + "木星" * 500
+    pieces = tokens.split_text(text, 100)
+    assert len(pieces) > 1
+    assert "".join(pieces) == text
+    assert all(tokens.estimate_tokens(piece) <= 100 for piece in pieces)
+    # ASCII pieces end at a word boundary.
+    assert all(piece.endswith(" ") for piece in pieces if piece.isascii())
+
+    overlapping = tokens.split_text(text, 100, overlap=10)
+    assert len(overlapping) > len(pieces)
+    assert all(tokens.estimate_tokens(piece) <= 100 and piece in text for piece in overlapping)
+    assert overlapping[0] == pieces[0] and text.endswith(overlapping[-1])
+
+
+def test_split_text_short_text_is_one_piece(estimated_counts):
+    assert tokens.split_text("a short text", 100, overlap=10) == ["a short text"]
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from commons.mcp import MCPMessage
+from commons.registry import AgentRegistry
+from commons.workers import AgentWorker, AgentWorkerPool, WorkerError
+
+FACTORY = "tests.worker_agents:echo_factory"
+CONFIG = {"index_name": "test-index"}
+
+
+def request(**content):
+    return MCPMessage("Engine", content)
+
+
+@pytest.fixture
+def pool():
+    pool = AgentWorkerPool("Echo", 1, CONFIG, FACTORY, timeout=5)
+    yield pool
+    pool.close()
+
+
+def test_round_trip():
+    worker = AgentWorker("Echo", CONFIG, FACTORY)
+    try:
+        reply = worker.call(request(text="héllo", items=[1, 2]))
+        assert isinstance(reply, MCPMessage)
+        assert reply["sender"] == "Echo"
+        assert reply["content"]["echo"] == {"text": "héllo", "items": [1, 2]}
+        assert reply["content"]["config"] == CONFIG
+        # The worker stays up between requests.
+        assert worker.call(request(text="again"))["content"]["echo"] == {"text": "again"}
+        assert worker.alive()
+    finally:
+        worker.close()
+    assert not worker.alive()
+
+
+def test_agent_error_keeps_worker(pool):
+    with pytest.raises(WorkerError, match="asked to fail"):
+        pool(request(action="fail"))
+    assert pool(request(text="ok"))["content"]["echo"] == {"text": "ok"}
+    assert len(pool._workers) == 1
+
+
+def test_crashed_worker_is_replaced(pool):
+    first_pid = pool(request())["content"]["pid"]
+    with pytest.raises(WorkerError, match="exited with code 3"):
+        pool(request(action="crash"))
+    assert len(pool._workers) == 1
+    reply = pool(request(text="after crash"))
+    assert reply["content"]["echo"] == {"text": "after crash"}
+    assert reply["content"]["pid"] != first_pid
+
+
+def test_hung_worker_is_killed_and_replaced():
+    pool = AgentWorkerPool("Echo", 1, CONFIG, FACTORY, timeout=1)
+    try:
+        hung_worker = pool._workers[0]
+        started = time.monotonic()
+        with pytest.raises(WorkerError, match="timed out"):
+            pool(request(action="hang"))
+        assert time.monotonic() - started < 10
+        assert not hung_worker.alive()
+        assert pool._workers and pool._workers[0] is not hung_worker
+        assert pool(request(text="after hang"))["content"]["echo"] == {"text": "after hang"}
+    finally:
+        pool.close()
+
+
+def test_pool_needs_a_worker():
+    with pytest.raises(ValueError, match="at least one worker"):
+        AgentWorkerPool("Echo", 0, CONFIG, FACTORY)
+
+
+def test_bound_agents_send_the_run_context():
+    registry = AgentRegistry()
+    registry.enable_workers({"Researcher": 1}, CONFIG, FACTORY, timeout=5)
+    try:
+        bound = registry.bind(client=object(), index=object(), generation_model="gen-model",
+                              embedding_model="embed-model", namespace_context="ContextLibrary__v1",
+                              namespace_knowledge="KnowledgeStore__v2")
+        reply = bound.get("Researcher")(request(topic_query="Juno"))
+        assert reply["content"]["context"] == {
+            "generation_model": "gen-model", "embedding_model": "embed-model",
+            "namespace_context": "ContextLibrary__v1", "namespace_knowledge": "KnowledgeStore__v2"}
+    finally:
+        registry.disable_workers()
@@ -0,0 +1,23 @@
+# Agent factories for the worker tests, loaded inside the worker subprocesses
+# through `--factory tests.worker_agents:<name>`.
+import os
+import time
+
+from commons.mcp import MCPMessage
+
+
+def echo_factory(agent_name, config):
+    """Answers with the request content and context; {"action": "crash"} or "hang" misbehave on purpose."""
+
+    def run(mcp_message, context):
+        action = mcp_message["content"].get("action")
+        if action == "crash":
+            os._exit(3)
+        if action == "hang":
+            time.sleep(3600)
+        if action == "fail":
+            raise ValueError("asked to fail")
+        return MCPMessage(agent_name, {"echo": mcp_message["content"], "pid": os.getpid(),
+                                       "config": config, "context": context})
+
+    return run
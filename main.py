@@ -1,5 +1,26 @@
+import os
+import sys
+
+# The engine lives in the project directory and is imported from there (`commons.*`).
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "context_engineering_for_multi_agent_systems")
+
+
+def offline_clients():
+    """
+    Seeded in-process stand-ins for the clients (benchmarks/fakes.py), with no
+    network access. Returns (client, pc, config).
+    """
+    from benchmarks.run import INDEX_NAME, build_services, parse_args
+    client, pc = build_services(parse_args(["--llm-ms", "0", "--embed-ms", "0", "--embed-item-ms", "0",
+                                            "--query-ms", "0"]))
+    return client, pc, {"index_name": INDEX_NAME}
+
+
 def main():
-    print("Hello from agent-ai!")
+    """Starts the Context Engine service; see commons/service.py for options (e.g. --offline, --port)."""
+    sys.path.insert(0, PROJECT_DIR)
+    from commons.service import main as serve_main
+    serve_main(offline_clients=offline_clients)
 
 
 if __name__ == "__main__":